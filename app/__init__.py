@@ -1,4 +1,5 @@
 import os
+import click
 from flask import Flask, render_template
 from flask_babel import Babel
 import datetime
@@ -6,7 +7,7 @@ from app.config import config
 from app.extensions import init_extensions, db
 
 # Importar modelos para que SQLAlchemy los reconozca
-from app.models import usuario, tipos_usuario, centro_medico
+from app.models import usuario, tipos_usuario, centro_medico, estadistica, busqueda
 
 def create_app(config_name=None):
     """
@@ -51,16 +52,51 @@ def create_app(config_name=None):
     
     # Crear datos iniciales si es necesario
     with app.app_context():
-        from app.utils.inicializador import crear_datos_iniciales
+        from app.utils.inicializador import (crear_datos_iniciales, agregar_columnas_faltantes,
+                                             crear_indices_faltantes)
         db.create_all()  # Crear tablas
+        agregar_columnas_faltantes()  # Columnas nuevas en tablas existentes
+        crear_indices_faltantes()  # Índices nuevos en tablas existentes
         crear_datos_iniciales()  # Crear datos necesarios
     
     # Configurar jinja
     configure_jinja(app)
     
+    # Los hilos verdes solo se inician en el proceso que sirve solicitudes
+    if not app.config.get('TESTING') and sirve_solicitudes():
+        # Programador de recordatorios, si está habilitado
+        # (alternativa al proceso dedicado `flask enviar-recordatorios`)
+        if app.config.get('REMINDER_SCHEDULER_ENABLED'):
+            from app.utils.recordatorios import iniciar_programador
+            iniciar_programador(app)
+        
+        # Escritura de la auditoría de accesos por lotes
+        from app.utils.auditoria import registro_accesos
+        registro_accesos.iniciar(app)
+    
     return app
 
 
+def sirve_solicitudes():
+    """
+    Indica si la aplicación se crea para servir solicitudes.
+    
+    Bajo la línea de comandos de Flask (que define FLASK_RUN_FROM_CLI) solo
+    `flask run` sirve solicitudes; los demás comandos (enviar-recordatorios,
+    crear-indices, etc.) terminan al completar su tarea y no deben iniciar el
+    programador ni la escritura periódica de la auditoría. Fuera de la línea
+    de comandos (run.py o un servidor WSGI) siempre es True.
+    
+    Returns:
+        bool: True si el proceso sirve solicitudes
+    """
+    if os.environ.get('FLASK_RUN_FROM_CLI') != 'true':
+        return True
+    
+    contexto = click.get_current_context(silent=True)
+    return contexto is not None and contexto.info_name == 'run'
+
+
 def register_blueprints(app):
     """
     Registra todos los blueprints de la aplicación.
@@ -120,11 +156,25 @@ def register_commands(app):
     Args:
         app: Aplicación Flask
     """
-    from app.commands import create_superuser_command, reset_db_command
+    from app.commands.commands import (create_superuser_command, reset_db_command,
+                                       reconstruir_franjas_command, registrar_feriado_command,
+                                       reconciliar_capacidad_command, enviar_recordatorios_command,
+                                       crear_indices_command, recalcular_estadisticas_command,
+                                       exportar_command, reconstruir_busqueda_command,
+                                       completar_mascaras_roles_command)
     
     # Registrar comandos
     app.cli.add_command(create_superuser_command)
     app.cli.add_command(reset_db_command)
+    app.cli.add_command(reconstruir_franjas_command)
+    app.cli.add_command(registrar_feriado_command)
+    app.cli.add_command(reconciliar_capacidad_command)
+    app.cli.add_command(enviar_recordatorios_command)
+    app.cli.add_command(crear_indices_command)
+    app.cli.add_command(recalcular_estadisticas_command)
+    app.cli.add_command(exportar_command)
+    app.cli.add_command(reconstruir_busqueda_command)
+    app.cli.add_command(completar_mascaras_roles_command)
 
 
 def register_shell_context(app):
@@ -96,4 +96,253 @@ def reset_db_command(yes):
         
         click.echo(click.style('Base de datos reiniciada exitosamente.', fg='green'))
     except Exception as e:
-        click.echo(click.style(f"Error: {str(e)}", fg='red'))
\ No newline at end of file
+        click.echo(click.style(f"Error: {str(e)}", fg='red'))
+
+@click.command('reconstruir-franjas')
+@click.option('--desde', type=click.DateTime(formats=['%Y-%m-%d']), default=None,
+              help='Reconstruir solo disponibilidades desde esta fecha (YYYY-MM-DD)')
+@with_appcontext
+def reconstruir_franjas_command(desde):
+    """Reconstruye el índice de franjas horarias a partir de disponibilidades y citas."""
+    from app.models.cita import Cita, Disponibilidad, FranjaHoraria, ESTADOS_ACTIVOS
+    
+    try:
+        query = Disponibilidad.query
+        citas_query = Cita.query.filter(Cita.estado.in_(ESTADOS_ACTIVOS))
+        franjas_query = FranjaHoraria.query
+        
+        if desde:
+            query = query.filter(Disponibilidad.fecha >= desde.date())
+            citas_query = citas_query.filter(Cita.fecha_hora >= desde)
+            franjas_query = franjas_query.filter(FranjaHoraria.fecha >= desde.date())
+        
+        # Eliminar el índice existente para el rango
+        franjas_query.delete(synchronize_session=False)
+        
+        # Cargar todas las citas activas en una sola consulta
+        citas_ocupadas = {}
+        for cita in citas_query.all():
+            citas_ocupadas.setdefault((cita.medico_id, cita.centro_medico_id), {})[cita.fecha_hora] = cita
+        
+        total = 0
+        for disponibilidad in query.all():
+            franjas = disponibilidad.generar_franjas(
+                citas_ocupadas.get((disponibilidad.medico_id, disponibilidad.centro_medico_id)))
+            total += len(franjas)
+        
+        db.session.commit()
+        
+        click.echo(click.style(f'Índice reconstruido: {total} franjas horarias.', fg='green'))
+    except Exception as e:
+        db.session.rollback()
+        click.echo(click.style(f"Error: {str(e)}", fg='red'))
+
+
+@click.command('registrar-feriado')
+@click.argument('fecha', type=click.DateTime(formats=['%Y-%m-%d']))
+@click.option('--motivo', default=None, help='Descripción del feriado')
+@click.option('--centro-id', type=int, default=None, help='Aplicar solo a este centro médico')
+@with_appcontext
+def registrar_feriado_command(fecha, motivo, centro_id):
+    """Registra un feriado que bloquea la agenda de todos los médicos."""
+    from app.models.tipos_usuario import ExcepcionHorario
+    
+    try:
+        existente = ExcepcionHorario.query.filter_by(
+            medico_id=None,
+            centro_medico_id=centro_id,
+            fecha=fecha.date(),
+            tipo='feriado'
+        ).first()
+        
+        if existente:
+            click.echo(click.style('Ya existe un feriado registrado para esa fecha.', fg='yellow'))
+            return
+        
+        db.session.add(ExcepcionHorario(
+            medico_id=None,
+            centro_medico_id=centro_id,
+            fecha=fecha.date(),
+            tipo='feriado',
+            motivo=motivo
+        ))
+        db.session.commit()
+        
+        click.echo(click.style(f'Feriado registrado para el {fecha.date()}.', fg='green'))
+    except Exception as e:
+        db.session.rollback()
+        click.echo(click.style(f"Error: {str(e)}", fg='red'))
+
+
+@click.command('reconciliar-capacidad')
+@click.option('--desde', type=click.DateTime(formats=['%Y-%m-%d']), default=None,
+              help='Reconstruir solo los contadores desde esta fecha (YYYY-MM-DD)')
+@with_appcontext
+def reconciliar_capacidad_command(desde):
+    """Reconstruye los contadores de citas por médico y día a partir de las citas."""
+    from collections import Counter
+    from sqlalchemy import insert
+    from app.models.cita import Cita, CapacidadDiaria
+    
+    try:
+        citas_query = db.session.query(Cita.medico_id, Cita.fecha_hora).filter(Cita.estado != 'cancelada')
+        capacidad_query = CapacidadDiaria.query
+        
+        if desde:
+            citas_query = citas_query.filter(Cita.fecha_hora >= desde)
+            capacidad_query = capacidad_query.filter(CapacidadDiaria.fecha >= desde.date())
+        
+        # Eliminar los contadores existentes para el rango
+        capacidad_query.delete(synchronize_session=False)
+        
+        contadores = Counter(
+            (medico_id, fecha_hora.date())
+            for medico_id, fecha_hora in citas_query.yield_per(1000)
+        )
+        
+        if contadores:
+            db.session.execute(insert(CapacidadDiaria), [
+                {'medico_id': medico_id, 'fecha': fecha, 'citas_agendadas': cantidad}
+                for (medico_id, fecha), cantidad in contadores.items()
+            ])
+        
+        db.session.commit()
+        
+        click.echo(click.style(f'Capacidad reconciliada: {len(contadores)} días de agenda.', fg='green'))
+    except Exception as e:
+        db.session.rollback()
+        click.echo(click.style(f"Error: {str(e)}", fg='red'))
+
+
+@click.command('enviar-recordatorios')
+@click.option('--una-vez', is_flag=True, help='Realizar una sola pasada y terminar')
+@click.option('--intervalo', type=int, default=None, help='Segundos entre pasadas')
+@click.option('--lote', type=int, default=None, help='Cantidad de citas por lote')
+@with_appcontext
+def enviar_recordatorios_command(una_vez, intervalo, lote):
+    """Envía los recordatorios de citas próximas (24 horas y 1 hora antes)."""
+    import time
+    import uuid
+    from flask import current_app
+    from app.utils.recordatorios import procesar_recordatorios, metricas_recordatorios
+    
+    intervalo = intervalo or current_app.config.get('REMINDER_INTERVAL_SECONDS', 60)
+    trabajador = uuid.uuid4().hex
+    
+    click.echo(f'Programador de recordatorios iniciado ({trabajador}).')
+    
+    while True:
+        try:
+            resultado = procesar_recordatorios(trabajador, tamano=lote)
+            metricas = metricas_recordatorios.resumen()
+            
+            click.echo(
+                f"[{datetime.now():%Y-%m-%d %H:%M:%S}] "
+                + ', '.join(f"{tipo}: {r['enviados']} enviados, {r['fallidos']} fallidos"
+                            for tipo, r in resultado.items())
+                + f" | {metricas['enviados_por_minuto']}/min, retraso {metricas['ultimo_retraso_segundos']}s"
+            )
+        except Exception as e:
+            db.session.rollback()
+            click.echo(click.style(f"Error: {str(e)}", fg='red'))
+        
+        if una_vez:
+            return
+        
+        time.sleep(intervalo)
+
+
+@click.command('crear-indices')
+@with_appcontext
+def crear_indices_command():
+    """Crea los índices declarados en los modelos que aún no existen en la base de datos."""
+    from app.utils.inicializador import crear_indices_faltantes
+    
+    try:
+        creados = crear_indices_faltantes()
+        for nombre in creados:
+            click.echo(f'Índice creado: {nombre}')
+        
+        click.echo(click.style(f'{len(creados)} índices creados.', fg='green'))
+    except Exception as e:
+        click.echo(click.style(f"Error: {str(e)}", fg='red'))
+
+
+@click.command('recalcular-estadisticas')
+@click.option('--desde', type=click.DateTime(formats=['%Y-%m-%d']), default=None,
+              help='Recalcular solo desde esta fecha (YYYY-MM-DD)')
+@with_appcontext
+def recalcular_estadisticas_command(desde):
+    """Reconstruye los resúmenes diarios de estadísticas a partir de citas, consultas y usuarios."""
+    from app.models.estadistica import recalcular_estadisticas
+    
+    try:
+        filas, dias = recalcular_estadisticas(desde)
+        db.session.commit()
+        
+        click.echo(click.style(
+            f'Estadísticas recalculadas: {filas} filas de citas y {dias} días de registros.',
+            fg='green'))
+    except Exception as e:
+        db.session.rollback()
+        click.echo(click.style(f"Error: {str(e)}", fg='red'))
+
+
+@click.command('exportar')
+@click.argument('tipo', type=click.Choice(['citas', 'consultas']))
+@click.option('--formato', type=click.Choice(['csv', 'ndjson']), default='csv', help='Formato de salida')
+@click.option('--desde', type=click.DateTime(formats=['%Y-%m-%d']), default=None,
+              help='Fecha inicial de las citas (YYYY-MM-DD)')
+@click.option('--hasta', type=click.DateTime(formats=['%Y-%m-%d']), default=None,
+              help='Fecha final de las citas, inclusive (YYYY-MM-DD)')
+@click.option('--estado', default=None, help='Estado de las citas')
+@click.option('--centro-id', type=int, default=None, help='ID del centro médico')
+@click.option('--salida', type=click.File('w', encoding='utf-8'), default='-',
+              help='Archivo de salida (por defecto, la salida estándar)')
+@with_appcontext
+def exportar_command(tipo, formato, desde, hasta, estado, centro_id, salida):
+    """Exporta citas o consultas en CSV o NDJSON para reportes."""
+    from app.utils.exportacion import exportar
+    
+    try:
+        for fragmento in exportar(tipo, formato,
+                                  centro_id=centro_id,
+                                  fecha_inicio=desde.date() if desde else None,
+                                  fecha_fin=hasta.date() if hasta else None,
+                                  estado=estado):
+            salida.write(fragmento)
+    except Exception as e:
+        click.echo(click.style(f"Error: {str(e)}", fg='red'), err=True)
+
+
+@click.command('reconstruir-busqueda')
+@with_appcontext
+def reconstruir_busqueda_command():
+    """Crea el índice de búsqueda de texto completo si no existe y lo reconstruye."""
+    from app.models.busqueda import reconstruir_indice
+    from app.utils.busqueda import reiniciar_deteccion_fts
+    
+    try:
+        usuarios = reconstruir_indice()
+        db.session.commit()
+        reiniciar_deteccion_fts(db.engine)
+        
+        click.echo(click.style(f'Índice de búsqueda reconstruido: {usuarios} usuarios.', fg='green'))
+    except Exception as e:
+        db.session.rollback()
+        click.echo(click.style(f"Error: {str(e)}", fg='red'))
+
+
+@click.command('completar-mascaras-roles')
+@with_appcontext
+def completar_mascaras_roles_command():
+    """Calcula la máscara de roles de los usuarios que aún no la tienen."""
+    from app.utils.inicializador import completar_mascaras_roles
+    
+    try:
+        actualizados = completar_mascaras_roles()
+        db.session.commit()
+        click.echo(click.style(f'Máscaras de roles completadas: {actualizados} usuarios.', fg='green'))
+    except Exception as e:
+        db.session.rollback()
+        click.echo(click.style(f"Error: {str(e)}", fg='red'))
@@ -41,6 +41,31 @@ class Config:
     
     # Límites de datos
     MAX_APPOINTMENTS_PER_DOCTOR_DAY = 20  # Máximo de citas por día para un médico
+    SLOT_HOLD_SECONDS = 300  # Tiempo de retención de un horario durante el agendamiento
+    PATIENTS_PER_PAGE = 50  # Pacientes por página en el listado del médico
+    LIST_PAGE_SIZE = 50  # Filas por página en los listados paginados por clave
+    SEARCH_FALLBACK_CANDIDATES = 500  # Máximo de coincidencias puntuadas sin índice de texto completo
+    PATIENT_HISTORY_LIMIT = 50  # Filas por página de citas, recetas y órdenes en la ficha del paciente
+    
+    # Recordatorios de citas
+    REMINDER_SCHEDULER_ENABLED = os.environ.get('REMINDER_SCHEDULER_ENABLED', 'false').lower() in ['true', 'on', '1']
+    REMINDER_INTERVAL_SECONDS = 60  # Frecuencia de revisión de citas próximas
+    REMINDER_BATCH_SIZE = 100  # Citas reclamadas y enviadas por lote (una conexión SMTP por lote)
+    REMINDER_CLAIM_SECONDS = 600  # Tiempo tras el cual un reclamo sin completar puede retomarse
+    
+    # Hash de contraseñas
+    PASSWORD_HASH_METHOD = 'pbkdf2:sha256:600000'  # Los hashes con otro método se actualizan al iniciar sesión
+    PASSWORD_HASH_MAX_CONCURRENT = 4  # Cálculos de hash simultáneos por proceso
+    PASSWORD_HASH_QUEUE_TIMEOUT = 5  # Segundos de espera por un lugar antes de rechazar el inicio de sesión
+    
+    # Auditoría de accesos (escritura diferida por lotes)
+    AUDIT_BATCH_SIZE = 100  # Accesos encolados que fuerzan una escritura inmediata
+    AUDIT_FLUSH_SECONDS = 5  # Intervalo máximo entre escrituras de la cola
+    AUDIT_FALLBACK_FILE = os.environ.get('AUDIT_FALLBACK_FILE')  # Respaldo local si la base de datos falla (por defecto en instance/; se agrega el pid)
+    
+    # Caché de los paneles de administración
+    DASHBOARD_CACHE_SECONDS = 60  # Vigencia máxima de los indicadores en caché
+    IDENTITY_CACHE_SECONDS = 30  # Vigencia del usuario autenticado en caché (0 para desactivar)
     
     # Rutas protegidas
     LOGIN_REQUIRED_PATHS = ['/paciente', '/medico', '/admin']
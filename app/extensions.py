@@ -26,9 +26,15 @@ login_manager.session_protection = 'strong'
 
 @login_manager.user_loader
 def load_user(user_id):
-    """Carga un usuario desde la base de datos usando su ID."""
-    from app.models.usuario import Usuario
-    return Usuario.query.get(int(user_id))
+    """
+    Carga un usuario desde la base de datos usando su ID.
+    
+    El usuario, sus roles y su perfil se obtienen en una sola consulta (o de la
+    caché de identidades), de modo que las verificaciones de rol y el acceso a
+    current_user.medico, .paciente o .admin_centro no hagan consultas.
+    """
+    from app.utils.identidad import cargar_usuario
+    return cargar_usuario(int(user_id))
 
 def init_extensions(app):
     """
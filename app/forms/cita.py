@@ -9,16 +9,19 @@ class AgendarCitaForm(FlaskForm):
     especialidad_id = SelectField('Especialidad', coerce=int,
                                 validators=[DataRequired('Por favor seleccione una especialidad')])
     
-    centro_medico_id = SelectField('Centro Médico', coerce=int,
+    # Las opciones de centro, médico y horario se cargan en el navegador según la
+    # selección anterior; la vista verifica que el horario sea uno de los
+    # ofrecidos por el médico en el centro (agenda.horario_disponible)
+    centro_medico_id = SelectField('Centro Médico', coerce=int, validate_choice=False,
                                  validators=[DataRequired('Por favor seleccione un centro médico')])
     
-    medico_id = SelectField('Médico', coerce=int,
+    medico_id = SelectField('Médico', coerce=int, validate_choice=False,
                           validators=[DataRequired('Por favor seleccione un médico')])
     
     fecha = DateField('Fecha', format='%Y-%m-%d',
                     validators=[DataRequired('Por favor seleccione una fecha')])
     
-    horario = SelectField('Horario Disponible',
+    horario = SelectField('Horario Disponible', validate_choice=False,
                         validators=[DataRequired('Por favor seleccione un horario')])
     
     tipo = SelectField('Tipo de Consulta',
@@ -156,6 +159,86 @@ class RegistrarDisponibilidadForm(FlaskForm):
                 raise ValidationError('Por favor ingrese un número válido.')
 
 
+class HorarioSemanalForm(FlaskForm):
+    """Formulario para que los médicos registren su horario semanal recurrente."""
+    centro_medico_id = SelectField('Centro Médico', coerce=int,
+                                 validators=[DataRequired('Por favor seleccione un centro médico')])
+    
+    dias_semana = SelectMultipleField('Días de la Semana',
+                                    choices=[
+                                        ('0', 'Lunes'),
+                                        ('1', 'Martes'),
+                                        ('2', 'Miércoles'),
+                                        ('3', 'Jueves'),
+                                        ('4', 'Viernes'),
+                                        ('5', 'Sábado'),
+                                        ('6', 'Domingo')
+                                    ],
+                                    validators=[DataRequired('Por favor seleccione al menos un día')])
+    
+    hora_inicio = TimeField('Hora de Inicio', format='%H:%M',
+                          validators=[DataRequired('Por favor seleccione la hora de inicio')])
+    
+    hora_fin = TimeField('Hora de Finalización', format='%H:%M',
+                       validators=[DataRequired('Por favor seleccione la hora de finalización')])
+    
+    intervalo_citas = SelectField('Duración de cada Cita (en minutos)',
+                                choices=[
+                                    ('15', '15 minutos'),
+                                    ('20', '20 minutos'),
+                                    ('30', '30 minutos'),
+                                    ('45', '45 minutos'),
+                                    ('60', '60 minutos')
+                                ],
+                                validators=[DataRequired('Por favor seleccione la duración de las citas')])
+    
+    submit = SubmitField('Registrar Horario Semanal')
+    
+    def validate_hora_fin(self, field):
+        """Valida que la hora final sea después de la inicial."""
+        if self.hora_inicio.data and field.data <= self.hora_inicio.data:
+            raise ValidationError('La hora de finalización debe ser posterior a la hora de inicio.')
+
+
+class ExcepcionHorarioForm(FlaskForm):
+    """Formulario para registrar un bloqueo puntual en la agenda del médico."""
+    centro_medico_id = SelectField('Centro Médico (opcional, todos si no se indica)', coerce=int,
+                                 validators=[Optional()])
+    
+    fecha = DateField('Fecha', format='%Y-%m-%d',
+                    validators=[DataRequired('Por favor seleccione una fecha')])
+    
+    hora_inicio = TimeField('Hora de Inicio (opcional, día completo si no se indica)', format='%H:%M',
+                          validators=[Optional()])
+    
+    hora_fin = TimeField('Hora de Finalización', format='%H:%M',
+                       validators=[Optional()])
+    
+    motivo = StringField('Motivo', validators=[Optional(), Length(max=200)])
+    
+    submit = SubmitField('Registrar Bloqueo')
+    
+    def validate_fecha(self, field):
+        """Valida que la fecha sea hoy o en el futuro."""
+        if field.data < date.today():
+            raise ValidationError('La fecha no puede ser en el pasado.')
+    
+    def validate(self, extra_validators=None):
+        """Valida que las horas se indiquen juntas y en orden."""
+        if not super().validate(extra_validators):
+            return False
+        
+        if (self.hora_inicio.data is None) != (self.hora_fin.data is None):
+            self.hora_fin.errors.append('Indique ambas horas o ninguna para bloquear el día completo.')
+            return False
+        
+        if self.hora_fin.data and self.hora_fin.data <= self.hora_inicio.data:
+            self.hora_fin.errors.append('La hora de finalización debe ser posterior a la hora de inicio.')
+            return False
+        
+        return True
+
+
 class CancelarCitaForm(FlaskForm):
     """Formulario para cancelar una cita."""
     motivo_cancelacion = TextAreaField('Motivo de la Cancelación',
@@ -178,7 +261,8 @@ class ReprogramarCitaForm(FlaskForm):
     fecha = DateField('Nueva Fecha', format='%Y-%m-%d',
                     validators=[DataRequired('Por favor seleccione una fecha')])
     
-    horario = SelectField('Nuevo Horario',
+    # Opciones cargadas en el navegador; la vista verifica el horario elegido
+    horario = SelectField('Nuevo Horario', validate_choice=False,
                         validators=[DataRequired('Por favor seleccione un horario')])
     
     motivo_reprogramacion = TextAreaField('Motivo de la Reprogramación',
@@ -0,0 +1,269 @@
+import re
+import unicodedata
+
+from flask import current_app
+from app.extensions import db
+from sqlalchemy import event, inspect
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import Session
+
+from app.models.usuario import Usuario
+from app.models.tipos_usuario import Medico, Especialidad
+
+# Tabla virtual FTS5 que replica el índice en SQLite
+TABLA_FTS = 'indice_busqueda_fts'
+
+# Columnas indexadas, en el orden de la tabla FTS5 (documento incluye la licencia de los médicos)
+COLUMNAS_TEXTO = ('nombre', 'documento', 'email', 'biografia', 'especialidad')
+
+# Atributos de cada modelo cuyo cambio obliga a reindexar al usuario
+ATRIBUTOS_INDEXADOS = {
+    Usuario: ('nombre', 'apellido', 'numero_documento', 'email'),
+    Medico: ('numero_licencia', 'biografia', 'especialidad_id'),
+}
+
+# Cantidad de usuarios reindexados por sentencia
+TAMANO_LOTE = 500
+
+
+class IndiceBusqueda(db.Model):
+    """
+    Texto de búsqueda de cada usuario, normalizado (minúsculas y sin tildes).
+    
+    Se mantiene en la misma transacción que los usuarios, médicos y
+    especialidades. En SQLite se replica en una tabla virtual FTS5 mediante
+    triggers; en PostgreSQL se indexa con GIN sobre su tsvector y con
+    trigramas (pg_trgm). En una base existente se puebla al iniciar la
+    aplicación (ver reconstruir_indice) o con `flask reconstruir-busqueda`.
+    """
+    __tablename__ = 'indice_busqueda'
+    
+    usuario_id = db.Column(db.Integer, db.ForeignKey('usuarios.id', ondelete='CASCADE'), primary_key=True)
+    es_medico = db.Column(db.Boolean, default=False, nullable=False)
+    
+    # Campos normalizados
+    nombre = db.Column(db.String(201), nullable=False)
+    documento = db.Column(db.String(71), nullable=False)  # Documento y número de licencia
+    email = db.Column(db.String(120), nullable=False)
+    biografia = db.Column(db.Text, nullable=True)
+    especialidad = db.Column(db.String(100), nullable=True)
+    
+    # Concatenación de todos los campos, usada en PostgreSQL y en la búsqueda alternativa
+    texto = db.Column(db.Text, nullable=False)
+    
+    def __repr__(self):
+        return f"<IndiceBusqueda {self.usuario_id}: {self.nombre}>"
+
+
+def normalizar(texto):
+    """
+    Normaliza un texto para la búsqueda: minúsculas y sin tildes.
+    
+    Args:
+        texto: Texto a normalizar (puede ser None)
+    
+    Returns:
+        str: Texto normalizado
+    """
+    if not texto:
+        return ''
+    descompuesto = unicodedata.normalize('NFKD', texto)
+    return ''.join(c for c in descompuesto if not unicodedata.combining(c)).lower()
+
+
+def terminos_busqueda(texto, maximo=8):
+    """
+    Separa un texto de búsqueda en términos normalizados.
+    
+    Los términos solo contienen letras y dígitos, de modo que pueden
+    insertarse sin riesgo en la sintaxis de FTS5 o de to_tsquery.
+    
+    Args:
+        texto: Texto ingresado por el usuario
+        maximo: Cantidad máxima de términos a considerar
+    
+    Returns:
+        list: Términos normalizados
+    """
+    return re.findall(r'\w+', normalizar(texto))[:maximo]
+
+
+def _crear_indice_sqlite(conexion):
+    """Crea la tabla FTS5 y los triggers que la sincronizan con indice_busqueda."""
+    columnas = ', '.join(COLUMNAS_TEXTO)
+    nuevas = ', '.join(f'new.{columna}' for columna in COLUMNAS_TEXTO)
+    viejas = ', '.join(f'old.{columna}' for columna in COLUMNAS_TEXTO)
+    
+    sentencias = [
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS {TABLA_FTS} USING fts5({columnas}, "
+        f"content='indice_busqueda', content_rowid='usuario_id', tokenize='unicode61 remove_diacritics 2')",
+        f"CREATE TRIGGER IF NOT EXISTS indice_busqueda_ai AFTER INSERT ON indice_busqueda BEGIN "
+        f"INSERT INTO {TABLA_FTS}(rowid, {columnas}) VALUES (new.usuario_id, {nuevas}); END",
+        f"CREATE TRIGGER IF NOT EXISTS indice_busqueda_ad AFTER DELETE ON indice_busqueda BEGIN "
+        f"INSERT INTO {TABLA_FTS}({TABLA_FTS}, rowid, {columnas}) VALUES ('delete', old.usuario_id, {viejas}); END",
+        f"CREATE TRIGGER IF NOT EXISTS indice_busqueda_au AFTER UPDATE ON indice_busqueda BEGIN "
+        f"INSERT INTO {TABLA_FTS}({TABLA_FTS}, rowid, {columnas}) VALUES ('delete', old.usuario_id, {viejas}); "
+        f"INSERT INTO {TABLA_FTS}(rowid, {columnas}) VALUES (new.usuario_id, {nuevas}); END",
+    ]
+    
+    try:
+        for sentencia in sentencias:
+            conexion.exec_driver_sql(sentencia)
+    except OperationalError as e:
+        # SQLite compilado sin FTS5: se usa la búsqueda alternativa
+        current_app.logger.warning(f"Búsqueda de texto completo no disponible en SQLite: {e}")
+
+
+def _crear_indice_postgresql(conexion):
+    """Crea los índices GIN de texto completo y de trigramas."""
+    conexion.exec_driver_sql("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+    conexion.exec_driver_sql(
+        "CREATE INDEX IF NOT EXISTS ix_indice_busqueda_tsv ON indice_busqueda "
+        "USING gin (to_tsvector('simple', texto))")
+    conexion.exec_driver_sql(
+        "CREATE INDEX IF NOT EXISTS ix_indice_busqueda_trgm ON indice_busqueda "
+        "USING gin (texto gin_trgm_ops)")
+
+
+@event.listens_for(IndiceBusqueda.__table__, 'after_create')
+def crear_indice_texto(tabla, conexion, **kwargs):
+    """Crea el índice de texto completo propio del motor de base de datos."""
+    from app.utils.busqueda import reiniciar_deteccion_fts
+    
+    if conexion.dialect.name == 'sqlite':
+        _crear_indice_sqlite(conexion)
+    elif conexion.dialect.name == 'postgresql':
+        _crear_indice_postgresql(conexion)
+    reiniciar_deteccion_fts(conexion.engine)
+
+
+@event.listens_for(IndiceBusqueda.__table__, 'before_drop')
+def eliminar_indice_texto(tabla, conexion, **kwargs):
+    """Elimina la tabla FTS5 junto con el índice (los triggers se eliminan con la tabla)."""
+    from app.utils.busqueda import reiniciar_deteccion_fts
+    
+    if conexion.dialect.name == 'sqlite':
+        conexion.exec_driver_sql(f"DROP TABLE IF EXISTS {TABLA_FTS}")
+    reiniciar_deteccion_fts(conexion.engine)
+
+
+def reindexar_usuarios(conexion, usuario_ids):
+    """
+    Recalcula las filas del índice de los usuarios indicados.
+    
+    Los usuarios que ya no existen quedan fuera del índice.
+    
+    Args:
+        conexion: Conexión de la transacción en curso
+        usuario_ids: Identificadores de los usuarios
+    """
+    tabla = IndiceBusqueda.__table__
+    usuario_ids = list(usuario_ids)
+    
+    for inicio in range(0, len(usuario_ids), TAMANO_LOTE):
+        lote = usuario_ids[inicio:inicio + TAMANO_LOTE]
+        
+        filas = conexion.execute(
+            db.select(
+                Usuario.id, Usuario.nombre, Usuario.apellido, Usuario.numero_documento, Usuario.email,
+                Medico.usuario_id.label('medico_id'), Medico.numero_licencia, Medico.biografia, Especialidad.nombre.label('especialidad')
+            ).select_from(Usuario.__table__)
+            .outerjoin(Medico.__table__, Medico.usuario_id == Usuario.id)
+            .outerjoin(Especialidad.__table__, Especialidad.id == Medico.especialidad_id)
+            .where(Usuario.id.in_(lote))
+        ).all()
+        
+        registros = []
+        for fila in filas:
+            campos = {
+                'nombre': normalizar(f'{fila.nombre} {fila.apellido}'),
+                'documento': normalizar(f'{fila.numero_documento} {fila.numero_licencia or ""}'.strip()),
+                'email': normalizar(fila.email),
+                'biografia': normalizar(fila.biografia),
+                'especialidad': normalizar(fila.especialidad),
+            }
+            registros.append(dict(
+                campos,
+                usuario_id=fila.id,
+                es_medico=fila.medico_id is not None,
+                texto=' '.join(valor for valor in campos.values() if valor)
+            ))
+        
+        conexion.execute(tabla.delete().where(tabla.c.usuario_id.in_(lote)))
+        if registros:
+            conexion.execute(tabla.insert(), registros)
+
+
+def reconstruir_indice():
+    """
+    Crea el índice de texto completo si no existe y recalcula todas sus filas.
+    
+    No confirma la transacción; quien la confirma debe llamar luego a
+    app.utils.busqueda.reiniciar_deteccion_fts para que las búsquedas usen
+    la tabla FTS5 recién creada.
+    
+    Returns:
+        int: Cantidad de usuarios indexados
+    """
+    tabla = IndiceBusqueda.__table__
+    tabla.create(db.engine, checkfirst=True)
+    
+    conexion = db.session.connection()
+    crear_indice_texto(tabla, conexion)
+    
+    # Vaciar el índice y volver a calcularlo por lotes
+    conexion.execute(tabla.delete())
+    usuario_ids = db.session.execute(db.select(Usuario.id)).scalars().all()
+    reindexar_usuarios(conexion, usuario_ids)
+    
+    if conexion.dialect.name == 'sqlite' and inspect(conexion).has_table(TABLA_FTS):
+        conexion.exec_driver_sql(f"INSERT INTO {TABLA_FTS}({TABLA_FTS}) VALUES ('rebuild')")
+    
+    return len(usuario_ids)
+
+
+def _usuarios_afectados(session):
+    """Obtiene los usuarios cuyo texto de búsqueda cambia con el flush en curso."""
+    usuario_ids, especialidad_ids = set(), set()
+    
+    for objeto in list(session.new) + list(session.dirty) + list(session.deleted):
+        if isinstance(objeto, Especialidad):
+            if objeto in session.dirty and inspect(objeto).attrs.nombre.history.has_changes():
+                especialidad_ids.add(objeto.id)
+            continue
+        
+        atributos = ATRIBUTOS_INDEXADOS.get(type(objeto))
+        if atributos is None:
+            continue
+        
+        # Los objetos modificados solo se reindexan si cambió algún atributo indexado
+        estado = inspect(objeto)
+        if objeto in session.dirty and not any(
+                estado.attrs[atributo].history.has_changes() for atributo in atributos):
+            continue
+        usuario_ids.add(objeto.id if isinstance(objeto, Usuario) else objeto.usuario_id)
+    
+    usuario_ids.discard(None)
+    return usuario_ids, especialidad_ids
+
+
+@event.listens_for(Session, 'after_flush')
+def sincronizar_indice_busqueda(session, flush_context):
+    """
+    Actualiza el índice de búsqueda con los cambios recién enviados a la base de datos.
+    
+    Se ejecuta después del flush para que los usuarios nuevos ya tengan
+    identificador; las escrituras se hacen con sentencias Core sobre la
+    conexión de la sesión, dentro de la misma transacción.
+    """
+    usuario_ids, especialidad_ids = _usuarios_afectados(session)
+    if not usuario_ids and not especialidad_ids:
+        return
+    
+    conexion = session.connection()
+    if especialidad_ids:
+        usuario_ids.update(conexion.execute(
+            db.select(Medico.usuario_id).where(Medico.especialidad_id.in_(especialidad_ids))
+        ).scalars())
+    
+    reindexar_usuarios(conexion, usuario_ids)
@@ -34,6 +34,11 @@ class CentroMedico(db.Model):
     # Citas asociadas a este centro
     citas = db.relationship('Cita', back_populates='centro_medico', lazy='dynamic')
     
+    # Orden de los listados paginados por clave
+    __table_args__ = (
+        db.Index('ix_centros_medicos_nombre_id', 'nombre', 'id'),
+    )
+    
     def __repr__(self):
         return f"<Centro Médico {self.nombre} - {self.ciudad}>"
     
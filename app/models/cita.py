@@ -1,6 +1,16 @@
 from datetime import datetime, timedelta
+from flask import current_app
 from app.extensions import db
-from sqlalchemy import event
+from sqlalchemy import event, inspect
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session
+
+# Estados en los que una cita ocupa su horario
+ESTADOS_ACTIVOS = ('pendiente', 'confirmada', 'en_curso')
+
+
+class CupoAgotadoError(Exception):
+    """El médico alcanzó el máximo de citas permitidas para el día."""
 
 class Cita(db.Model):
     """Modelo para las citas médicas."""
@@ -37,22 +47,46 @@ class Cita(db.Model):
     recordatorio_24h_enviado = db.Column(db.Boolean, default=False)
     recordatorio_1h_enviado = db.Column(db.Boolean, default=False)
     
+    # Reclamo del envío de recordatorios por un proceso (evita envíos duplicados)
+    recordatorio_reclamado_en = db.Column(db.DateTime, nullable=True)
+    recordatorio_reclamado_por = db.Column(db.String(64), nullable=True)
+    
     # Notas adicionales (para el personal administrativo)
     notas = db.Column(db.Text, nullable=True)
     
     # ID de la sala virtual (si aplica)
-    sala_virtual_id = db.Column(db.Integer, db.ForeignKey('salas_virtuales.id'), nullable=True)
+    # (forma un ciclo con salas_virtuales.cita_id; use_alter permite ordenar las tablas)
+    sala_virtual_id = db.Column(db.Integer, db.ForeignKey('salas_virtuales.id', use_alter=True,
+                                                          name='fk_citas_sala_virtual'),
+                                nullable=True)
     
     # Relaciones
     paciente = db.relationship('Paciente', back_populates='citas')
     medico = db.relationship('Medico', back_populates='citas')
     centro_medico = db.relationship('CentroMedico', back_populates='citas')
     especialidad = db.relationship('Especialidad')
-    sala_virtual = db.relationship('SalaVirtual', back_populates='cita', uselist=False, 
+    sala_virtual = db.relationship('SalaVirtual', back_populates='cita', uselist=False,
+                                  foreign_keys='SalaVirtual.cita_id',
                                   cascade='all, delete-orphan', single_parent=True)
     consulta = db.relationship('Consulta', back_populates='cita', uselist=False)
     usuario_cancelador = db.relationship('Usuario', foreign_keys=[cancelado_por])
     
+    # Un médico no puede tener dos citas activas en el mismo horario. El índice
+    # parcial permite reutilizar el horario de citas canceladas o completadas.
+    __table_args__ = (
+        db.Index('uq_citas_medico_fecha_hora_activa', medico_id, fecha_hora, unique=True,
+                 postgresql_where=estado.in_(ESTADOS_ACTIVOS),
+                 sqlite_where=estado.in_(ESTADOS_ACTIVOS)),
+        db.Index('ix_citas_fecha_hora_recordatorios', fecha_hora,
+                 recordatorio_24h_enviado, recordatorio_1h_enviado),
+        
+        # Agendas y listados filtrados por rango de fecha y hora
+        db.Index('ix_citas_medico_fecha_hora', medico_id, fecha_hora),
+        db.Index('ix_citas_paciente_fecha_hora', paciente_id, fecha_hora),
+        db.Index('ix_citas_centro_fecha_hora', centro_medico_id, fecha_hora),
+        db.Index('ix_citas_estado_fecha_hora', estado, fecha_hora),
+    )
+    
     def __repr__(self):
         return f"<Cita {self.id}: {self.paciente_id} con {self.medico_id} - {self.fecha_hora}>"
     
@@ -221,7 +255,7 @@ class SalaVirtual(db.Model):
     
     # Relaciones
     cita_id = db.Column(db.Integer, db.ForeignKey('citas.id'), nullable=False)
-    cita = db.relationship('Cita', back_populates='sala_virtual')
+    cita = db.relationship('Cita', back_populates='sala_virtual', foreign_keys=[cita_id])
     mensajes = db.relationship('MensajeChat', back_populates='sala', cascade='all, delete-orphan')
     
     def __repr__(self):
@@ -304,6 +338,8 @@ class Disponibilidad(db.Model):
     # Relaciones
     medico = db.relationship('Medico')
     centro_medico = db.relationship('CentroMedico')
+    franjas = db.relationship('FranjaHoraria', back_populates='disponibilidad',
+                              cascade='all, delete-orphan')
     
     # Restricción de unicidad: un médico no puede tener dos disponibilidades 
     # en el mismo centro, fecha y hora
@@ -330,6 +366,49 @@ class Disponibilidad(db.Model):
             
         return self.duracion_total_minutos // self.intervalo_citas
     
+    def horarios(self):
+        """
+        Genera los horarios de inicio de cada turno de esta disponibilidad.
+        
+        Yields:
+            datetime: Fecha y hora de inicio de cada turno
+        """
+        fecha_base = datetime.combine(self.fecha, self.hora_inicio)
+        
+        for n, i in enumerate(range(0, self.duracion_total_minutos, self.intervalo_citas)):
+            # Si hay un límite de citas, no generar más turnos que el máximo
+            if self.citas_maximas and n >= self.citas_maximas:
+                break
+            
+            yield fecha_base + timedelta(minutes=i)
+    
+    def generar_franjas(self, citas_ocupadas=None):
+        """
+        Materializa las franjas horarias de esta disponibilidad en el índice de horarios.
+        
+        Args:
+            citas_ocupadas: Diccionario opcional fecha_hora -> Cita con las citas
+                activas del médico, para marcar las franjas ya reservadas
+        
+        Returns:
+            list: Lista de objetos FranjaHoraria creados
+        """
+        citas_ocupadas = citas_ocupadas or {}
+        franjas = []
+        
+        for horario in self.horarios():
+            franja = FranjaHoraria(
+                medico_id=self.medico_id,
+                centro_medico_id=self.centro_medico_id,
+                fecha=self.fecha,
+                fecha_hora=horario,
+                cita=citas_ocupadas.get(horario)
+            )
+            self.franjas.append(franja)
+            franjas.append(franja)
+        
+        return franjas
+    
     def generar_horarios_disponibles(self):
         """
         Genera una lista de horarios disponibles en base a esta disponibilidad.
@@ -337,29 +416,275 @@ class Disponibilidad(db.Model):
         Returns:
             list: Lista de objetos datetime con los horarios disponibles
         """
-        from datetime import datetime, timedelta
-        
-        horarios = []
-        fecha_base = datetime.combine(self.fecha, self.hora_inicio)
-        minutos_totales = self.duracion_total_minutos
+        franjas = FranjaHoraria.query.with_entities(FranjaHoraria.fecha_hora).filter(
+            FranjaHoraria.disponibilidad_id == self.id,
+            FranjaHoraria.cita_id == None
+        ).order_by(FranjaHoraria.fecha_hora).all()
         
-        # Iterar por cada intervalo posible
-        for i in range(0, minutos_totales, self.intervalo_citas):
-            horario = fecha_base + timedelta(minutes=i)
+        return [f.fecha_hora for f in franjas]
+
+
+class FranjaHoraria(db.Model):
+    """
+    Índice materializado de franjas horarias (una fila por turno reservable).
+    
+    Se mantiene al registrar disponibilidades y al agendar, cancelar o reprogramar
+    citas, de modo que la búsqueda de horarios libres sea una sola consulta por rango.
+    """
+    __tablename__ = 'franjas_horarias'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    disponibilidad_id = db.Column(db.Integer, db.ForeignKey('disponibilidades.id'), nullable=False)
+    medico_id = db.Column(db.Integer, db.ForeignKey('medicos.usuario_id'), nullable=False)
+    centro_medico_id = db.Column(db.Integer, db.ForeignKey('centros_medicos.id'), nullable=False)
+    fecha = db.Column(db.Date, nullable=False)
+    fecha_hora = db.Column(db.DateTime, nullable=False)
+    
+    # Cita que ocupa la franja (None = libre)
+    cita_id = db.Column(db.Integer, db.ForeignKey('citas.id'), nullable=True, unique=True)
+    
+    # Relaciones
+    disponibilidad = db.relationship('Disponibilidad', back_populates='franjas')
+    cita = db.relationship('Cita')
+    
+    __table_args__ = (
+        db.UniqueConstraint('medico_id', 'centro_medico_id', 'fecha_hora',
+                            name='uq_franja_medico_centro_fecha_hora'),
+        db.Index('ix_franjas_fecha_hora_medico', 'fecha_hora', 'medico_id'),
+        db.Index('ix_franjas_medico_fecha_hora', 'medico_id', 'fecha_hora'),
+    )
+    
+    def __repr__(self):
+        estado = 'ocupada' if self.cita_id else 'libre'
+        return f"<FranjaHoraria {self.medico_id}: {self.fecha_hora} ({estado})>"
+
+
+@event.listens_for(Session, 'before_flush')
+def sincronizar_franjas(session, flush_context, instances):
+    """
+    Mantiene el índice de franjas horarias sincronizado con las citas.
+    
+    Ocupa la franja al agendar una cita, la libera al cancelarla o completarla
+    fuera de un estado activo, y la traslada al reprogramarla.
+    """
+    citas = [obj for obj in list(session.new) + list(session.dirty) if isinstance(obj, Cita)]
+    if not citas:
+        return
+    
+    with session.no_autoflush:
+        for cita in citas:
+            estado = inspect(cita).attrs.estado.history
+            fecha_hora = inspect(cita).attrs.fecha_hora.history
+            if cita in session.dirty and not (estado.has_changes() or fecha_hora.has_changes()):
+                continue
             
-            # Verificar si este horario ya está ocupado
-            from app.models.cita import Cita
-            cita_existente = Cita.query.filter_by(
-                medico_id=self.medico_id,
-                fecha_hora=horario,
-                estado=['pendiente', 'confirmada', 'en_curso']
+            # Liberar la franja ocupada previamente por la cita
+            if cita.id is not None:
+                FranjaHoraria.query.filter_by(cita_id=cita.id).update(
+                    {'cita_id': None}, synchronize_session='fetch')
+            
+            # El valor por defecto del estado aún no se aplicó en citas nuevas
+            if (cita.estado or 'pendiente') not in ESTADOS_ACTIVOS:
+                continue
+            
+            franja = FranjaHoraria.query.filter_by(
+                medico_id=cita.medico_id,
+                centro_medico_id=cita.centro_medico_id,
+                fecha_hora=cita.fecha_hora,
+                cita_id=None
             ).first()
             
-            if not cita_existente:
-                horarios.append(horario)
-                
-            # Si hay un límite de citas y ya lo alcanzamos, terminar
-            if self.citas_maximas > 0 and len(horarios) >= self.citas_maximas:
-                break
+            if franja:
+                franja.cita = cita
+
+
+class CapacidadDiaria(db.Model):
+    """
+    Contador de citas agendadas por médico y día.
+    
+    Se actualiza en la misma transacción que crea, cancela o reprograma las
+    citas, de modo que verificar el cupo diario no requiera contar citas.
+    """
+    __tablename__ = 'capacidad_diaria'
+    
+    medico_id = db.Column(db.Integer, db.ForeignKey('medicos.usuario_id'), primary_key=True)
+    fecha = db.Column(db.Date, primary_key=True)
+    
+    # Citas no canceladas del médico en la fecha
+    citas_agendadas = db.Column(db.Integer, default=0, nullable=False)
+    
+    def __repr__(self):
+        return f"<CapacidadDiaria {self.medico_id}: {self.fecha} ({self.citas_agendadas})>"
+
+
+class RetencionHorario(db.Model):
+    """
+    Retención temporal de un horario mientras un paciente completa el agendamiento.
+    
+    Se guarda en la base de datos para que todos los procesos de la aplicación
+    vean las mismas retenciones. Las filas vencidas se ignoran al leer y se
+    eliminan al crear nuevas retenciones.
+    """
+    __tablename__ = 'retenciones_horarios'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    medico_id = db.Column(db.Integer, db.ForeignKey('medicos.usuario_id'), nullable=False)
+    fecha_hora = db.Column(db.DateTime, nullable=False)
+    
+    # Cada usuario retiene como máximo un horario
+    usuario_id = db.Column(db.Integer, db.ForeignKey('usuarios.id'), nullable=False, unique=True)
+    vence = db.Column(db.DateTime, nullable=False, index=True)  # UTC
+    
+    __table_args__ = (
+        db.UniqueConstraint('medico_id', 'fecha_hora', name='uq_retenciones_medico_fecha_hora'),
+    )
+    
+    def __repr__(self):
+        return f"<RetencionHorario {self.medico_id}: {self.fecha_hora} ({self.usuario_id})>"
+
+
+def valores_previos(session, objeto, atributos):
+    """
+    Obtiene los valores de los atributos de un objeto previos a los cambios pendientes.
+    
+    Args:
+        session: Sesión en curso
+        objeto: Instancia de un modelo
+        atributos: Nombres de los atributos
+        
+    Returns:
+        dict: atributo -> valor, o None si el objeto ya no existe en la base de datos
+    """
+    estado = inspect(objeto)
+    historiales = {atributo: estado.attrs[atributo].history for atributo in atributos}
+    
+    # Si el atributo estaba expirado al modificarse, el valor previo solo
+    # está en la base de datos
+    if estado.identity is not None and any(h.added and not h.deleted for h in historiales.values()):
+        modelo = estado.mapper.class_
+        fila = session.query(*(getattr(modelo, atributo) for atributo in atributos)).filter(
+            *(columna == valor for columna, valor in zip(estado.mapper.primary_key, estado.identity))
+        ).first()
+        return fila._asdict() if fila else None
+    
+    return {
+        atributo: historial.deleted[0] if historial.deleted else getattr(objeto, atributo)
+        for atributo, historial in historiales.items()
+    }
+
+
+def _cupo_de_cita(session, cita, anterior=False):
+    """
+    Obtiene la clave (médico, fecha) del cupo que ocupa una cita.
+    
+    Args:
+        session: Sesión en curso
+        cita: Objeto Cita
+        anterior: Si es True usa los valores previos a los cambios pendientes
+        
+    Returns:
+        tuple: (medico_id, fecha) o None si la cita no ocupa cupo
+    """
+    atributos = ('medico_id', 'fecha_hora', 'estado')
+    if anterior:
+        valores = valores_previos(session, cita, atributos)
+        if valores is None:
+            return None
+    else:
+        valores = {atributo: getattr(cita, atributo) for atributo in atributos}
+    
+    # Las citas canceladas liberan el cupo; las completadas lo siguen ocupando
+    if valores['fecha_hora'] is None or (valores['estado'] or 'pendiente') == 'cancelada':
+        return None
+    
+    return valores['medico_id'], valores['fecha_hora'].date()
+
+
+@event.listens_for(Session, 'before_flush')
+def actualizar_capacidad_diaria(session, flush_context, instances):
+    """
+    Mantiene el contador de citas por médico y día sincronizado con las citas.
+    
+    Los incrementos se aplican con un UPDATE condicional al máximo configurado,
+    por lo que dos reservas concurrentes no pueden superar el cupo del día.
+    
+    Raises:
+        CupoAgotadoError: Si la cita excede el máximo de citas del médico en el día
+    """
+    cambios = {}
+    
+    with session.no_autoflush:
+        for cita in session.new:
+            if isinstance(cita, Cita):
+                nuevo = _cupo_de_cita(session, cita)
+                if nuevo:
+                    cambios[nuevo] = cambios.get(nuevo, 0) + 1
         
-        return horarios
\ No newline at end of file
+        for cita in session.dirty:
+            if isinstance(cita, Cita):
+                anterior, nuevo = _cupo_de_cita(session, cita, anterior=True), _cupo_de_cita(session, cita)
+                if anterior != nuevo:
+                    if anterior:
+                        cambios[anterior] = cambios.get(anterior, 0) - 1
+                    if nuevo:
+                        cambios[nuevo] = cambios.get(nuevo, 0) + 1
+        
+        for cita in session.deleted:
+            if isinstance(cita, Cita):
+                anterior = _cupo_de_cita(session, cita, anterior=True)
+                if anterior:
+                    cambios[anterior] = cambios.get(anterior, 0) - 1
+        
+        if not cambios:
+            return
+        
+        maximo = current_app.config.get('MAX_APPOINTMENTS_PER_DOCTOR_DAY')
+        tabla = CapacidadDiaria.__table__
+        
+        # Aplicar primero las liberaciones para no rechazar reprogramaciones válidas
+        for (medico_id, fecha), delta in sorted(cambios.items(), key=lambda c: c[1]):
+            if delta == 0:
+                continue
+            
+            condicion = db.and_(tabla.c.medico_id == medico_id, tabla.c.fecha == fecha)
+            
+            if delta < 0:
+                session.execute(tabla.update().where(condicion).values(
+                    citas_agendadas=db.case((tabla.c.citas_agendadas + delta > 0, tabla.c.citas_agendadas + delta),
+                                            else_=0)))
+                continue
+            
+            _crear_contador(session, medico_id, fecha)
+            
+            actualizacion = tabla.update().where(condicion)
+            if maximo:
+                actualizacion = actualizacion.where(tabla.c.citas_agendadas + delta <= maximo)
+            
+            resultado = session.execute(actualizacion.values(
+                citas_agendadas=tabla.c.citas_agendadas + delta))
+            if not resultado.rowcount:
+                raise CupoAgotadoError(
+                    f'El médico {medico_id} alcanzó el máximo de {maximo} citas para el {fecha}.')
+
+
+def _crear_contador(session, medico_id, fecha):
+    """
+    Crea en cero el contador de un médico y día si todavía no existe.
+    
+    En PostgreSQL y SQLite se usa INSERT ... ON CONFLICT DO NOTHING, de modo que
+    dos primeras reservas concurrentes del día no chocan al crear la fila y
+    ambas pasan por el UPDATE condicional al cupo.
+    """
+    tabla = CapacidadDiaria.__table__
+    dialecto = session.get_bind().dialect.name
+    
+    if dialecto in ('postgresql', 'sqlite'):
+        insertar = (postgresql.insert if dialecto == 'postgresql' else sqlite.insert)(tabla)
+        session.execute(insertar.values(medico_id=medico_id, fecha=fecha, citas_agendadas=0)
+                        .on_conflict_do_nothing(index_elements=['medico_id', 'fecha']))
+        return
+    
+    existe = session.execute(db.select(tabla.c.medico_id).where(
+        tabla.c.medico_id == medico_id, tabla.c.fecha == fecha)).first()
+    if not existe:
+        session.execute(tabla.insert().values(medico_id=medico_id, fecha=fecha, citas_agendadas=0))
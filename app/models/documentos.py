@@ -74,7 +74,7 @@ class RecetaMedica(db.Model, DocumentoBase):
     consulta = db.relationship('Consulta', back_populates='recetas')
     paciente = db.relationship('Paciente')
     medico = db.relationship('Medico')
-    emisor = db.relationship('Usuario', foreign_keys=[emitido_por])
+    emisor = db.relationship('Usuario', foreign_keys='RecetaMedica.emitido_por')
     medicamentos = db.relationship('MedicamentoReceta', back_populates='receta', 
                                 cascade='all, delete-orphan')
     
@@ -83,6 +83,13 @@ class RecetaMedica(db.Model, DocumentoBase):
         if not self.codigo_validacion:
             self.codigo_validacion = generar_codigo_validacion()
     
+    # Documentos de un médico, de un paciente o de todo el sistema, del más reciente al más antiguo
+    __table_args__ = (
+        db.Index('ix_recetas_medicas_medico_paciente_fecha', 'medico_id', 'paciente_id', 'fecha_emision'),
+        db.Index('ix_recetas_medicas_paciente_fecha', 'paciente_id', 'fecha_emision'),
+        db.Index('ix_recetas_medicas_fecha', 'fecha_emision'),
+    )
+    
     def __repr__(self):
         return f"<RecetaMedica {self.id} - Médico: {self.medico_id}, Paciente: {self.paciente_id}>"
     
@@ -146,7 +153,7 @@ class OrdenLaboratorio(db.Model, DocumentoBase):
     consulta = db.relationship('Consulta', back_populates='ordenes_laboratorio')
     paciente = db.relationship('Paciente')
     medico = db.relationship('Medico')
-    emisor = db.relationship('Usuario', foreign_keys=[emitido_por])
+    emisor = db.relationship('Usuario', foreign_keys='OrdenLaboratorio.emitido_por')
     examenes = db.relationship('ExamenLaboratorio', back_populates='orden', 
                              cascade='all, delete-orphan')
     
@@ -155,6 +162,13 @@ class OrdenLaboratorio(db.Model, DocumentoBase):
         if not self.codigo_validacion:
             self.codigo_validacion = generar_codigo_validacion()
     
+    # Documentos de un médico, de un paciente o de todo el sistema, del más reciente al más antiguo
+    __table_args__ = (
+        db.Index('ix_ordenes_laboratorio_medico_paciente_fecha', 'medico_id', 'paciente_id', 'fecha_emision'),
+        db.Index('ix_ordenes_laboratorio_paciente_fecha', 'paciente_id', 'fecha_emision'),
+        db.Index('ix_ordenes_laboratorio_fecha', 'fecha_emision'),
+    )
+    
     def __repr__(self):
         return f"<OrdenLaboratorio {self.id} - Médico: {self.medico_id}, Paciente: {self.paciente_id}>"
     
@@ -0,0 +1,274 @@
+from datetime import datetime
+from app.extensions import db
+from sqlalchemy import event, insert
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session
+
+from app.models.cita import Cita, valores_previos
+from app.models.consulta import Consulta
+from app.models.usuario import Usuario
+
+# Estados de cita con contador propio en el resumen diario
+ESTADOS_CITA = ('pendiente', 'confirmada', 'en_curso', 'completada', 'cancelada')
+
+
+class EstadisticaDiaria(db.Model):
+    """
+    Resumen diario de citas y consultas por centro, especialidad y médico.
+    
+    Se actualiza de forma incremental en la misma transacción que las citas y
+    consultas, de modo que los paneles de estadísticas no recorran las tablas
+    de origen en cada solicitud. Las citas se cuentan en la fecha de la cita.
+    """
+    __tablename__ = 'estadisticas_diarias'
+    
+    fecha = db.Column(db.Date, primary_key=True)
+    centro_medico_id = db.Column(db.Integer, db.ForeignKey('centros_medicos.id'), primary_key=True)
+    especialidad_id = db.Column(db.Integer, db.ForeignKey('especialidades.id'), primary_key=True)
+    medico_id = db.Column(db.Integer, db.ForeignKey('medicos.usuario_id'), primary_key=True)
+    
+    # Citas por estado
+    citas_pendientes = db.Column(db.Integer, default=0, nullable=False)
+    citas_confirmadas = db.Column(db.Integer, default=0, nullable=False)
+    citas_en_curso = db.Column(db.Integer, default=0, nullable=False)
+    citas_completadas = db.Column(db.Integer, default=0, nullable=False)
+    citas_canceladas = db.Column(db.Integer, default=0, nullable=False)
+    
+    # Consultas finalizadas y su duración acumulada
+    consultas_completadas = db.Column(db.Integer, default=0, nullable=False)
+    duracion_total_minutos = db.Column(db.Integer, default=0, nullable=False)
+    
+    __table_args__ = (
+        db.Index('ix_estadisticas_diarias_centro_fecha', 'centro_medico_id', 'fecha'),
+    )
+    
+    def __repr__(self):
+        return f"<EstadisticaDiaria {self.fecha} - Centro: {self.centro_medico_id}, Médico: {self.medico_id}>"
+    
+    @property
+    def total_citas(self):
+        """Total de citas del día en cualquier estado."""
+        return sum(getattr(self, columna_estado(estado)) for estado in ESTADOS_CITA)
+    
+    @classmethod
+    def total_citas_expr(cls):
+        """Expresión SQL con la suma de citas en todos los estados."""
+        return sum(db.func.sum(getattr(cls, columna_estado(estado))) for estado in ESTADOS_CITA)
+
+
+class EstadisticaUsuariosDiaria(db.Model):
+    """Cantidad de usuarios registrados por día."""
+    __tablename__ = 'estadisticas_usuarios_diarias'
+    
+    fecha = db.Column(db.Date, primary_key=True)
+    nuevos_usuarios = db.Column(db.Integer, default=0, nullable=False)
+    
+    def __repr__(self):
+        return f"<EstadisticaUsuariosDiaria {self.fecha}: {self.nuevos_usuarios}>"
+
+
+def columna_estado(estado):
+    """
+    Obtiene el nombre de la columna que cuenta las citas en un estado.
+    
+    Args:
+        estado: Estado de la cita
+    
+    Returns:
+        str: Nombre de la columna
+    """
+    return f'citas_{estado}s' if estado != 'en_curso' else 'citas_en_curso'
+
+
+def _clave_cita(valores):
+    """Obtiene la clave del resumen diario a partir de los valores de una cita."""
+    return (
+        valores['fecha_hora'].date(),
+        valores['centro_medico_id'],
+        valores['especialidad_id'],
+        valores['medico_id']
+    )
+
+
+def aplicar_incrementos(session, modelo, incrementos):
+    """
+    Suma los incrementos a las filas de un resumen, creándolas si no existen.
+    
+    En PostgreSQL y SQLite se usa un único INSERT ... ON CONFLICT DO UPDATE por
+    fila, por lo que dos transacciones concurrentes no chocan al crear la fila.
+    
+    Args:
+        session: Sesión en curso
+        modelo: Modelo del resumen
+        incrementos: dict clave primaria (tupla) -> {columna: incremento}
+    """
+    tabla = modelo.__table__
+    claves = [columna.name for columna in tabla.primary_key.columns]
+    dialecto = session.get_bind().dialect.name
+    
+    for clave, columnas in incrementos.items():
+        columnas = {nombre: valor for nombre, valor in columnas.items() if valor}
+        if not columnas:
+            continue
+        
+        filtro = dict(zip(claves, clave))
+        suma = {nombre: tabla.c[nombre] + valor for nombre, valor in columnas.items()}
+        
+        if dialecto in ('postgresql', 'sqlite'):
+            insertar = (postgresql.insert if dialecto == 'postgresql' else sqlite.insert)(tabla)
+            session.execute(insertar.values(**filtro, **columnas).on_conflict_do_update(
+                index_elements=claves, set_=suma))
+            continue
+        
+        resultado = session.execute(tabla.update().filter_by(**filtro).values(**suma))
+        if not resultado.rowcount:
+            session.execute(tabla.insert().values(**filtro, **columnas))
+
+
+def _sumar(incrementos, clave, columna, valor):
+    """Acumula un incremento para una fila y columna del resumen."""
+    fila = incrementos.setdefault(clave, {})
+    fila[columna] = fila.get(columna, 0) + valor
+
+
+@event.listens_for(Session, 'before_flush')
+def actualizar_estadisticas(session, flush_context, instances):
+    """
+    Actualiza los resúmenes diarios con las citas, consultas y usuarios modificados.
+    
+    Cada cambio de estado de una cita (agendar, confirmar, iniciar, completar,
+    cancelar, reprogramar) resta en la fila y el estado anteriores y suma en los
+    nuevos.
+    """
+    atributos_cita = ('fecha_hora', 'centro_medico_id', 'especialidad_id', 'medico_id', 'estado')
+    atributos_consulta = ('fecha_fin', 'duracion_minutos')
+    
+    citas = {}
+    usuarios = {}
+    
+    with session.no_autoflush:
+        for objeto in list(session.new) + list(session.dirty) + list(session.deleted):
+            if isinstance(objeto, Cita):
+                anterior = None
+                if objeto not in session.new:
+                    anterior = valores_previos(session, objeto, atributos_cita)
+                
+                nuevo = None
+                if objeto not in session.deleted:
+                    nuevo = {atributo: getattr(objeto, atributo) for atributo in atributos_cita}
+                    nuevo['estado'] = nuevo['estado'] or 'pendiente'
+                
+                if anterior == nuevo:
+                    continue
+                
+                if anterior and anterior['fecha_hora'] and anterior['estado'] in ESTADOS_CITA:
+                    _sumar(citas, _clave_cita(anterior), columna_estado(anterior['estado']), -1)
+                if nuevo and nuevo['fecha_hora'] and nuevo['estado'] in ESTADOS_CITA:
+                    _sumar(citas, _clave_cita(nuevo), columna_estado(nuevo['estado']), 1)
+            
+            elif isinstance(objeto, Consulta):
+                anterior = None
+                if objeto not in session.new:
+                    anterior = valores_previos(session, objeto, atributos_consulta)
+                
+                nuevo = None
+                if objeto not in session.deleted:
+                    nuevo = {atributo: getattr(objeto, atributo) for atributo in atributos_consulta}
+                
+                if anterior == nuevo:
+                    continue
+                
+                cita = objeto.cita or (session.get(Cita, objeto.cita_id) if objeto.cita_id else None)
+                if cita is None or cita.fecha_hora is None:
+                    continue
+                
+                # La consulta se contabiliza en la fila de su cita
+                clave = _clave_cita({
+                    'fecha_hora': cita.fecha_hora,
+                    'centro_medico_id': cita.centro_medico_id,
+                    'especialidad_id': cita.especialidad_id,
+                    'medico_id': cita.medico_id
+                })
+                
+                for valores, signo in ((anterior, -1), (nuevo, 1)):
+                    if valores and valores['fecha_fin'] is not None:
+                        _sumar(citas, clave, 'consultas_completadas', signo)
+                        _sumar(citas, clave, 'duracion_total_minutos', signo * (valores['duracion_minutos'] or 0))
+            
+            elif isinstance(objeto, Usuario) and objeto in session.new:
+                # El valor por defecto de la fecha de registro aún no se aplicó
+                fecha = (objeto.fecha_registro or datetime.utcnow()).date()
+                _sumar(usuarios, (fecha,), 'nuevos_usuarios', 1)
+        
+        if citas:
+            aplicar_incrementos(session, EstadisticaDiaria, citas)
+        if usuarios:
+            aplicar_incrementos(session, EstadisticaUsuariosDiaria, usuarios)
+
+
+def recalcular_estadisticas(desde=None):
+    """
+    Reconstruye los resúmenes diarios a partir de citas, consultas y usuarios.
+    
+    Los resúmenes del rango se eliminan y se vuelven a calcular recorriendo
+    las tablas de origen por bloques. No confirma la transacción.
+    
+    Args:
+        desde: Recalcular solo desde esta fecha y hora (por defecto, todo)
+    
+    Returns:
+        tuple: (filas de citas, días de registros de usuarios) calculados
+    """
+    citas_query = db.session.query(
+        Cita.fecha_hora, Cita.centro_medico_id, Cita.especialidad_id, Cita.medico_id, Cita.estado,
+        Consulta.fecha_fin, Consulta.duracion_minutos
+    ).outerjoin(Consulta, Consulta.cita_id == Cita.id)
+    usuarios_query = db.session.query(Usuario.fecha_registro).filter(Usuario.fecha_registro != None)
+    estadisticas_query = EstadisticaDiaria.query
+    estadisticas_usuarios_query = EstadisticaUsuariosDiaria.query
+    
+    if desde:
+        citas_query = citas_query.filter(Cita.fecha_hora >= desde)
+        usuarios_query = usuarios_query.filter(Usuario.fecha_registro >= desde)
+        estadisticas_query = estadisticas_query.filter(EstadisticaDiaria.fecha >= desde.date())
+        estadisticas_usuarios_query = estadisticas_usuarios_query.filter(
+            EstadisticaUsuariosDiaria.fecha >= desde.date())
+    
+    # Eliminar los resúmenes existentes para el rango
+    estadisticas_query.delete(synchronize_session=False)
+    estadisticas_usuarios_query.delete(synchronize_session=False)
+    
+    # Acumular en memoria recorriendo las citas por bloques
+    filas = {}
+    for cita in citas_query.yield_per(1000):
+        if cita.estado not in ESTADOS_CITA:
+            continue
+        
+        clave = (cita.fecha_hora.date(), cita.centro_medico_id, cita.especialidad_id, cita.medico_id)
+        fila = filas.setdefault(clave, {
+            'fecha': clave[0],
+            'centro_medico_id': clave[1],
+            'especialidad_id': clave[2],
+            'medico_id': clave[3],
+            **{columna_estado(estado): 0 for estado in ESTADOS_CITA},
+            'consultas_completadas': 0,
+            'duracion_total_minutos': 0
+        })
+        
+        fila[columna_estado(cita.estado)] += 1
+        if cita.fecha_fin is not None:
+            fila['consultas_completadas'] += 1
+            fila['duracion_total_minutos'] += cita.duracion_minutos or 0
+    
+    usuarios = {}
+    for (fecha_registro,) in usuarios_query.yield_per(1000):
+        usuarios[fecha_registro.date()] = usuarios.get(fecha_registro.date(), 0) + 1
+    
+    if filas:
+        db.session.execute(insert(EstadisticaDiaria), list(filas.values()))
+    if usuarios:
+        db.session.execute(insert(EstadisticaUsuariosDiaria), [
+            {'fecha': fecha, 'nuevos_usuarios': cantidad} for fecha, cantidad in usuarios.items()
+        ])
+    
+    return len(filas), len(usuarios)
@@ -121,9 +121,54 @@ class HorarioMedico(db.Model):
     hora_fin = db.Column(db.Time, nullable=False)
     activo = db.Column(db.Boolean, default=True)
     
+    # Intervalo entre citas en minutos (por defecto 30 minutos)
+    intervalo_citas = db.Column(db.Integer, default=30)
+    
     # Relaciones
     medico = db.relationship('Medico', back_populates='horarios')
     centro_medico = db.relationship('CentroMedico')
     
+    __table_args__ = (
+        db.Index('ix_horarios_medicos_medico_centro', 'medico_id', 'centro_medico_id'),
+    )
+    
     def __repr__(self):
-        return f"<Horario {self.medico_id} - Día: {self.dia_semana}>"
\ No newline at end of file
+        return f"<Horario {self.medico_id} - Día: {self.dia_semana}>"
+
+
+class ExcepcionHorario(db.Model):
+    """
+    Modelo para las excepciones a los horarios semanales (feriados, bloqueos puntuales).
+    
+    Una excepción sin médico aplica a todos los médicos (por ejemplo, un feriado
+    nacional); sin centro aplica a todos los centros del médico; sin horas
+    bloquea el día completo.
+    """
+    __tablename__ = 'excepciones_horario'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    medico_id = db.Column(db.Integer, db.ForeignKey('medicos.usuario_id'), nullable=True)
+    centro_medico_id = db.Column(db.Integer, db.ForeignKey('centros_medicos.id'), nullable=True)
+    fecha = db.Column(db.Date, nullable=False)
+    hora_inicio = db.Column(db.Time, nullable=True)
+    hora_fin = db.Column(db.Time, nullable=True)
+    
+    # Tipo de excepción: feriado, bloqueo
+    tipo = db.Column(db.String(20), default='bloqueo', nullable=False)
+    motivo = db.Column(db.String(200), nullable=True)
+    
+    # Relaciones
+    medico = db.relationship('Medico')
+    centro_medico = db.relationship('CentroMedico')
+    
+    __table_args__ = (
+        db.Index('ix_excepciones_horario_fecha_medico', 'fecha', 'medico_id'),
+    )
+    
+    def __repr__(self):
+        return f"<ExcepcionHorario {self.medico_id} - {self.fecha} ({self.tipo})>"
+    
+    @property
+    def dia_completo(self):
+        """Determina si la excepción bloquea el día completo."""
+        return self.hora_inicio is None or self.hora_fin is None
\ No newline at end of file
@@ -1,9 +1,19 @@
 from datetime import datetime
 from flask_login import UserMixin
-from werkzeug.security import generate_password_hash, check_password_hash
+from sqlalchemy import event
 from sqlalchemy.ext.declarative import declared_attr
+from sqlalchemy.orm import Session
 
 from app.extensions import db
+from app.utils.contrasenas import generar_hash, verificar_hash, necesita_rehash, metricas_contrasenas
+
+# Bit de cada rol del sistema en la máscara denormalizada de usuarios
+BITS_ROLES = {
+    'paciente': 1 << 0,
+    'medico': 1 << 1,
+    'administrador_centro': 1 << 2,
+    'administrador_sistema': 1 << 3,
+}
 
 # Tabla de asociación entre usuarios y roles
 usuarios_roles = db.Table(
@@ -33,6 +43,10 @@ class Usuario(UserMixin, db.Model):
     fecha_registro = db.Column(db.DateTime, default=datetime.utcnow)
     ultimo_acceso = db.Column(db.DateTime, nullable=True)
     
+    # Máscara de bits de los roles (BITS_ROLES), copia de la relación roles.
+    # NULL en filas anteriores a la columna: los roles se leen de la relación.
+    roles_mascara = db.Column(db.Integer, nullable=True)
+    
     # Relaciones
     roles = db.relationship('Rol', secondary=usuarios_roles, 
                             backref=db.backref('usuarios', lazy='dynamic'))
@@ -46,6 +60,11 @@ class Usuario(UserMixin, db.Model):
     # Historial de acceso del usuario
     accesos = db.relationship('HistorialAcceso', back_populates='usuario')
     
+    # Orden de los listados paginados por clave
+    __table_args__ = (
+        db.Index('ix_usuarios_apellido_nombre_id', 'apellido', 'nombre', 'id'),
+    )
+    
     @property
     def password(self):
         """Previene acceso a la contraseña."""
@@ -53,16 +72,44 @@ class Usuario(UserMixin, db.Model):
     
     @password.setter
     def password(self, password):
-        """Establece la contraseña hasheada."""
-        self.password_hash = generate_password_hash(password)
+        """Establece la contraseña hasheada (el cálculo no bloquea el hub de eventlet)."""
+        self.password_hash = generar_hash(password)
     
     def verificar_password(self, password):
-        """Verifica si la contraseña es correcta."""
-        return check_password_hash(self.password_hash, password)
+        """
+        Verifica si la contraseña es correcta.
+        
+        Si el hash se calculó con parámetros distintos a PASSWORD_HASH_METHOD,
+        se vuelve a calcular con la contraseña recién verificada; el cambio se
+        guarda con el próximo commit de la sesión.
+        """
+        if not verificar_hash(self.password_hash, password):
+            return False
+        if necesita_rehash(self.password_hash):
+            self.password = password
+            metricas_contrasenas.registrar_rehash()
+        return True
+    
+    @property
+    def roles_resueltos(self):
+        """
+        Nombres de los roles del usuario, resueltos una sola vez por instancia.
+        
+        Se obtienen de la máscara denormalizada, sin consultas adicionales, salvo
+        que la relación roles ya esté cargada o la máscara aún no exista.
+        """
+        roles = self.__dict__.get('_roles_resueltos')
+        if roles is None:
+            if 'roles' in self.__dict__ or self.roles_mascara is None:
+                roles = frozenset(rol.nombre for rol in self.roles)
+            else:
+                roles = nombres_de_mascara(self.roles_mascara)
+            self.__dict__['_roles_resueltos'] = roles
+        return roles
     
     def tiene_rol(self, nombre_rol):
         """Verifica si el usuario tiene un rol específico."""
-        return any(rol.nombre == nombre_rol for rol in self.roles)
+        return nombre_rol in self.roles_resueltos
     
     def asignar_rol(self, rol):
         """Asigna un rol al usuario."""
@@ -79,13 +126,18 @@ class Usuario(UserMixin, db.Model):
         """Retorna el nombre completo del usuario."""
         return f"{self.nombre} {self.apellido}"
     
-    def registrar_acceso(self):
-        """Registra el acceso del usuario al sistema."""
-        self.ultimo_acceso = datetime.utcnow()
+    def registrar_acceso(self, direccion_ip=None, user_agent=None):
+        """
+        Registra el acceso del usuario al sistema.
+        
+        El acceso se encola al confirmarse la transacción del inicio de sesión
+        y se escribe en historial_accesos por lotes, fuera de ella (ver
+        app.utils.auditoria); si la transacción se revierte, no se registra.
+        """
+        from app.utils.auditoria import registro_accesos
         
-        # Registrar en historial de accesos
-        acceso = HistorialAcceso(usuario_id=self.id)
-        db.session.add(acceso)
+        self.ultimo_acceso = datetime.utcnow()
+        registro_accesos.registrar_al_confirmar(db.session, self.id, direccion_ip, user_agent)
     
     def __repr__(self):
         return f"<Usuario {self.numero_documento} - {self.nombre_completo}>"
@@ -111,6 +163,62 @@ class Usuario(UserMixin, db.Model):
         return self.tiene_rol('paciente')
 
 
+def mascara_de_roles(nombres):
+    """
+    Calcula la máscara de bits de un conjunto de roles.
+    
+    Args:
+        nombres: Nombres de los roles
+    
+    Returns:
+        int: Máscara con el bit de cada rol conocido
+    """
+    mascara = 0
+    for nombre in nombres:
+        mascara |= BITS_ROLES.get(nombre, 0)
+    return mascara
+
+
+def nombres_de_mascara(mascara):
+    """
+    Obtiene los nombres de los roles presentes en una máscara de bits.
+    
+    Args:
+        mascara: Máscara calculada con mascara_de_roles
+    
+    Returns:
+        frozenset: Nombres de los roles
+    """
+    return frozenset(nombre for nombre, bit in BITS_ROLES.items() if mascara & bit)
+
+
+@event.listens_for(Usuario.roles, 'append')
+@event.listens_for(Usuario.roles, 'remove')
+@event.listens_for(Usuario.roles, 'bulk_replace')
+def _descartar_roles_resueltos(usuario, *args):
+    """Descarta los roles resueltos cuando cambia la relación roles."""
+    usuario.__dict__.pop('_roles_resueltos', None)
+
+
+@event.listens_for(Usuario, 'expire')
+@event.listens_for(Usuario, 'refresh')
+def _descartar_roles_al_recargar(usuario, *args):
+    """Descarta los roles resueltos cuando se recargan los atributos del usuario."""
+    # Al expirar la sesión el evento puede llegar para instancias ya liberadas
+    if usuario is not None:
+        usuario.__dict__.pop('_roles_resueltos', None)
+
+
+@event.listens_for(Session, 'before_flush')
+def actualizar_mascara_roles(session, flush_context, instances):
+    """Mantiene roles_mascara al día con los cambios en la relación roles."""
+    for objeto in list(session.new) + list(session.dirty):
+        if not isinstance(objeto, Usuario):
+            continue
+        if objeto in session.new or db.inspect(objeto).attrs.roles.history.has_changes():
+            objeto.roles_mascara = mascara_de_roles(rol.nombre for rol in objeto.roles)
+
+
 class Rol(db.Model):
     """Modelo para los roles del sistema."""
     __tablename__ = 'roles'
@@ -0,0 +1,612 @@
+import heapq
+from bisect import bisect_left
+from datetime import datetime, date, timedelta
+from itertools import accumulate, islice
+
+from sqlalchemy import insert
+from sqlalchemy.exc import IntegrityError
+
+from flask import current_app
+
+from app.extensions import db
+from app.models.cita import (Cita, Disponibilidad, FranjaHoraria, CapacidadDiaria, CupoAgotadoError,
+                             ESTADOS_ACTIVOS)
+from app.models.usuario import Usuario
+from app.models.tipos_usuario import Medico, HorarioMedico, medicos_centros
+from app.models.centro_medico import CentroMedico, EspecialidadCentro
+from app.utils.retencion_horarios import retencion_horarios
+from app.utils.fechas import rango_dias
+from app.utils.horarios_recurrentes import turnos_recurrentes, turnos_recurrentes_medicos
+
+
+def guardar_reserva(*objetos):
+    """
+    Confirma una reserva de horario de forma atómica.
+    
+    La unicidad de las citas activas por médico y horario la garantiza la base
+    de datos, por lo que no se consulta previamente si el horario está libre:
+    si otra reserva concurrente tomó el horario, el commit falla y se revierte.
+    
+    Args:
+        *objetos: Objetos a agregar a la sesión junto con la reserva
+        
+    Returns:
+        bool: True si la reserva se guardó, False si el horario ya estaba tomado
+        
+    Raises:
+        CupoAgotadoError: Si el médico ya no tiene cupo en el día (la sesión
+            queda revertida)
+    """
+    try:
+        db.session.add_all(objetos)
+        db.session.commit()
+        return True
+    except IntegrityError:
+        db.session.rollback()
+        return False
+    except CupoAgotadoError:
+        db.session.rollback()
+        raise
+
+
+def dias_sin_cupo(medico_ids, fecha_inicio, fecha_fin):
+    """
+    Obtiene los días en que los médicos alcanzaron el máximo de citas diarias.
+    
+    Args:
+        medico_ids: Lista de IDs de médicos
+        fecha_inicio: Primera fecha del rango
+        fecha_fin: Última fecha del rango (inclusive)
+        
+    Returns:
+        dict: medico_id -> conjunto de fechas sin cupo
+    """
+    resultado = {medico_id: set() for medico_id in medico_ids}
+    
+    maximo = current_app.config.get('MAX_APPOINTMENTS_PER_DOCTOR_DAY')
+    if not maximo or not medico_ids:
+        return resultado
+    
+    completos = db.session.query(CapacidadDiaria.medico_id, CapacidadDiaria.fecha).filter(
+        CapacidadDiaria.medico_id.in_(medico_ids),
+        CapacidadDiaria.fecha >= fecha_inicio,
+        CapacidadDiaria.fecha <= fecha_fin,
+        CapacidadDiaria.citas_agendadas >= maximo
+    ).all()
+    
+    for medico_id, fecha in completos:
+        resultado[medico_id].add(fecha)
+    
+    return resultado
+
+
+def _solapa(intervalos, inicio, fin):
+    """
+    Determina si el intervalo [inicio, fin) se solapa con alguno de los intervalos.
+    
+    Args:
+        intervalos: Tupla (inicios, max_fines) con los inicios ordenados y el
+            máximo acumulado de los finales en ese orden
+        inicio: Hora de inicio del intervalo a verificar
+        fin: Hora de fin del intervalo a verificar
+        
+    Returns:
+        bool: True si hay solapamiento
+    """
+    inicios, max_fines = intervalos
+    
+    # Intervalos que empiezan antes del fin del nuevo; basta con que el mayor
+    # de sus finales supere el inicio del nuevo para que haya solapamiento
+    n = bisect_left(inicios, fin)
+    return n > 0 and max_fines[n - 1] > inicio
+
+
+def registrar_disponibilidades(medico_id, centro_medico_id, fecha_inicio, fecha_fin, dias_semana,
+                               hora_inicio, hora_fin, intervalo_citas, citas_maximas=0):
+    """
+    Registra en bloque la disponibilidad de un médico para un rango de fechas.
+    
+    Obtiene con una sola consulta las disponibilidades existentes del médico en
+    el rango (en cualquier centro) y con otra sus horarios semanales activos,
+    calcula en memoria los días faltantes y los inserta junto con sus franjas
+    horarias mediante inserciones masivas.
+    
+    Args:
+        medico_id: ID del médico
+        centro_medico_id: ID del centro médico
+        fecha_inicio: Primera fecha del rango
+        fecha_fin: Última fecha del rango (inclusive)
+        dias_semana: Días de la semana seleccionados (0=Lunes)
+        hora_inicio: Hora de inicio de la atención
+        hora_fin: Hora de fin de la atención
+        intervalo_citas: Duración de cada turno en minutos
+        citas_maximas: Máximo de citas por día (0 = sin límite)
+        
+    Returns:
+        dict: Cantidad de días creados, omitidos (ya existentes o cubiertos por
+            el horario semanal) y en conflicto (solapados con otra
+            disponibilidad o con un turno del horario semanal del médico)
+    """
+    resultado = {'creados': 0, 'omitidos': 0, 'conflictos': 0}
+    
+    existentes = db.session.query(
+        Disponibilidad.fecha,
+        Disponibilidad.centro_medico_id,
+        Disponibilidad.hora_inicio,
+        Disponibilidad.hora_fin
+    ).filter(
+        Disponibilidad.medico_id == medico_id,
+        Disponibilidad.fecha >= fecha_inicio,
+        Disponibilidad.fecha <= fecha_fin
+    ).order_by(Disponibilidad.fecha, Disponibilidad.hora_inicio).all()
+    
+    # Agrupar por fecha los intervalos existentes, ordenados por inicio
+    exactos = set()
+    por_fecha = {}
+    for d in existentes:
+        exactos.add((d.fecha, d.centro_medico_id, d.hora_inicio, d.hora_fin))
+        por_fecha.setdefault(d.fecha, []).append((d.hora_inicio, d.hora_fin))
+    
+    # Los turnos del horario semanal (en cualquier centro) también ocupan la agenda del médico
+    reglas_por_dia = {}
+    for regla in db.session.query(
+        HorarioMedico.dia_semana,
+        HorarioMedico.centro_medico_id,
+        HorarioMedico.hora_inicio,
+        HorarioMedico.hora_fin
+    ).filter(HorarioMedico.medico_id == medico_id, HorarioMedico.activo == True):
+        reglas_por_dia.setdefault(regla.dia_semana, []).append(regla)
+    
+    if reglas_por_dia:
+        fecha = fecha_inicio
+        while fecha <= fecha_fin:
+            for regla in reglas_por_dia.get(fecha.weekday(), ()):
+                exactos.add((fecha, regla.centro_medico_id, regla.hora_inicio, regla.hora_fin))
+                por_fecha.setdefault(fecha, []).append((regla.hora_inicio, regla.hora_fin))
+            fecha += timedelta(days=1)
+    
+    intervalos = {}
+    for fecha, tramos in por_fecha.items():
+        tramos.sort()
+        intervalos[fecha] = ([i for i, _ in tramos], list(accumulate((f for _, f in tramos), max)))
+    
+    nuevas = []
+    fecha = fecha_inicio
+    while fecha <= fecha_fin:
+        if fecha.weekday() in dias_semana:
+            if (fecha, centro_medico_id, hora_inicio, hora_fin) in exactos:
+                resultado['omitidos'] += 1
+            elif fecha in intervalos and _solapa(intervalos[fecha], hora_inicio, hora_fin):
+                resultado['conflictos'] += 1
+            else:
+                nuevas.append(Disponibilidad(
+                    medico_id=medico_id,
+                    centro_medico_id=centro_medico_id,
+                    fecha=fecha,
+                    hora_inicio=hora_inicio,
+                    hora_fin=hora_fin,
+                    intervalo_citas=intervalo_citas,
+                    citas_maximas=citas_maximas
+                ))
+        
+        fecha += timedelta(days=1)
+    
+    if not nuevas:
+        return resultado
+    
+    # Insertar todas las disponibilidades en bloque, recuperando sus IDs
+    ids = db.session.scalars(
+        insert(Disponibilidad).returning(Disponibilidad.id, sort_by_parameter_order=True),
+        [{
+            'medico_id': d.medico_id,
+            'centro_medico_id': d.centro_medico_id,
+            'fecha': d.fecha,
+            'hora_inicio': d.hora_inicio,
+            'hora_fin': d.hora_fin,
+            'intervalo_citas': d.intervalo_citas,
+            'citas_maximas': d.citas_maximas
+        } for d in nuevas]
+    ).all()
+    
+    # Citas activas ya agendadas en el rango (por ejemplo, desde un horario
+    # semanal), para marcar sus franjas como ocupadas igual que generar_franjas
+    inicio, fin = rango_dias(fecha_inicio, fecha_fin)
+    citas_ocupadas = dict(db.session.query(Cita.fecha_hora, Cita.id).filter(
+        Cita.medico_id == medico_id,
+        Cita.centro_medico_id == centro_medico_id,
+        Cita.estado.in_(ESTADOS_ACTIVOS),
+        Cita.fecha_hora >= inicio,
+        Cita.fecha_hora < fin
+    ).all())
+    
+    # Materializar las franjas horarias de los días creados
+    franjas = [
+        {
+            'disponibilidad_id': disponibilidad_id,
+            'medico_id': medico_id,
+            'centro_medico_id': centro_medico_id,
+            'fecha': d.fecha,
+            'fecha_hora': horario,
+            'cita_id': citas_ocupadas.get(horario)
+        }
+        for disponibilidad_id, d in zip(ids, nuevas)
+        for horario in d.horarios()
+    ]
+    if franjas:
+        db.session.execute(insert(FranjaHoraria), franjas)
+    
+    resultado['creados'] = len(nuevas)
+    return resultado
+
+
+def _iterar_franjas_libres(medico_id, centro_id, desde, hasta, bloque=None):
+    """
+    Recorre en orden cronológico las franjas libres del índice de un médico en un centro.
+    
+    Las franjas se leen por bloques con paginación por clave (fecha_hora), de
+    modo que quien consume el generador puede detenerse antes de recorrer todo
+    el rango.
+    
+    Args:
+        medico_id: ID del médico
+        centro_id: ID del centro médico
+        desde: Fecha y hora inicial (inclusive)
+        hasta: Fecha y hora final (exclusive)
+        bloque: Cantidad de franjas por consulta (None = una sola consulta)
+        
+    Yields:
+        datetime: Fecha y hora de cada franja libre
+    """
+    ultimo = None
+    
+    while True:
+        query = db.session.query(FranjaHoraria.fecha_hora).filter(
+            FranjaHoraria.medico_id == medico_id,
+            FranjaHoraria.centro_medico_id == centro_id,
+            FranjaHoraria.fecha_hora >= desde,
+            FranjaHoraria.fecha_hora < hasta,
+            FranjaHoraria.cita_id == None
+        )
+        
+        if ultimo is not None:
+            query = query.filter(FranjaHoraria.fecha_hora > ultimo)
+        
+        query = query.order_by(FranjaHoraria.fecha_hora)
+        if bloque:
+            query = query.limit(bloque)
+        
+        franjas = query.all()
+        
+        for franja in franjas:
+            yield franja.fecha_hora
+        
+        if not bloque or len(franjas) < bloque:
+            return
+        
+        ultimo = franjas[-1].fecha_hora
+
+
+def iterar_horarios_libres(medico_id, centro_id, desde, hasta, usuario_id=None, bloque=None):
+    """
+    Recorre en orden cronológico los horarios libres de un médico en un centro.
+    
+    Combina las franjas libres del índice (disponibilidades por fecha) con los
+    turnos calculados al vuelo a partir de los horarios semanales del médico,
+    descartando duplicados, horarios retenidos por otros usuarios y días en
+    que el médico ya no tiene cupo.
+    
+    Ambas fuentes se mantienen a propósito: el horario semanal cubre la
+    agenda habitual sin materializar filas, mientras que las disponibilidades
+    por fecha registran días de atención que no siguen ese patrón (jornadas
+    extraordinarias, centros visitados ocasionalmente) y conservan sus
+    franjas en el índice. Las excepciones solo recortan el horario semanal;
+    un día registrado por fecha se quita eliminando su disponibilidad.
+    
+    Args:
+        medico_id: ID del médico
+        centro_id: ID del centro médico
+        desde: Fecha y hora inicial (inclusive)
+        hasta: Fecha y hora final (exclusive)
+        usuario_id: ID del usuario que consulta; sus propias retenciones se
+            consideran disponibles y las de otros usuarios se excluyen
+        bloque: Cantidad de franjas por consulta (None = una sola consulta)
+        
+    Yields:
+        datetime: Fecha y hora de cada horario libre
+    """
+    retenidos = retencion_horarios.horarios_retenidos(medico_id, excepto_usuario_id=usuario_id)
+    sin_cupo = dias_sin_cupo([medico_id], desde.date(), hasta.date())[medico_id]
+    anterior = None
+    
+    for fecha_hora in heapq.merge(
+        _iterar_franjas_libres(medico_id, centro_id, desde, hasta, bloque=bloque),
+        turnos_recurrentes(medico_id, centro_id, desde, hasta)
+    ):
+        if fecha_hora != anterior and fecha_hora not in retenidos and fecha_hora.date() not in sin_cupo:
+            yield fecha_hora
+        anterior = fecha_hora
+
+
+def obtener_horarios_disponibles(medico_id, centro_id, fecha, usuario_id=None):
+    """
+    Obtiene los horarios disponibles de un médico en una fecha específica.
+    
+    Args:
+        medico_id: ID del médico
+        centro_id: ID del centro médico
+        fecha: Fecha para la que se buscan horarios
+        usuario_id: ID del usuario que consulta; sus propias retenciones se
+            consideran disponibles y las de otros usuarios se excluyen
+        
+    Returns:
+        list: Lista de objetos datetime con los horarios disponibles
+    """
+    desde = datetime.combine(fecha, datetime.min.time())
+    
+    return list(iterar_horarios_libres(medico_id, centro_id, desde, desde + timedelta(days=1),
+                                       usuario_id=usuario_id))
+
+
+def horario_disponible(medico_id, centro_id, fecha_hora, usuario_id=None):
+    """
+    Verifica que un horario sea uno de los ofrecidos y siga libre.
+    
+    Se usa antes de guardar una reserva: el índice único solo impide dos citas
+    activas en el mismo horario, no que se reserve una hora que el médico no
+    atiende en ese centro.
+    
+    Args:
+        medico_id: ID del médico
+        centro_id: ID del centro médico
+        fecha_hora: Fecha y hora solicitada
+        usuario_id: ID del usuario que reserva; su propia retención cuenta
+            como horario libre
+        
+    Returns:
+        bool: True si el horario está ofrecido y libre
+    """
+    return fecha_hora in iterar_horarios_libres(medico_id, centro_id, fecha_hora,
+                                                fecha_hora + timedelta(minutes=1), usuario_id=usuario_id)
+
+
+def medicos_elegibles(especialidad_id, centro_medico_id=None):
+    """
+    Obtiene los pares (médico, centro) que atienden una especialidad.
+    
+    Solo se consideran médicos disponibles y activos, en centros activos que
+    ofrecen la especialidad.
+    
+    Args:
+        especialidad_id: ID de la especialidad
+        centro_medico_id: Restringir a este centro médico (opcional)
+        
+    Returns:
+        list: Lista de tuplas (medico_id, centro_medico_id)
+    """
+    query = db.session.query(
+        medicos_centros.c.medico_id,
+        medicos_centros.c.centro_medico_id
+    ).join(Medico, Medico.usuario_id == medicos_centros.c.medico_id)\
+     .join(Usuario, Usuario.id == Medico.usuario_id)\
+     .join(CentroMedico, CentroMedico.id == medicos_centros.c.centro_medico_id)\
+     .join(EspecialidadCentro, db.and_(
+        EspecialidadCentro.centro_medico_id == CentroMedico.id,
+        EspecialidadCentro.especialidad_id == especialidad_id
+     )).filter(
+        Medico.especialidad_id == especialidad_id,
+        Medico.disponible == True,
+        Usuario.activo == True,
+        CentroMedico.activo == True,
+        EspecialidadCentro.disponible == True
+    )
+    
+    if centro_medico_id:
+        query = query.filter(medicos_centros.c.centro_medico_id == centro_medico_id)
+    
+    return [(fila.medico_id, fila.centro_medico_id) for fila in query.all()]
+
+
+def proximos_horarios_disponibles(especialidad_id, centro_medico_id=None, limite=10,
+                                  usuario_id=None, dias=90):
+    """
+    Obtiene los primeros horarios libres de una especialidad en cualquier centro
+    (o en un centro específico), ordenados cronológicamente.
+    
+    Combina con un montículo los flujos de horarios libres de cada médico
+    elegible y se detiene al alcanzar el límite, sin expandir todo el rango.
+    
+    Args:
+        especialidad_id: ID de la especialidad
+        centro_medico_id: Restringir a este centro médico (opcional)
+        limite: Cantidad máxima de horarios a devolver
+        usuario_id: ID del usuario que consulta
+        dias: Cantidad de días hacia adelante en los que buscar
+        
+    Returns:
+        list: Lista de diccionarios con fecha_hora, medico_id, medico_nombre,
+            centro_id y centro_nombre
+    """
+    desde = datetime.now()
+    hasta = datetime.combine(date.today() + timedelta(days=dias + 1), datetime.min.time())
+    
+    def flujo(medico_id, centro_id):
+        for fecha_hora in iterar_horarios_libres(medico_id, centro_id, desde, hasta,
+                                                 usuario_id=usuario_id, bloque=limite):
+            yield fecha_hora, medico_id, centro_id
+    
+    flujos = [flujo(medico_id, centro_id)
+              for medico_id, centro_id in medicos_elegibles(especialidad_id, centro_medico_id)]
+    horarios = list(islice(heapq.merge(*flujos), limite))
+    
+    if not horarios:
+        return []
+    
+    # Cargar los nombres de médicos y centros con una consulta cada uno
+    medicos = dict(db.session.query(Usuario.id, Usuario.nombre + ' ' + Usuario.apellido).filter(
+        Usuario.id.in_({h[1] for h in horarios})).all())
+    centros = dict(db.session.query(CentroMedico.id, CentroMedico.nombre).filter(
+        CentroMedico.id.in_({h[2] for h in horarios})).all())
+    
+    return [
+        {
+            'fecha_hora': fecha_hora,
+            'medico_id': medico_id,
+            'medico_nombre': medicos.get(medico_id),
+            'centro_id': centro_id,
+            'centro_nombre': centros.get(centro_id)
+        }
+        for fecha_hora, medico_id, centro_id in horarios
+    ]
+
+
+def resumen_horarios_libres(medico_ids, centro_id, fecha_inicio, fecha_fin, usuario_id=None,
+                            detalle=False):
+    """
+    Resume por día los horarios libres de uno o varios médicos en un rango de fechas.
+    
+    Se resuelve con una sola consulta sobre el índice de franjas: agrupada por
+    médico y fecha cuando solo se piden cantidades, o con los horarios de todo
+    el rango cuando se pide el detalle. En el primer caso las retenciones se
+    descuentan consultando solo las franjas retenidas. A esto se suman los
+    turnos calculados a partir de los horarios semanales de todos los
+    médicos, con una consulta por tabla en lugar de varias por médico.
+    
+    Args:
+        medico_ids: Lista de IDs de médicos
+        centro_id: ID del centro médico
+        fecha_inicio: Primera fecha del rango
+        fecha_fin: Última fecha del rango (inclusive)
+        usuario_id: ID del usuario que consulta
+        detalle: Si es True devuelve la lista de horarios de cada día en lugar
+            de la cantidad
+        
+    Returns:
+        dict: medico_id -> {fecha: cantidad} o {fecha: [horarios]}
+    """
+    filtros = (
+        FranjaHoraria.medico_id.in_(medico_ids),
+        FranjaHoraria.centro_medico_id == centro_id,
+        FranjaHoraria.fecha >= fecha_inicio,
+        FranjaHoraria.fecha <= fecha_fin,
+        FranjaHoraria.fecha_hora >= datetime.now(),
+        FranjaHoraria.cita_id == None
+    )
+    
+    resumen = {medico_id: {} for medico_id in medico_ids}
+    retenidos = {
+        medico_id: retencion_horarios.horarios_retenidos(medico_id, excepto_usuario_id=usuario_id)
+        for medico_id in medico_ids
+    }
+    
+    if detalle:
+        franjas = db.session.query(FranjaHoraria.medico_id, FranjaHoraria.fecha_hora)\
+                            .filter(*filtros)\
+                            .order_by(FranjaHoraria.medico_id, FranjaHoraria.fecha_hora).all()
+        
+        for medico_id, fecha_hora in franjas:
+            if fecha_hora not in retenidos[medico_id]:
+                resumen[medico_id].setdefault(fecha_hora.date(), []).append(fecha_hora)
+        
+        for medico_id, fecha, horarios in _turnos_recurrentes_por_dia(medico_ids, centro_id, fecha_inicio,
+                                                                      fecha_fin, retenidos):
+            existentes = resumen[medico_id].get(fecha, [])
+            resumen[medico_id][fecha] = sorted(set(existentes).union(horarios))
+        
+        return _quitar_dias_sin_cupo(resumen, fecha_inicio, fecha_fin)
+    
+    cantidades = db.session.query(
+        FranjaHoraria.medico_id,
+        FranjaHoraria.fecha,
+        db.func.count(FranjaHoraria.id)
+    ).filter(*filtros).group_by(FranjaHoraria.medico_id, FranjaHoraria.fecha).all()
+    
+    for medico_id, fecha, cantidad in cantidades:
+        resumen[medico_id][fecha] = cantidad
+    
+    # Descontar las franjas libres retenidas por otros pacientes; los turnos
+    # recurrentes retenidos ya se excluyen al calcularlos
+    todos_retenidos = set().union(*retenidos.values())
+    if todos_retenidos:
+        for medico_id, fecha_hora in db.session.query(FranjaHoraria.medico_id, FranjaHoraria.fecha_hora)\
+                                               .filter(*filtros, FranjaHoraria.fecha_hora.in_(todos_retenidos)).all():
+            if fecha_hora in retenidos[medico_id]:
+                fecha = fecha_hora.date()
+                resumen[medico_id][fecha] -= 1
+                if not resumen[medico_id][fecha]:
+                    del resumen[medico_id][fecha]
+    
+    for medico_id, fecha, horarios in _turnos_recurrentes_por_dia(medico_ids, centro_id, fecha_inicio,
+                                                                  fecha_fin, retenidos):
+        resumen[medico_id][fecha] = resumen[medico_id].get(fecha, 0) + len(horarios)
+    
+    return _quitar_dias_sin_cupo(resumen, fecha_inicio, fecha_fin)
+
+
+def _quitar_dias_sin_cupo(resumen, fecha_inicio, fecha_fin):
+    """
+    Elimina del resumen los días en que cada médico ya no tiene cupo.
+    
+    Args:
+        resumen: Diccionario medico_id -> {fecha: valor}
+        fecha_inicio: Primera fecha del rango
+        fecha_fin: Última fecha del rango (inclusive)
+        
+    Returns:
+        dict: El mismo resumen, sin los días completos
+    """
+    for medico_id, fechas in dias_sin_cupo(list(resumen), fecha_inicio, fecha_fin).items():
+        for fecha in fechas:
+            resumen[medico_id].pop(fecha, None)
+    
+    return resumen
+
+
+def _turnos_recurrentes_por_dia(medico_ids, centro_id, fecha_inicio, fecha_fin, retenidos):
+    """
+    Agrupa por día los turnos libres calculados a partir de los horarios semanales.
+    
+    Los turnos que coinciden con una franja del índice se omiten para no
+    contarlos dos veces.
+    
+    Args:
+        medico_ids: Lista de IDs de médicos
+        centro_id: ID del centro médico
+        fecha_inicio: Primera fecha del rango
+        fecha_fin: Última fecha del rango (inclusive)
+        retenidos: Diccionario medico_id -> horarios retenidos por otros usuarios
+        
+    Yields:
+        tuple: (medico_id, fecha, lista de horarios) por cada día con turnos
+    """
+    desde = max(datetime.combine(fecha_inicio, datetime.min.time()), datetime.now())
+    hasta = datetime.combine(fecha_fin + timedelta(days=1), datetime.min.time())
+    
+    turnos = {}
+    for medico_id, turnos_medico in turnos_recurrentes_medicos(medico_ids, centro_id, desde, hasta).items():
+        libres = [t for t in turnos_medico if t not in retenidos[medico_id]]
+        if libres:
+            turnos[medico_id] = libres
+    
+    if not turnos:
+        return
+    
+    # Franjas del índice (libres u ocupadas) que ya representan esos horarios
+    indexados = {
+        (fila.medico_id, fila.fecha_hora) for fila in db.session.query(
+            FranjaHoraria.medico_id, FranjaHoraria.fecha_hora
+        ).filter(
+            FranjaHoraria.medico_id.in_(list(turnos)),
+            FranjaHoraria.centro_medico_id == centro_id,
+            FranjaHoraria.fecha_hora >= min(libres[0] for libres in turnos.values()),
+            FranjaHoraria.fecha_hora <= max(libres[-1] for libres in turnos.values())
+        ).all()
+    }
+    
+    for medico_id, libres in turnos.items():
+        por_dia = {}
+        for turno in libres:
+            if (medico_id, turno) not in indexados:
+                por_dia.setdefault(turno.date(), []).append(turno)
+        
+        for fecha, horarios in por_dia.items():
+            yield medico_id, fecha, horarios
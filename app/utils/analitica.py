@@ -0,0 +1,337 @@
+from datetime import date, datetime, timedelta
+
+from sqlalchemy import select
+
+from app.extensions import db
+from app.models.usuario import Usuario
+from app.models.tipos_usuario import Especialidad
+from app.models.centro_medico import CentroMedico
+from app.models.cita import Cita
+from app.models.consulta import Consulta
+from app.utils.fechas import rango_dias, inicio_del_dia
+from app.utils.cache_paneles import cache_paneles
+
+# Tiempo tras la hora de una cita confirmada sin iniciar para considerarla inasistencia
+MARGEN_INASISTENCIA = timedelta(hours=1)
+
+# Tramos de anticipación de la reserva: (límite superior en horas, etiqueta)
+TRAMOS_ANTICIPACION = [
+    (24, 'menos de 24 h'),
+    (72, '1 a 3 días'),
+    (168, '3 a 7 días'),
+    (720, '7 a 30 días'),
+    (None, 'más de 30 días'),
+]
+
+DIAS_SEMANA = ['lunes', 'martes', 'miércoles', 'jueves', 'viernes', 'sábado', 'domingo']
+
+
+# Percentiles de duración que se informan
+PERCENTILES = (50, 90, 99)
+
+
+def _filtrar_citas(consulta, centro_id, fecha_inicio, fecha_fin):
+    """Aplica los filtros de centro y rango de fechas de la cita a una consulta."""
+    if centro_id:
+        consulta = consulta.where(Cita.centro_medico_id == centro_id)
+    if fecha_inicio or fecha_fin:
+        desde, hasta = rango_dias(fecha_inicio or fecha_fin, fecha_fin or fecha_inicio)
+        if fecha_inicio:
+            consulta = consulta.where(Cita.fecha_hora >= desde)
+        if fecha_fin:
+            consulta = consulta.where(Cita.fecha_hora < hasta)
+    return consulta
+
+
+def _percentil_sql(duraciones, p):
+    """
+    Expresión agregada con el percentil p de la duración de cada grupo.
+    
+    Interpola linealmente entre los valores en las posiciones inferior y
+    superior a (n - 1) * p / 100, igual que percentile_cont. Las posiciones se
+    calculan con división entera para que la expresión sea la misma en SQLite
+    y PostgreSQL.
+    
+    Args:
+        duraciones: Subconsulta con las columnas duracion, posicion (0 a n - 1
+            dentro del grupo, en orden de duración) y n (filas del grupo)
+        p: Percentil entero entre 0 y 100
+    """
+    escala = (duraciones.c.n - 1) * p
+    inferior = escala // 100
+    valor_inferior = db.func.max(db.case((duraciones.c.posicion == inferior, duraciones.c.duracion)))
+    valor_superior = db.func.coalesce(
+        db.func.max(db.case((duraciones.c.posicion == inferior + 1, duraciones.c.duracion))),
+        valor_inferior
+    )
+    fraccion = db.func.max(escala - inferior * 100) / 100.0
+    return (valor_inferior + (valor_superior - valor_inferior) * fraccion).label(f'p{p}')
+
+
+def _resumir_duraciones_por(agrupacion, centro_id, fecha_inicio, fecha_fin):
+    """
+    Resume en la base de datos las duraciones de las consultas finalizadas por grupo.
+    
+    Una subconsulta numera las duraciones de cada grupo con row_number() y
+    las cuenta con count() como funciones de ventana; la consulta externa
+    agrupa con GROUP BY y calcula cantidad, media, percentiles, duración
+    reservada media y tasa de exceso, de modo que solo se transfiere una
+    fila por grupo.
+    
+    Args:
+        agrupacion: Columnas (identificador, nombre) del grupo, o () para el total
+        centro_id: Limitar a un centro médico (opcional)
+        fecha_inicio: Fecha inicial de la cita (opcional)
+        fecha_fin: Fecha final de la cita, inclusive (opcional)
+    
+    Returns:
+        list: Resúmenes (dict) con 'id' y 'nombre' del grupo
+    """
+    claves = [columna.label(f'clave_{indice}') for indice, columna in enumerate(agrupacion)]
+    particion = list(agrupacion) or None
+    
+    consulta = select(
+        *claves,
+        Consulta.duracion_minutos.label('duracion'),
+        db.func.coalesce(Cita.duracion, 30).label('reservada'),
+        (db.func.row_number().over(partition_by=particion, order_by=Consulta.duracion_minutos) - 1).label('posicion'),
+        db.func.count().over(partition_by=particion).label('n')
+    ).select_from(Consulta).join(Cita, Consulta.cita_id == Cita.id)\
+     .join(Usuario, Cita.medico_id == Usuario.id)\
+     .join(Especialidad, Cita.especialidad_id == Especialidad.id)\
+     .where(Consulta.fecha_fin != None, Consulta.duracion_minutos != None)
+    duraciones = _filtrar_citas(consulta, centro_id, fecha_inicio, fecha_fin).subquery()
+    
+    grupo = [duraciones.c[clave.name] for clave in claves]
+    filas = db.session.execute(select(
+        *grupo,
+        db.func.count().label('consultas'),
+        db.func.avg(duraciones.c.duracion).label('media'),
+        *[_percentil_sql(duraciones, p) for p in PERCENTILES],
+        db.func.avg(duraciones.c.reservada).label('duracion_reservada_media'),
+        db.func.avg(db.case((duraciones.c.duracion > duraciones.c.reservada, 1.0), else_=0.0)).label('tasa_exceso')
+    ).group_by(*grupo).order_by(*grupo[1:])).all()
+    
+    return [{
+        'id': fila[0] if grupo else None,
+        'nombre': fila[1] if grupo else None,
+        'consultas': fila.consultas,
+        'media': round(float(fila.media), 1),
+        **{f'p{p}': round(float(getattr(fila, f'p{p}')), 1) for p in PERCENTILES},
+        'duracion_reservada_media': round(float(fila.duracion_reservada_media), 1),
+        'tasa_exceso': round(float(fila.tasa_exceso), 3)
+    } for fila in filas if fila.consultas]
+
+
+def analizar_duraciones(centro_id=None, fecha_inicio=None, fecha_fin=None):
+    """
+    Analiza la duración de las consultas finalizadas por médico y especialidad.
+    
+    La agregación se hace en la base de datos (ver _resumir_duraciones_por):
+    se ejecuta una consulta para el total y una por cada agrupación, y no se
+    recorren las consultas en Python.
+    
+    Args:
+        centro_id: Limitar a un centro médico (opcional)
+        fecha_inicio: Fecha inicial de la cita (opcional)
+        fecha_fin: Fecha final de la cita, inclusive (opcional)
+    
+    Returns:
+        dict: Resumen general, 'por_medico' y 'por_especialidad' (listas de
+              resúmenes con el identificador y nombre de cada grupo)
+    """
+    general = _resumir_duraciones_por((), centro_id, fecha_inicio, fecha_fin)
+    if not general:
+        return {'general': None, 'por_medico': [], 'por_especialidad': []}
+    
+    def por(clave, nombre, campo):
+        return [
+            {f'{campo}_id': resumen.pop('id'), campo: resumen.pop('nombre'), **resumen}
+            for resumen in _resumir_duraciones_por((clave, nombre), centro_id, fecha_inicio, fecha_fin)
+        ]
+    
+    general = general[0]
+    del general['id'], general['nombre']
+    return {
+        'general': general,
+        'por_medico': por(Cita.medico_id, Usuario.nombre + ' ' + Usuario.apellido, 'medico'),
+        'por_especialidad': por(Cita.especialidad_id, Especialidad.nombre, 'especialidad')
+    }
+
+
+def leer_rango(argumentos, dias=90):
+    """
+    Obtiene el rango de fechas de un análisis de los parámetros de una solicitud.
+    
+    Args:
+        argumentos: Parámetros de la solicitud (request.args)
+        dias: Días hacia atrás del rango por defecto
+    
+    Returns:
+        tuple: (fecha_inicio, fecha_fin); por defecto, los últimos `dias` días
+    """
+    fecha_fin = date.today()
+    fecha_inicio = fecha_fin - timedelta(days=dias)
+    
+    try:
+        if argumentos.get('fecha_inicio'):
+            fecha_inicio = datetime.strptime(argumentos['fecha_inicio'], '%Y-%m-%d').date()
+        if argumentos.get('fecha_fin'):
+            fecha_fin = datetime.strptime(argumentos['fecha_fin'], '%Y-%m-%d').date()
+    except ValueError:
+        pass
+    
+    return fecha_inicio, fecha_fin
+
+
+def _resumir_cancelaciones(contadores):
+    """
+    Calcula las tasas de un grupo a partir de sus contadores.
+    
+    Args:
+        contadores: [citas, canceladas, vencidas, no_asistidas]
+    
+    Returns:
+        dict: Cantidades y tasas de cancelación e inasistencia
+    """
+    citas, canceladas, vencidas, no_asistidas = contadores
+    return {
+        'citas': citas,
+        'canceladas': canceladas,
+        'tasa_cancelacion': round(canceladas / citas, 3) if citas else None,
+        'citas_vencidas': vencidas,
+        'no_asistidas': no_asistidas,
+        'tasa_inasistencia': round(no_asistidas / vencidas, 3) if vencidas else None
+    }
+
+
+def _dia_semana_sql(dialecto):
+    """Expresión con el día de la semana de la cita (0 = lunes, como date.weekday())."""
+    if dialecto == 'sqlite':
+        domingo_cero = db.cast(db.func.strftime('%w', Cita.fecha_hora), db.Integer)
+    else:
+        domingo_cero = db.cast(db.extract('dow', Cita.fecha_hora), db.Integer)
+    return (domingo_cero + 6) % 7
+
+
+def _tramo_anticipacion_sql(dialecto, desfase):
+    """
+    Expresión con el índice del tramo de anticipación de la reserva de la cita.
+    
+    Es NULL para las citas sin fecha de creación, que no se agrupan por
+    anticipación.
+    
+    Args:
+        dialecto: Nombre del dialecto de la base de datos
+        desfase: Diferencia entre la hora local y UTC (fecha_creacion está en UTC)
+    """
+    if dialecto == 'sqlite':
+        horas = (db.func.julianday(Cita.fecha_hora) - db.func.julianday(Cita.fecha_creacion)) * 24
+    else:
+        horas = db.extract('epoch', Cita.fecha_hora - Cita.fecha_creacion) / 3600
+    horas = horas - desfase.total_seconds() / 3600
+    
+    return db.case(*[
+        (horas < limite if limite is not None else Cita.fecha_creacion != None, indice)
+        for indice, (limite, etiqueta) in enumerate(TRAMOS_ANTICIPACION)
+    ])
+
+
+def analizar_cancelaciones(centro_id=None, fecha_inicio=None, fecha_fin=None, ahora=None):
+    """
+    Analiza las tasas de cancelación e inasistencia de las citas.
+    
+    Se considera inasistencia una cita confirmada que no se inició pasado
+    MARGEN_INASISTENCIA desde su hora; la tasa se calcula sobre las citas no
+    canceladas cuya hora ya pasó ese margen. Los contadores se calculan en la
+    base de datos con una consulta GROUP BY por agrupación (médico, centro,
+    especialidad, día de la semana, anticipación de la reserva y quién
+    canceló); las citas no se recorren en Python.
+    
+    Args:
+        centro_id: Limitar a un centro médico (opcional)
+        fecha_inicio: Fecha inicial de la cita (opcional)
+        fecha_fin: Fecha final de la cita, inclusive (opcional)
+        ahora: Fecha y hora de referencia (por defecto, la actual)
+    
+    Returns:
+        dict: Resumen general y listas de resúmenes por cada agrupación
+    """
+    ahora = ahora or datetime.now()
+    limite_vencidas = ahora - MARGEN_INASISTENCIA
+    dialecto = db.session.get_bind().dialect.name
+    
+    # Las fechas de creación se guardan en UTC y las de las citas en hora local
+    desfase = datetime.now() - datetime.utcnow()
+    
+    cancelada = Cita.estado == 'cancelada'
+    vencida = db.and_(Cita.estado != 'cancelada', Cita.fecha_hora < limite_vencidas)
+    contadores = [
+        db.func.count(Cita.id),
+        *[db.func.coalesce(db.func.sum(db.case((condicion, 1), else_=0)), 0)
+          for condicion in (cancelada, vencida, db.and_(vencida, Cita.estado == 'confirmada'))]
+    ]
+    
+    # Agrupación: (identificador, nombre en la base de datos o función que lo obtiene del identificador)
+    agrupaciones = {
+        'medico': (Cita.medico_id, Usuario.nombre + ' ' + Usuario.apellido),
+        'centro_medico': (Cita.centro_medico_id, CentroMedico.nombre),
+        'especialidad': (Cita.especialidad_id, Especialidad.nombre),
+        'dia_semana': (_dia_semana_sql(dialecto), lambda dia: DIAS_SEMANA[dia]),
+        'anticipacion': (_tramo_anticipacion_sql(dialecto, desfase),
+                         lambda indice: TRAMOS_ANTICIPACION[indice][1]),
+        'cancelado_por': (db.case(
+            (db.and_(cancelada, Cita.cancelado_por == Cita.paciente_id), 'paciente'),
+            (db.and_(cancelada, Cita.cancelado_por == Cita.medico_id), 'medico'),
+            (cancelada, 'otro')
+        ), lambda quien: quien),
+    }
+    
+    def contar(*columnas):
+        consulta = select(*columnas, *contadores).select_from(Cita)\
+            .join(Usuario, Cita.medico_id == Usuario.id)\
+            .join(CentroMedico, Cita.centro_medico_id == CentroMedico.id)\
+            .join(Especialidad, Cita.especialidad_id == Especialidad.id)
+        if columnas:
+            consulta = consulta.where(columnas[0] != None).group_by(*columnas).order_by(columnas[0])
+        return db.session.execute(_filtrar_citas(consulta, centro_id, fecha_inicio, fecha_fin)).all()
+    
+    resultado = {'general': _resumir_cancelaciones(contar()[0])}
+    for agrupacion, (clave, nombre) in agrupaciones.items():
+        if callable(nombre):
+            resultado[f'por_{agrupacion}'] = [
+                {'id': fila[0], 'nombre': nombre(fila[0]), **_resumir_cancelaciones(fila[1:])}
+                for fila in contar(clave)
+            ]
+        else:
+            resultado[f'por_{agrupacion}'] = [
+                {'id': fila[0], 'nombre': fila[1], **_resumir_cancelaciones(fila[2:])}
+                for fila in contar(clave, nombre)
+            ]
+    
+    return resultado
+
+
+def cancelaciones_del_dia(centro_id=None, fecha_inicio=None, fecha_fin=None):
+    """
+    Obtiene el análisis de cancelaciones, calculado como máximo una vez por día.
+    
+    El resultado se guarda en la caché de paneles hasta la medianoche para cada
+    combinación de centro y rango de fechas.
+    
+    Args:
+        centro_id: Limitar a un centro médico (opcional)
+        fecha_inicio: Fecha inicial de la cita (opcional)
+        fecha_fin: Fecha final de la cita, inclusive (opcional)
+    
+    Returns:
+        dict: Resultado de analizar_cancelaciones
+    """
+    hoy = date.today()
+    vigencia = (inicio_del_dia(hoy + timedelta(days=1)) - datetime.now()).total_seconds()
+    
+    return cache_paneles.obtener(
+        ('analitica', 'cancelaciones', centro_id, fecha_inicio, fecha_fin, hoy),
+        lambda: analizar_cancelaciones(centro_id, fecha_inicio, fecha_fin),
+        ttl=vigencia
+    )
@@ -0,0 +1,375 @@
+import atexit
+import json
+import os
+import re
+import threading
+from collections import deque
+from datetime import datetime
+
+from flask import current_app
+from sqlalchemy import event, insert
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import Session
+
+from app.extensions import db, socketio
+from app.models.usuario import HistorialAcceso
+
+
+def _a_json(valor):
+    """Convierte a texto los valores que json no serializa (fechas)."""
+    return valor.isoformat() if isinstance(valor, datetime) else str(valor)
+
+
+def _proceso_activo(pid):
+    """Indica si existe un proceso con el pid indicado."""
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class RegistroAccesos:
+    """
+    Cola en memoria de los accesos al sistema, escrita en la base de datos por lotes.
+    
+    Los inicios de sesión solo encolan el evento, una vez confirmada su
+    transacción; un hilo verde inserta los accesos pendientes con un único
+    INSERT por lote cada AUDIT_FLUSH_SECONDS, o antes si la cola alcanza
+    AUDIT_BATCH_SIZE eventos. Si la base de datos no está disponible, el lote
+    se agrega al archivo de respaldo del proceso (AUDIT_FALLBACK_FILE con el
+    pid agregado, una línea JSON por acceso) y se reenvía en lotes propios
+    antes de la siguiente escritura. Los respaldos de procesos que ya
+    terminaron los reenvía cualquier otro proceso.
+    
+    Si la base de datos rechaza un lote, se reintenta fila por fila y los
+    accesos rechazados se apartan al archivo de cuarentena, de modo que una
+    fila inválida no bloquee a las siguientes.
+    
+    Los accesos encolados se pierden solo si el proceso termina de forma
+    abrupta; al salir normalmente la cola se escribe (ver atexit).
+    """
+    
+    def __init__(self):
+        self._pendientes = deque()
+        self._lock = threading.Lock()
+        self._escritura = threading.Lock()  # Una sola escritura a la vez
+        self._app = None
+        self._trabajador = None
+        self.escritos = 0
+        self.respaldados = 0
+        self.apartados = 0
+    
+    def registrar(self, usuario_id, direccion_ip=None, user_agent=None):
+        """
+        Encola un acceso de un usuario.
+        
+        Args:
+            usuario_id: Identificador del usuario
+            direccion_ip: Dirección IP de la solicitud
+            user_agent: User agent del navegador (se trunca a 255 caracteres)
+        """
+        app = current_app._get_current_object()
+        evento = {
+            'usuario_id': usuario_id,
+            'fecha_hora': datetime.utcnow(),
+            'direccion_ip': direccion_ip,
+            'user_agent': user_agent[:255] if user_agent else None,
+        }
+        
+        with self._lock:
+            self._app = self._app or app
+            self._pendientes.append(evento)
+            lleno = len(self._pendientes) >= app.config.get('AUDIT_BATCH_SIZE', 100)
+        
+        if lleno:
+            # Con el hilo verde activo la escritura se hace fuera de la solicitud
+            if self._trabajador is not None:
+                socketio.start_background_task(self.vaciar, app)
+            else:
+                self.vaciar(app)
+    
+    def registrar_al_confirmar(self, session, usuario_id, direccion_ip=None, user_agent=None):
+        """
+        Encola un acceso cuando se confirme la transacción en curso de la sesión.
+        
+        Si la transacción se revierte, el acceso se descarta.
+        
+        Args:
+            session: Sesión de la transacción del inicio de sesión
+            usuario_id: Identificador del usuario
+            direccion_ip: Dirección IP de la solicitud
+            user_agent: User agent del navegador
+        """
+        session.info.setdefault('accesos_pendientes', []).append((usuario_id, direccion_ip, user_agent))
+    
+    def vaciar(self, app=None):
+        """
+        Escribe en la base de datos los accesos respaldados y los encolados.
+        
+        Args:
+            app: Aplicación Flask (por defecto la que registró el primer acceso)
+        
+        Returns:
+            int: Cantidad de accesos escritos en la base de datos
+        """
+        app = app or self._app
+        if app is None:
+            return 0
+        
+        with self._escritura:
+            with self._lock:
+                lote = list(self._pendientes)
+                self._pendientes.clear()
+            
+            with app.app_context():
+                try:
+                    escritos, disponible = self._reenviar_respaldos(app)
+                except OSError as e:
+                    app.logger.error(f'Error al reenviar el respaldo local de accesos: {e}')
+                    escritos, disponible = 0, False
+                
+                # Si la base de datos no aceptó el respaldo, el lote va directo al respaldo
+                pendientes = lote
+                if disponible and lote:
+                    escritos_lote, pendientes = self._escribir(app, lote)
+                    escritos += escritos_lote
+                
+                if pendientes:
+                    try:
+                        self._respaldar(app, pendientes)
+                    except OSError as e:
+                        app.logger.error(f'Error al guardar el respaldo local, los accesos vuelven a la cola: {e}')
+                        with self._lock:
+                            self._pendientes.extendleft(reversed(pendientes))
+        
+        self.escritos += escritos
+        return escritos
+    
+    def _insertar(self, filas):
+        """Inserta accesos con un único INSERT y confirma la transacción."""
+        try:
+            db.session.execute(insert(HistorialAcceso), filas)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+    
+    def _escribir(self, app, filas):
+        """
+        Inserta accesos en lotes de AUDIT_BATCH_SIZE.
+        
+        Un lote rechazado se reintenta fila por fila y las filas que la base de
+        datos rechaza se apartan a la cuarentena. Si la base de datos no está
+        disponible (OperationalError) se detiene la escritura.
+        
+        Returns:
+            tuple: (cantidad de accesos escritos, lista de accesos sin escribir)
+        """
+        tamano = app.config.get('AUDIT_BATCH_SIZE', 100)
+        escritos = 0
+        
+        for inicio in range(0, len(filas), tamano):
+            lote = filas[inicio:inicio + tamano]
+            try:
+                self._insertar(lote)
+                escritos += len(lote)
+                continue
+            except OperationalError as e:
+                app.logger.error(f'Error al escribir accesos, se guardan en el respaldo local: {e}')
+                return escritos, filas[inicio:]
+            except Exception as e:
+                app.logger.warning(f'Lote de accesos rechazado, se reintenta fila por fila: {e}')
+            
+            for posicion, fila in enumerate(lote):
+                try:
+                    self._insertar([fila])
+                    escritos += 1
+                except OperationalError as e:
+                    app.logger.error(f'Error al escribir accesos, se guardan en el respaldo local: {e}')
+                    return escritos, filas[inicio + posicion:]
+                except Exception as e:
+                    self._apartar(app, fila, e)
+        
+        return escritos, []
+    
+    def _reenviar_respaldos(self, app):
+        """
+        Reenvía los archivos de respaldo del proceso y los de procesos terminados.
+        
+        Cada archivo se borra solo después de escribir todos sus accesos; si la
+        base de datos deja de responder, el archivo se reemplaza de forma
+        atómica por los accesos que faltan escribir.
+        
+        Returns:
+            tuple: (cantidad de accesos escritos, True si la base de datos aceptó todo)
+        """
+        escritos = 0
+        
+        while True:
+            reenvio = self._tomar_respaldo(app)
+            if reenvio is None:
+                return escritos, True
+            
+            escritos_archivo, pendientes = self._escribir(app, self._leer_respaldo(app, reenvio))
+            escritos += escritos_archivo
+            
+            if pendientes:
+                # Sin los accesos ya escritos ni los apartados a la cuarentena
+                temporal = reenvio + '.tmp'
+                self._guardar(temporal, pendientes, modo='w')
+                os.replace(temporal, reenvio)
+                return escritos, False
+            
+            os.remove(reenvio)
+    
+    def _ruta_base(self, app):
+        """Ruta configurada del respaldo (por defecto en la carpeta instance)."""
+        return app.config.get('AUDIT_FALLBACK_FILE') or os.path.join(app.instance_path, 'auditoria_accesos.jsonl')
+    
+    def _ruta_respaldo(self, app):
+        """Ruta del archivo de respaldo del proceso actual (incluye su pid)."""
+        base, extension = os.path.splitext(self._ruta_base(app))
+        return f'{base}.{os.getpid()}{extension}'
+    
+    def _ruta_cuarentena(self, app):
+        """Ruta del archivo con los accesos que la base de datos rechazó."""
+        base, extension = os.path.splitext(self._ruta_base(app))
+        return f'{base}.cuarentena{extension}'
+    
+    def _respaldos_huerfanos(self, app):
+        """
+        Obtiene los archivos de respaldo de procesos que ya terminaron.
+        
+        Incluye el archivo sin pid de versiones anteriores.
+        """
+        directorio, nombre = os.path.split(self._ruta_base(app))
+        base, extension = os.path.splitext(nombre)
+        patron = re.compile(re.escape(base) + r'(?:\.(\d+))?' + re.escape(extension) + r'(?:\.reenvio)?')
+        
+        if not os.path.isdir(directorio or '.'):
+            return []
+        
+        huerfanos = []
+        for archivo in sorted(os.listdir(directorio or '.')):
+            coincidencia = patron.fullmatch(archivo)
+            if coincidencia and (coincidencia.group(1) is None or not _proceso_activo(int(coincidencia.group(1)))):
+                huerfanos.append(os.path.join(directorio, archivo))
+        return huerfanos
+    
+    def _tomar_respaldo(self, app):
+        """
+        Elige el próximo archivo de respaldo a reenviar y lo renombra a '.reenvio'.
+        
+        Primero se retoma un reenvío interrumpido, luego el respaldo del
+        proceso y por último los de procesos que ya terminaron. Los accesos
+        que se respalden mientras tanto van a un archivo nuevo.
+        
+        Returns:
+            str: Ruta del archivo tomado, o None si no hay respaldos
+        """
+        ruta = self._ruta_respaldo(app)
+        reenvio = ruta + '.reenvio'
+        if os.path.exists(reenvio):
+            return reenvio
+        
+        for candidato in [ruta] + self._respaldos_huerfanos(app):
+            try:
+                os.replace(candidato, reenvio)
+            except FileNotFoundError:
+                # Otro proceso lo tomó primero
+                continue
+            return reenvio
+        return None
+    
+    def _guardar(self, ruta, filas, modo='a'):
+        """Escribe accesos en un archivo, una línea JSON por acceso, y lo sincroniza en disco."""
+        os.makedirs(os.path.dirname(ruta) or '.', exist_ok=True)
+        with open(ruta, modo, encoding='utf-8') as archivo:
+            for evento in filas:
+                archivo.write(json.dumps(evento, default=_a_json) + '\n')
+            archivo.flush()
+            os.fsync(archivo.fileno())
+    
+    def _respaldar(self, app, filas):
+        """Agrega accesos al final del archivo de respaldo del proceso."""
+        if not filas:
+            return
+        self._guardar(self._ruta_respaldo(app), filas)
+        self.respaldados += len(filas)
+    
+    def _apartar(self, app, evento, error):
+        """Agrega a la cuarentena un acceso rechazado, junto con el motivo."""
+        app.logger.error(f'Acceso rechazado, se aparta a la cuarentena: {error}')
+        self.apartados += 1
+        try:
+            self._guardar(self._ruta_cuarentena(app), [dict(evento, error=str(error))])
+        except OSError as e:
+            # El acceso queda al menos en el registro de la aplicación
+            app.logger.error(f'Error al escribir la cuarentena de accesos ({e}): '
+                             f'{json.dumps(evento, default=_a_json)}')
+    
+    def _leer_respaldo(self, app, ruta):
+        """
+        Lee los accesos de un archivo de respaldo.
+        
+        Las líneas que no se pueden interpretar se apartan a la cuarentena.
+        
+        Returns:
+            list: Accesos del archivo
+        """
+        filas = []
+        with open(ruta, encoding='utf-8') as archivo:
+            for linea in archivo:
+                if not linea.strip():
+                    continue
+                try:
+                    evento = json.loads(linea)
+                    evento['fecha_hora'] = datetime.fromisoformat(evento['fecha_hora'])
+                except (ValueError, TypeError, KeyError) as e:
+                    self._apartar(app, {'linea': linea.rstrip('\n')}, e)
+                    continue
+                filas.append(evento)
+        return filas
+    
+    def ejecutar(self, app):
+        """Escribe los accesos encolados cada AUDIT_FLUSH_SECONDS segundos."""
+        intervalo = app.config.get('AUDIT_FLUSH_SECONDS', 5)
+        while True:
+            # Cede el control al resto de hilos verdes mientras espera
+            socketio.sleep(intervalo)
+            try:
+                self.vaciar(app)
+            except Exception as e:
+                app.logger.error(f'Error al vaciar la cola de accesos: {e}')
+    
+    def iniciar(self, app):
+        """
+        Inicia la escritura periódica como hilo verde dentro del proceso.
+        
+        Args:
+            app: Aplicación Flask
+        """
+        self._app = app
+        self._trabajador = socketio.start_background_task(self.ejecutar, app)
+        atexit.register(self.vaciar, app)
+        return self._trabajador
+
+
+# Instancia compartida por el proceso
+registro_accesos = RegistroAccesos()
+
+
+@event.listens_for(Session, 'after_commit')
+def _encolar_accesos_confirmados(session):
+    """Encola los accesos de la sesión una vez confirmado el inicio de sesión."""
+    for acceso in session.info.pop('accesos_pendientes', ()):
+        registro_accesos.registrar(*acceso)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _descartar_accesos(session):
+    """Descarta los accesos pendientes si la transacción del inicio de sesión se revierte."""
+    session.info.pop('accesos_pendientes', None)
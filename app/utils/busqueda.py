@@ -0,0 +1,154 @@
+from flask import current_app
+
+from app.extensions import db
+from app.models.busqueda import IndiceBusqueda, TABLA_FTS, COLUMNAS_TEXTO, terminos_busqueda
+
+# Peso de cada columna en el ranking (mismo orden que COLUMNAS_TEXTO)
+PESOS_COLUMNAS = (10.0, 5.0, 5.0, 1.0, 2.0)
+
+# Motores en los que se verificó si existe la tabla FTS5
+_fts_disponible = {}
+
+
+def _usa_fts(session):
+    """Indica si la base de datos SQLite tiene la tabla FTS5 del índice."""
+    motor = session.get_bind()
+    clave = str(motor.url)
+    if clave not in _fts_disponible:
+        _fts_disponible[clave] = session.execute(
+            db.text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :nombre"),
+            {'nombre': TABLA_FTS}
+        ).first() is not None
+    return _fts_disponible[clave]
+
+
+def reiniciar_deteccion_fts(motor=None):
+    """
+    Descarta la verificación guardada de la tabla FTS5 para que se repita en la próxima búsqueda.
+    
+    Debe llamarse después de crear, reconstruir o eliminar el índice (una vez
+    confirmada la transacción); de lo contrario el proceso seguiría usando el
+    resultado anterior hasta reiniciarse.
+    
+    Args:
+        motor: Motor de base de datos (por defecto, todos)
+    """
+    if motor is None:
+        _fts_disponible.clear()
+    else:
+        _fts_disponible.pop(str(motor.url), None)
+
+
+def _subconsulta_fts(terminos):
+    """Resultados de la tabla FTS5 ordenados con bm25 (menor es mejor)."""
+    # Cada término se busca como prefijo y todos deben aparecer
+    expresion = ' '.join(f'"{termino}"*' for termino in terminos)
+    pesos = ', '.join(str(peso) for peso in PESOS_COLUMNAS)
+    
+    return db.text(
+        f"SELECT rowid AS usuario_id, bm25({TABLA_FTS}, {pesos}) AS rango "
+        f"FROM {TABLA_FTS} WHERE {TABLA_FTS} MATCH :expresion"
+    ).bindparams(expresion=expresion).columns(
+        usuario_id=db.Integer, rango=db.Float
+    ).subquery('busqueda')
+
+
+def _subconsulta_postgresql(terminos, frase):
+    """Resultados por tsvector o por trigramas, ordenados por relevancia descendente."""
+    vector = db.func.to_tsvector('simple', IndiceBusqueda.texto)
+    consulta = db.func.to_tsquery('simple', ' & '.join(f'{termino}:*' for termino in terminos))
+    relevancia = db.func.ts_rank(vector, consulta) + db.func.similarity(IndiceBusqueda.texto, frase)
+    
+    return db.select(
+        IndiceBusqueda.usuario_id, (-relevancia).label('rango')
+    ).where(db.or_(
+        vector.op('@@')(consulta),
+        IndiceBusqueda.texto.contains(frase, autoescape=True)
+    )).subquery('busqueda')
+
+
+def puntuar(fila, terminos):
+    """
+    Calcula la relevancia de una fila del índice para la búsqueda alternativa.
+    
+    Cada término suma el peso de las columnas donde aparece: el peso completo
+    si coincide con una palabra, la mitad si es prefijo de una palabra y un
+    cuarto si solo aparece dentro de ella.
+    
+    Args:
+        fila: Fila del índice con las columnas de COLUMNAS_TEXTO
+        terminos: Términos normalizados
+    
+    Returns:
+        float: Relevancia (mayor es mejor)
+    """
+    puntaje = 0.0
+    for columna, peso in zip(COLUMNAS_TEXTO, PESOS_COLUMNAS):
+        palabras = terminos_busqueda(getattr(fila, columna), maximo=None)
+        for termino in terminos:
+            if termino in palabras:
+                puntaje += peso
+            elif any(palabra.startswith(termino) for palabra in palabras):
+                puntaje += peso / 2
+            elif any(termino in palabra for palabra in palabras):
+                puntaje += peso / 4
+    return puntaje
+
+
+def _subconsulta_alternativa(terminos):
+    """
+    Resultados de la búsqueda sin índice de texto completo.
+    
+    Se filtran con LIKE sobre el texto normalizado, se puntúan en Python y el
+    puntaje se devuelve a la base de datos en una expresión CASE para poder
+    ordenar y paginar en SQL.
+    """
+    maximo = current_app.config.get('SEARCH_FALLBACK_CANDIDATES', 500)
+    candidatos = db.session.query(IndiceBusqueda).filter(
+        *[IndiceBusqueda.texto.contains(termino, autoescape=True) for termino in terminos]
+    ).order_by(IndiceBusqueda.usuario_id).limit(maximo).all()
+    
+    rangos = {fila.usuario_id: -puntuar(fila, terminos) for fila in candidatos}
+    if not rangos:
+        return db.select(
+            IndiceBusqueda.usuario_id, db.literal(0.0, db.Float).label('rango')
+        ).where(db.false()).subquery('busqueda')
+    
+    return db.select(
+        IndiceBusqueda.usuario_id,
+        db.case(rangos, value=IndiceBusqueda.usuario_id, else_=0.0).label('rango')
+    ).where(IndiceBusqueda.usuario_id.in_(rangos)).subquery('busqueda')
+
+
+def subconsulta_busqueda(texto):
+    """
+    Busca usuarios por nombre, documento, email, biografía y especialidad.
+    
+    Usa el índice de texto completo del motor de base de datos (FTS5 en
+    SQLite, tsvector y trigramas en PostgreSQL) y, si no está disponible,
+    una búsqueda sobre el texto normalizado con ranking calculado en Python.
+    
+    El resultado es una subconsulta con las columnas usuario_id y rango,
+    donde un rango menor indica mayor relevancia, para unirla a la consulta
+    del listado y paginarla por (rango, id):
+        
+        resultados = subconsulta_busqueda(busqueda)
+        query = Usuario.query.join(resultados, resultados.c.usuario_id == Usuario.id)
+        pagina = paginar_keyset(query, [(resultados.c.rango, False), (Usuario.id, False)], cursor)
+    
+    Args:
+        texto: Texto ingresado por el usuario
+    
+    Returns:
+        Subquery: Subconsulta (usuario_id, rango), o None si el texto no tiene términos
+    """
+    terminos = terminos_busqueda(texto)
+    if not terminos:
+        return None
+    
+    dialecto = db.session.get_bind().dialect.name
+    if dialecto == 'sqlite' and _usa_fts(db.session):
+        return _subconsulta_fts(terminos)
+    if dialecto == 'postgresql':
+        return _subconsulta_postgresql(terminos, ' '.join(terminos))
+    return _subconsulta_alternativa(terminos)
@@ -0,0 +1,111 @@
+import threading
+import time
+
+from flask import current_app
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+
+class CacheIdentidad:
+    """
+    Caché en memoria de los usuarios autenticados (ver app.utils.identidad).
+    
+    Cada entrada vence a los IDENTITY_CACHE_SECONDS segundos y se invalida
+    antes si se confirman cambios en el usuario o en alguno de sus perfiles
+    (ver los eventos de sesión al final del módulo). Es independiente de la
+    caché de los paneles: tiene su propia vigencia y sus invalidaciones no
+    afectan a los indicadores.
+    
+    La caché es local a cada proceso: entre procesos distintos la vigencia de
+    la identidad queda acotada por el TTL.
+    """
+    
+    def __init__(self):
+        self._entradas = {}  # usuario_id -> (valor, vence)
+        self._generaciones = {}  # usuario_id -> contador de invalidaciones
+        self._lock = threading.Lock()
+    
+    def obtener(self, usuario_id, calcular):
+        """
+        Obtiene la identidad de un usuario de la caché o la calcula si no está vigente.
+        
+        Args:
+            usuario_id: Identificador del usuario
+            calcular: Función sin argumentos que carga la identidad
+        
+        Returns:
+            El valor almacenado o recién calculado
+        """
+        ttl = current_app.config.get('IDENTITY_CACHE_SECONDS', 0)
+        
+        with self._lock:
+            entrada = self._entradas.get(usuario_id)
+            if entrada and entrada[1] > time.monotonic():
+                return entrada[0]
+            generacion = self._generaciones.get(usuario_id, 0)
+        
+        valor = calcular()
+        
+        with self._lock:
+            # No guardar el valor si la entrada se invalidó durante el cálculo
+            if self._generaciones.get(usuario_id, 0) == generacion and ttl > 0:
+                ahora = time.monotonic()
+                self._entradas[usuario_id] = (valor, ahora + ttl)
+                
+                # Descartar las entradas vencidas para que la caché no crezca sin límite
+                for vencida in [u for u, (_, vence) in self._entradas.items() if vence <= ahora]:
+                    del self._entradas[vencida]
+        
+        return valor
+    
+    def invalidar(self, *usuario_ids):
+        """
+        Invalida la identidad de los usuarios indicados.
+        
+        Args:
+            *usuario_ids: Identificadores de los usuarios (sin argumentos, todos)
+        """
+        with self._lock:
+            for usuario_id in usuario_ids or list(self._entradas):
+                self._entradas.pop(usuario_id, None)
+                self._generaciones[usuario_id] = self._generaciones.get(usuario_id, 0) + 1
+
+
+# Instancia compartida por el proceso
+cache_identidad = CacheIdentidad()
+
+
+def _usuario_afectado(objeto):
+    """Obtiene el usuario cuya identidad depende de un objeto modificado, o None."""
+    from app.models.usuario import Usuario
+    from app.models.tipos_usuario import Medico, Paciente, AdministradorCentro, AdministradorSistema
+    
+    if isinstance(objeto, Usuario):
+        return objeto.id
+    if isinstance(objeto, (Medico, Paciente, AdministradorCentro, AdministradorSistema)):
+        return objeto.usuario_id
+    return None
+
+
+@event.listens_for(Session, 'before_flush')
+def _registrar_cambios_identidad(session, flush_context, instances):
+    """Acumula en la sesión los usuarios cuya identidad cambia con los cambios pendientes."""
+    pendientes = session.info.setdefault('identidades_invalidadas', set())
+    for objeto in list(session.new) + list(session.dirty) + list(session.deleted):
+        usuario_id = _usuario_afectado(objeto)
+        if usuario_id is not None:
+            pendientes.add(usuario_id)
+
+
+@event.listens_for(Session, 'after_commit')
+def _invalidar_identidades(session):
+    """Invalida la identidad de los usuarios afectados una vez confirmados los cambios."""
+    usuario_ids = session.info.pop('identidades_invalidadas', None)
+    if usuario_ids:
+        cache_identidad.invalidar(*usuario_ids)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _descartar_cambios_identidad(session):
+    """Descarta las identidades pendientes de invalidar si la transacción se revierte."""
+    session.info.pop('identidades_invalidadas', None)
@@ -0,0 +1,162 @@
+import threading
+import time
+
+from flask import current_app
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session
+
+
+class CachePaneles:
+    """
+    Caché en memoria de los indicadores de los paneles de administración.
+    
+    Cada entrada vence a los DASHBOARD_CACHE_SECONDS segundos y se invalida
+    antes si se confirman cambios en las filas relevantes (ver los eventos de
+    sesión al final del módulo). Cuando varias solicitudes encuentran la misma
+    entrada vencida, solo una recalcula y las demás esperan su resultado.
+    
+    La caché es local a cada proceso: entre procesos distintos la vigencia de
+    los datos queda acotada por el TTL.
+    """
+    
+    def __init__(self):
+        self._entradas = {}  # clave -> (valor, vence)
+        self._en_calculo = {}  # clave -> threading.Event
+        self._generaciones = {}  # clave -> contador de invalidaciones
+        self._lock = threading.Lock()
+    
+    def obtener(self, clave, calcular, ttl=None):
+        """
+        Obtiene un valor de la caché o lo calcula si no está vigente.
+        
+        Args:
+            clave: Tupla que identifica la entrada; su primer elemento es el panel
+            calcular: Función sin argumentos que calcula el valor
+            ttl: Segundos de vigencia (por defecto DASHBOARD_CACHE_SECONDS)
+        
+        Returns:
+            El valor almacenado o recién calculado
+        """
+        if ttl is None:
+            ttl = current_app.config.get('DASHBOARD_CACHE_SECONDS', 60)
+        
+        while True:
+            with self._lock:
+                entrada = self._entradas.get(clave)
+                if entrada and entrada[1] > time.monotonic():
+                    return entrada[0]
+                
+                calculo = self._en_calculo.get(clave)
+                if calculo is None:
+                    # Esta solicitud se encarga del cálculo
+                    calculo = self._en_calculo[clave] = threading.Event()
+                    generacion = self._generaciones.get(clave, 0)
+                    break
+            
+            # Otra solicitud está calculando la misma entrada: esperar su resultado
+            if not calculo.wait(timeout=30):
+                return calcular()
+        
+        try:
+            valor = calcular()
+            
+            with self._lock:
+                # No guardar el valor si la entrada se invalidó durante el cálculo
+                if self._generaciones.get(clave, 0) == generacion and ttl > 0:
+                    ahora = time.monotonic()
+                    self._entradas[clave] = (valor, ahora + ttl)
+                    
+                    # Descartar las entradas vencidas para que la caché no crezca sin límite
+                    for vencida in [c for c, (_, vence) in self._entradas.items() if vence <= ahora]:
+                        del self._entradas[vencida]
+            
+            return valor
+        finally:
+            with self._lock:
+                del self._en_calculo[clave]
+            calculo.set()
+    
+    def invalidar(self, *prefijo):
+        """
+        Invalida las entradas cuya clave comienza con el prefijo indicado.
+        
+        Args:
+            *prefijo: Elementos iniciales de la clave (sin argumentos, todas)
+        """
+        n = len(prefijo)
+        with self._lock:
+            claves = [c for c in set(self._entradas) | set(self._en_calculo) if c[:n] == prefijo]
+            for clave in claves:
+                self._entradas.pop(clave, None)
+                self._generaciones[clave] = self._generaciones.get(clave, 0) + 1
+
+
+# Instancia compartida por el proceso
+cache_paneles = CachePaneles()
+
+
+# Atributos de un usuario existente que se reflejan en el panel del administrador
+ATRIBUTOS_PANEL_USUARIO = ('activo', 'roles', 'roles_mascara')
+
+
+def _prefijos_afectados(objeto, modificado=False):
+    """
+    Determina qué entradas de la caché dependen de un objeto modificado.
+    
+    La identidad de los usuarios autenticados tiene su propia caché (ver
+    app.utils.cache_identidad).
+    
+    Args:
+        objeto: Instancia nueva, modificada o eliminada en la sesión
+        modificado: True si el objeto ya existía y no se está eliminando
+    
+    Returns:
+        list: Prefijos de clave a invalidar
+    """
+    from app.models.usuario import Usuario
+    from app.models.tipos_usuario import Medico, Paciente
+    from app.models.centro_medico import CentroMedico, EspecialidadCentro
+    from app.models.cita import Cita
+    
+    if isinstance(objeto, Cita):
+        return [('admin',), ('centro', objeto.centro_medico_id)]
+    if isinstance(objeto, Medico):
+        # La cantidad de médicos se muestra en todos los centros donde atiende
+        return [('admin',), ('centro',)]
+    if isinstance(objeto, Usuario):
+        # Registrar el último acceso o actualizar el hash de la contraseña no
+        # cambia los totales del panel; sí su estado activo o sus roles
+        estado = inspect(objeto)
+        if modificado and not any(estado.attrs[atributo].history.has_changes()
+                                  for atributo in ATRIBUTOS_PANEL_USUARIO):
+            return []
+        return [('admin',)]
+    if isinstance(objeto, Paciente):
+        return [('admin',)]
+    if isinstance(objeto, CentroMedico):
+        return [('admin',)]
+    if isinstance(objeto, EspecialidadCentro):
+        return [('centro', objeto.centro_medico_id)]
+    return []
+
+
+@event.listens_for(Session, 'before_flush')
+def _registrar_cambios_paneles(session, flush_context, instances):
+    """Acumula en la sesión los paneles afectados por los cambios pendientes."""
+    pendientes = session.info.setdefault('paneles_invalidados', set())
+    modificados = session.dirty
+    for objeto in list(session.new) + list(modificados) + list(session.deleted):
+        pendientes.update(_prefijos_afectados(objeto, objeto in modificados))
+
+
+@event.listens_for(Session, 'after_commit')
+def _invalidar_paneles(session):
+    """Invalida los paneles afectados una vez confirmados los cambios."""
+    for prefijo in session.info.pop('paneles_invalidados', ()):
+        cache_paneles.invalidar(*prefijo)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _descartar_cambios_paneles(session):
+    """Descarta los paneles pendientes de invalidar si la transacción se revierte."""
+    session.info.pop('paneles_invalidados', None)
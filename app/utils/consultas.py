@@ -0,0 +1,71 @@
+from functools import wraps
+
+from flask import current_app, g, has_app_context
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _registrar_consulta(conn, cursor, statement, parameters, context, executemany):
+    """Registra la sentencia en el contador activo del contexto, si lo hay."""
+    if has_app_context():
+        consultas = g.get('_consultas_sql')
+        if consultas is not None:
+            consultas.append(statement)
+
+
+class contar_consultas:
+    """
+    Administrador de contexto que registra las consultas SQL ejecutadas.
+    
+    Uso:
+        with contar_consultas() as contador:
+            ...
+        contador.cantidad
+    """
+    
+    def __enter__(self):
+        self._anteriores = g.get('_consultas_sql')
+        self.consultas = []
+        g._consultas_sql = self.consultas
+        return self
+    
+    def __exit__(self, *exc):
+        # Las consultas también cuentan para un contador externo anidado
+        if self._anteriores is not None:
+            self._anteriores.extend(self.consultas)
+        g._consultas_sql = self._anteriores
+        return False
+    
+    @property
+    def cantidad(self):
+        """Cantidad de consultas registradas."""
+        return len(self.consultas)
+
+
+def limite_consultas(maximo):
+    """
+    Decorador que limita la cantidad de consultas SQL de una vista.
+    
+    Superar el límite registra una advertencia con las sentencias ejecutadas;
+    las pruebas verifican los límites con contar_consultas. Debe aplicarse
+    después de los decoradores de autenticación, de modo que la carga del
+    usuario no se cuente.
+    
+    Args:
+        maximo: Cantidad máxima de consultas permitidas
+    """
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            with contar_consultas() as contador:
+                respuesta = f(*args, **kwargs)
+            
+            if contador.cantidad > maximo:
+                current_app.logger.warning(
+                    f'{f.__name__} ejecutó {contador.cantidad} consultas SQL (máximo {maximo}):\n'
+                    + '\n'.join(contador.consultas))
+            
+            return respuesta
+        return decorated_function
+    return decorator
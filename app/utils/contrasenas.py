@@ -0,0 +1,241 @@
+import threading
+import time
+from collections import deque
+
+from flask import current_app
+from werkzeug.exceptions import ServiceUnavailable
+from werkzeug.security import generate_password_hash, check_password_hash, DEFAULT_PBKDF2_ITERATIONS
+
+try:
+    import greenlet
+    from eventlet import hubs, tpool
+    from eventlet.semaphore import Semaphore as SemaforoVerde
+except ImportError:  # eventlet es opcional fuera del servidor Socket.IO
+    greenlet = hubs = tpool = SemaforoVerde = None
+
+
+class ServicioContrasenasSaturado(ServiceUnavailable):
+    """Se alcanzó el máximo de cálculos de contraseña simultáneos y la espera venció."""
+    description = 'El servicio está ocupado. Por favor intente nuevamente en unos segundos.'
+
+
+class MetricasContrasenas:
+    """
+    Métricas del cálculo de hashes de contraseña en el proceso actual.
+    
+    Registra la duración de las últimas operaciones para calcular la latencia
+    media y los percentiles 50 y 95, y cuántas solicitudes se rechazaron por
+    saturación.
+    """
+    
+    def __init__(self, muestras=200):
+        self._duraciones = deque(maxlen=muestras)  # (operación, segundos)
+        self._lock = threading.Lock()
+        self.hashes = 0
+        self.verificaciones = 0
+        self.rehashes = 0
+        self.rechazados = 0
+        self.en_curso = 0
+        self.maximo_espera = 0.0
+    
+    def registrar_inicio(self):
+        """Registra el comienzo de un cálculo."""
+        with self._lock:
+            self.en_curso += 1
+    
+    def registrar(self, operacion, duracion, espera):
+        """
+        Registra un cálculo terminado.
+        
+        Args:
+            operacion: 'hash' o 'verificacion'
+            duracion: Segundos que tomó el cálculo
+            espera: Segundos que la operación esperó un lugar libre
+        """
+        with self._lock:
+            self.en_curso -= 1
+            if operacion == 'hash':
+                self.hashes += 1
+            else:
+                self.verificaciones += 1
+            self._duraciones.append((operacion, duracion))
+            self.maximo_espera = max(self.maximo_espera, espera)
+    
+    def registrar_rehash(self):
+        """Registra la actualización del hash de un usuario al iniciar sesión."""
+        with self._lock:
+            self.rehashes += 1
+    
+    def registrar_rechazo(self):
+        """Registra una operación rechazada por saturación."""
+        with self._lock:
+            self.rechazados += 1
+    
+    def resumen(self):
+        """
+        Obtiene las métricas actuales.
+        
+        Returns:
+            dict: Totales, operaciones en curso y latencias en milisegundos
+        """
+        with self._lock:
+            duraciones = sorted(duracion for _, duracion in self._duraciones)
+            resumen = {
+                'hashes': self.hashes,
+                'verificaciones': self.verificaciones,
+                'rehashes': self.rehashes,
+                'rechazados': self.rechazados,
+                'en_curso': self.en_curso,
+                'maximo_espera_ms': round(self.maximo_espera * 1000, 1),
+            }
+        
+        def percentil(p):
+            return round(duraciones[min(len(duraciones) - 1, int(p * len(duraciones)))] * 1000, 1)
+        
+        resumen.update({
+            'latencia_media_ms': round(sum(duraciones) / len(duraciones) * 1000, 1) if duraciones else None,
+            'latencia_p50_ms': percentil(0.5) if duraciones else None,
+            'latencia_p95_ms': percentil(0.95) if duraciones else None,
+        })
+        return resumen
+
+
+# Instancia compartida por el proceso
+metricas_contrasenas = MetricasContrasenas()
+
+# Semáforos que limitan los cálculos simultáneos (hilos verdes y hilos del
+# sistema operativo por separado); se crean con la primera operación de cada tipo
+_semaforos = {}
+_semaforo_lock = threading.Lock()
+
+
+def _en_hub_eventlet():
+    """
+    Indica si quien llama corre en un hilo verde del hub de eventlet.
+    
+    No basta con el modo configurado en Socket.IO: los comandos de la CLI, el
+    servidor de desarrollo con hilos o los workers síncronos corren sin hub
+    aunque eventlet esté instalado. Un hilo verde es un greenlet cuyo padre
+    es el greenlet del hub activo en el hilo actual.
+    """
+    if tpool is None:
+        return False
+    hub = getattr(hubs._threadlocal, 'hub', None)
+    return hub is not None and greenlet.getcurrent().parent is hub.greenlet
+
+
+def _obtener_semaforo(verde):
+    """Obtiene el semáforo de concurrencia del modo de ejecución indicado."""
+    with _semaforo_lock:
+        if verde not in _semaforos:
+            maximo = current_app.config.get('PASSWORD_HASH_MAX_CONCURRENT', 4)
+            _semaforos[verde] = SemaforoVerde(maximo) if verde else threading.BoundedSemaphore(maximo)
+        return _semaforos[verde]
+
+
+def _ejecutar(operacion, funcion, *args):
+    """
+    Ejecuta un cálculo de contraseña fuera del hub y con concurrencia limitada.
+    
+    Desde un hilo verde de eventlet el cálculo corre en el pool de hilos del
+    sistema operativo (tpool), de modo que el hilo verde que lo pidió cede el
+    control y el hub sigue atendiendo Socket.IO mientras tanto; fuera del hub
+    se calcula en el mismo hilo. Si ya hay
+    PASSWORD_HASH_MAX_CONCURRENT cálculos en curso, se espera un lugar hasta
+    PASSWORD_HASH_QUEUE_TIMEOUT segundos y luego se rechaza la operación.
+    
+    Raises:
+        ServicioContrasenasSaturado: Si no se obtuvo un lugar a tiempo
+    """
+    verde = _en_hub_eventlet()
+    semaforo = _obtener_semaforo(verde)
+    espera = current_app.config.get('PASSWORD_HASH_QUEUE_TIMEOUT', 5)
+    
+    inicio = time.monotonic()
+    if not semaforo.acquire(timeout=espera):
+        metricas_contrasenas.registrar_rechazo()
+        raise ServicioContrasenasSaturado()
+    
+    metricas_contrasenas.registrar_inicio()
+    comienzo = time.monotonic()
+    try:
+        if verde:
+            return tpool.execute(funcion, *args)
+        return funcion(*args)
+    finally:
+        fin = time.monotonic()
+        semaforo.release()
+        metricas_contrasenas.registrar(operacion, fin - comienzo, comienzo - inicio)
+
+
+def generar_hash(password):
+    """
+    Calcula el hash de una contraseña con el método configurado.
+    
+    Args:
+        password: Contraseña en texto plano
+    
+    Returns:
+        str: Hash en el formato de werkzeug (método$sal$hash)
+    """
+    metodo = current_app.config.get('PASSWORD_HASH_METHOD', 'pbkdf2:sha256:600000')
+    return _ejecutar('hash', generate_password_hash, password, metodo)
+
+
+def verificar_hash(password_hash, password):
+    """
+    Verifica una contraseña contra su hash.
+    
+    Args:
+        password_hash: Hash almacenado
+        password: Contraseña en texto plano
+    
+    Returns:
+        bool: True si la contraseña es correcta
+    """
+    return _ejecutar('verificacion', check_password_hash, password_hash, password)
+
+
+def _parametros_hash(metodo):
+    """
+    Normaliza un método de hash de werkzeug con sus parámetros por defecto.
+    
+    'scrypt' equivale a 'scrypt:32768:8:1' y 'pbkdf2' a
+    'pbkdf2:sha256:<DEFAULT_PBKDF2_ITERATIONS>', como al calcular el hash.
+    
+    Raises:
+        ValueError: Si los parámetros no son válidos
+    """
+    nombre, *argumentos = metodo.split(':')
+    if nombre == 'scrypt':
+        n, r, p = map(int, argumentos) if argumentos else (2 ** 15, 8, 1)
+        return nombre, n, r, p
+    if nombre == 'pbkdf2':
+        if len(argumentos) > 2:
+            raise ValueError(f'Método de hash inválido: {metodo}')
+        algoritmo = argumentos[0] if argumentos else 'sha256'
+        iteraciones = int(argumentos[1]) if len(argumentos) == 2 else DEFAULT_PBKDF2_ITERATIONS
+        return nombre, algoritmo, iteraciones
+    return (metodo,)
+
+
+def necesita_rehash(password_hash):
+    """
+    Indica si un hash se calculó con parámetros distintos a los configurados.
+    
+    Se comparan el método y sus parámetros tal como werkzeug los guarda en el
+    hash (por ejemplo 'scrypt:32768:8:1'), completando con los valores por
+    defecto los que la configuración omite.
+    
+    Args:
+        password_hash: Hash almacenado
+    
+    Returns:
+        bool: True si el método o sus parámetros cambiaron
+    """
+    metodo = current_app.config.get('PASSWORD_HASH_METHOD', 'pbkdf2:sha256:600000')
+    try:
+        return _parametros_hash(password_hash.split('$', 1)[0]) != _parametros_hash(metodo)
+    except ValueError:
+        # Un hash con parámetros ilegibles se reemplaza por uno con los actuales
+        return True
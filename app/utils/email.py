@@ -15,9 +15,9 @@ def enviar_email_asincrono(app, msg):
         mail.send(msg)
 
 
-def enviar_email(destinatario, asunto, template, **kwargs):
+def crear_mensaje(destinatario, asunto, template, **kwargs):
     """
-    Configura y envía un email utilizando una plantilla.
+    Crea un mensaje de correo a partir de una plantilla.
     
     Args:
         destinatario: Dirección de correo del destinatario
@@ -26,12 +26,11 @@ def enviar_email(destinatario, asunto, template, **kwargs):
         **kwargs: Argumentos adicionales para la plantilla
         
     Returns:
-        bool: True si el email se envió correctamente
+        Message: Mensaje listo para enviar
     """
-    app = current_app._get_current_object()
     msg = Message(
         asunto,
-        sender=app.config['MAIL_DEFAULT_SENDER'],
+        sender=current_app.config['MAIL_DEFAULT_SENDER'],
         recipients=[destinatario]
     )
     
@@ -39,6 +38,25 @@ def enviar_email(destinatario, asunto, template, **kwargs):
     msg.body = render_template(f'{template}.txt', **kwargs)
     msg.html = render_template(f'{template}.html', **kwargs)
     
+    return msg
+
+
+def enviar_email(destinatario, asunto, template, **kwargs):
+    """
+    Configura y envía un email utilizando una plantilla.
+    
+    Args:
+        destinatario: Dirección de correo del destinatario
+        asunto: Asunto del correo
+        template: Ruta de la plantilla (sin extensión)
+        **kwargs: Argumentos adicionales para la plantilla
+        
+    Returns:
+        bool: True si el email se envió correctamente
+    """
+    app = current_app._get_current_object()
+    msg = crear_mensaje(destinatario, asunto, template, **kwargs)
+    
     # Enviar de forma asíncrona si está configurado
     if app.config.get('MAIL_ASYNC', False):
         Thread(target=enviar_email_asincrono, args=(app, msg)).start()
@@ -72,20 +90,35 @@ def enviar_notificacion_cita(cita):
     )
 
 
-def enviar_recordatorio_cita(cita):
+def enviar_recordatorio_cita(cita, tipo='24h', conexion=None):
     """
     Envía recordatorios de citas próximas.
     
     Args:
         cita: Objeto de la cita médica
+        tipo: Tipo de recordatorio ('24h' o '1h')
+        conexion: Conexión SMTP abierta con mail.connect() para reutilizarla
+            en un lote de envíos (opcional)
     """
+    cuando = 'Mañana' if tipo == '24h' else 'en 1 Hora'
+    
     # Recordatorio al paciente
-    enviar_email(
-        destinatario=cita.paciente.usuario.email,
-        asunto=f'Recordatorio: Cita Médica Mañana - {cita.especialidad.nombre}',
-        template='email/recordatorio_cita',
-        cita=cita
-    )
+    if conexion is None:
+        enviar_email(
+            destinatario=cita.paciente.usuario.email,
+            asunto=f'Recordatorio: Cita Médica {cuando} - {cita.especialidad.nombre}',
+            template='email/recordatorio_cita',
+            cita=cita,
+            tipo=tipo
+        )
+    else:
+        conexion.send(crear_mensaje(
+            destinatario=cita.paciente.usuario.email,
+            asunto=f'Recordatorio: Cita Médica {cuando} - {cita.especialidad.nombre}',
+            template='email/recordatorio_cita',
+            cita=cita,
+            tipo=tipo
+        ))
 
 
 def enviar_notificacion_cancelacion(cita, razon, cancelado_por):
@@ -0,0 +1,222 @@
+import csv
+import io
+import json
+from datetime import datetime
+
+from flask import Response, stream_with_context
+from sqlalchemy import select
+from sqlalchemy.orm import aliased
+
+from app.extensions import db
+from app.models.usuario import Usuario
+from app.models.tipos_usuario import Especialidad
+from app.models.centro_medico import CentroMedico
+from app.models.cita import Cita
+from app.models.consulta import Consulta
+from app.utils.fechas import rango_dias
+
+# Formatos de exportación: tipo MIME y extensión del archivo
+FORMATOS_EXPORTACION = {
+    'csv': ('text/csv', 'csv'),
+    'ndjson': ('application/x-ndjson', 'ndjson'),
+}
+
+# Datos exportables
+TIPOS_EXPORTACION = ('citas', 'consultas')
+
+# Cantidad de filas leídas de la base de datos por bloque
+TAMANO_BLOQUE = 1000
+
+
+def _columnas_comunes(medico, paciente):
+    """Columnas de la cita incluidas en ambas exportaciones."""
+    return [
+        Cita.fecha_hora.label('fecha_hora'),
+        Cita.estado.label('estado'),
+        Cita.tipo.label('tipo'),
+        CentroMedico.id.label('centro_medico_id'),
+        CentroMedico.nombre.label('centro_medico'),
+        Especialidad.nombre.label('especialidad'),
+        Cita.medico_id.label('medico_id'),
+        (medico.nombre + ' ' + medico.apellido).label('medico'),
+        Cita.paciente_id.label('paciente_id'),
+        paciente.tipo_documento.label('paciente_tipo_documento'),
+        paciente.numero_documento.label('paciente_documento'),
+    ]
+
+
+def consulta_exportacion(tipo, centro_id=None, fecha_inicio=None, fecha_fin=None, estado=None):
+    """
+    Construye la consulta de exportación de citas o consultas.
+    
+    Las filas se obtienen ya unidas con el médico, la especialidad y el centro,
+    como tuplas planas y sin cargar objetos del ORM.
+    
+    Args:
+        tipo: 'citas' o 'consultas'
+        centro_id: Limitar a un centro médico (opcional)
+        fecha_inicio: Fecha inicial de la cita (opcional)
+        fecha_fin: Fecha final de la cita, inclusive (opcional)
+        estado: Estado de la cita (opcional)
+    
+    Returns:
+        Select: Consulta ordenada por fecha de la cita
+    """
+    medico = aliased(Usuario)
+    paciente = aliased(Usuario)
+    
+    if tipo == 'citas':
+        consulta = select(
+            Cita.id.label('cita_id'),
+            *_columnas_comunes(medico, paciente),
+            Cita.duracion.label('duracion'),
+            Cita.motivo_cancelacion.label('motivo_cancelacion'),
+            Cita.fecha_creacion.label('fecha_creacion')
+        ).select_from(Cita)
+    elif tipo == 'consultas':
+        consulta = select(
+            Consulta.id.label('consulta_id'),
+            Cita.id.label('cita_id'),
+            *_columnas_comunes(medico, paciente),
+            Consulta.fecha_inicio.label('fecha_inicio'),
+            Consulta.fecha_fin.label('fecha_fin'),
+            Consulta.duracion_minutos.label('duracion_minutos'),
+            Consulta.diagnostico.label('diagnostico'),
+            Consulta.requiere_seguimiento.label('requiere_seguimiento')
+        ).select_from(Consulta).join(Cita, Consulta.cita_id == Cita.id)
+    else:
+        raise ValueError(f'Tipo de exportación no válido: {tipo}')
+    
+    consulta = consulta.join(CentroMedico, Cita.centro_medico_id == CentroMedico.id)\
+                       .join(Especialidad, Cita.especialidad_id == Especialidad.id)\
+                       .join(medico, Cita.medico_id == medico.id)\
+                       .join(paciente, Cita.paciente_id == paciente.id)
+    
+    if centro_id:
+        consulta = consulta.where(Cita.centro_medico_id == centro_id)
+    if estado:
+        consulta = consulta.where(Cita.estado == estado)
+    if fecha_inicio or fecha_fin:
+        desde, hasta = rango_dias(fecha_inicio or fecha_fin, fecha_fin or fecha_inicio)
+        if fecha_inicio:
+            consulta = consulta.where(Cita.fecha_hora >= desde)
+        if fecha_fin:
+            consulta = consulta.where(Cita.fecha_hora < hasta)
+    
+    return consulta.order_by(Cita.fecha_hora, Cita.id)
+
+
+def leer_filtros(argumentos):
+    """
+    Obtiene los filtros de exportación de los parámetros de una solicitud.
+    
+    Args:
+        argumentos: Parámetros de la solicitud (request.args)
+    
+    Returns:
+        dict: fecha_inicio, fecha_fin y estado
+    
+    Raises:
+        ValueError: Si alguna fecha no tiene el formato YYYY-MM-DD
+    """
+    filtros = {'estado': argumentos.get('estado') or None}
+    if filtros['estado'] in ('todas', 'todos'):
+        filtros['estado'] = None
+    
+    for nombre in ('fecha_inicio', 'fecha_fin'):
+        valor = argumentos.get(nombre)
+        filtros[nombre] = datetime.strptime(valor, '%Y-%m-%d').date() if valor else None
+    
+    return filtros
+
+
+def _valor_json(valor):
+    """Convierte fechas a texto ISO para la salida NDJSON."""
+    return valor.isoformat() if hasattr(valor, 'isoformat') else str(valor)
+
+
+def exportar(tipo, formato='csv', tamano=None, **filtros):
+    """
+    Genera la exportación de citas o consultas por fragmentos de texto.
+    
+    Las filas se leen por bloques con yield_per (cursor del lado del servidor en
+    PostgreSQL) y cada bloque se emite en cuanto se escribe, de modo que la
+    memoria usada no depende de la cantidad de filas exportadas.
+    
+    Args:
+        tipo: 'citas' o 'consultas'
+        formato: 'csv' o 'ndjson'
+        tamano: Cantidad de filas por bloque
+        **filtros: Filtros de consulta_exportacion
+    
+    Yields:
+        str: Fragmentos del archivo exportado
+    """
+    if formato not in FORMATOS_EXPORTACION:
+        raise ValueError(f'Formato de exportación no válido: {formato}')
+    
+    tamano = tamano or TAMANO_BLOQUE
+    consulta = consulta_exportacion(tipo, **filtros).execution_options(yield_per=tamano)
+    resultado = db.session.execute(consulta)
+    columnas = list(resultado.keys())
+    
+    buffer = io.StringIO()
+    escritor = csv.writer(buffer)
+    if formato == 'csv':
+        escritor.writerow(columnas)
+    
+    try:
+        for bloque in resultado.partitions():
+            for fila in bloque:
+                if formato == 'csv':
+                    escritor.writerow(fila)
+                else:
+                    buffer.write(json.dumps(dict(zip(columnas, fila)), default=_valor_json,
+                                            ensure_ascii=False))
+                    buffer.write('\n')
+            
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+        
+        # Cabecera del CSV cuando no hay filas
+        if buffer.tell():
+            yield buffer.getvalue()
+    finally:
+        resultado.close()
+
+
+def nombre_archivo(tipo, formato):
+    """
+    Obtiene el nombre del archivo de una exportación.
+    
+    Args:
+        tipo: 'citas' o 'consultas'
+        formato: 'csv' o 'ndjson'
+    
+    Returns:
+        str: Nombre del archivo con la fecha actual
+    """
+    return f"{tipo}_{datetime.now().strftime('%Y%m%d_%H%M')}.{FORMATOS_EXPORTACION[formato][1]}"
+
+
+def respuesta_exportacion(tipo, formato, **filtros):
+    """
+    Construye la respuesta HTTP que transmite una exportación como descarga.
+    
+    La respuesta no declara Content-Length, por lo que el servidor la envía con
+    codificación por fragmentos (chunked) a medida que se generan.
+    
+    Args:
+        tipo: 'citas' o 'consultas'
+        formato: 'csv' o 'ndjson'
+        **filtros: Filtros de consulta_exportacion
+    
+    Returns:
+        Response: Respuesta con el contenido en streaming
+    """
+    return Response(
+        stream_with_context(exportar(tipo, formato, **filtros)),
+        mimetype=FORMATOS_EXPORTACION[formato][0],
+        headers={'Content-Disposition': f'attachment; filename={nombre_archivo(tipo, formato)}'}
+    )
@@ -0,0 +1,31 @@
+from datetime import datetime, timedelta
+
+
+def inicio_del_dia(fecha):
+    """
+    Obtiene el primer instante de una fecha.
+    
+    Args:
+        fecha: Objeto date
+        
+    Returns:
+        datetime: Fecha a las 00:00
+    """
+    return datetime.combine(fecha, datetime.min.time())
+
+
+def rango_dias(fecha_inicio, fecha_fin=None):
+    """
+    Convierte un rango de fechas en un intervalo semiabierto de fecha y hora.
+    
+    Filtrar con `columna >= inicio` y `columna < fin` permite usar los índices
+    sobre la columna, a diferencia de comparar `func.date(columna)`.
+    
+    Args:
+        fecha_inicio: Primera fecha del rango
+        fecha_fin: Última fecha del rango, inclusive (por defecto, la inicial)
+        
+    Returns:
+        tuple: (inicio, fin) con el fin excluido del rango
+    """
+    return inicio_del_dia(fecha_inicio), inicio_del_dia(fecha_fin or fecha_inicio) + timedelta(days=1)
@@ -0,0 +1,241 @@
+from datetime import datetime, timedelta
+
+from app.extensions import db
+from app.models.cita import Cita, ESTADOS_ACTIVOS
+from app.models.tipos_usuario import HorarioMedico, ExcepcionHorario
+from app.utils.fechas import inicio_del_dia
+
+# Cantidad de días cuyas excepciones y citas se cargan por consulta
+DIAS_POR_BLOQUE = 7
+
+
+def obtener_excepciones(medico_id, centro_id, fecha_inicio, fecha_fin):
+    """
+    Obtiene las excepciones que afectan a un médico en un centro, agrupadas por fecha.
+    
+    Args:
+        medico_id: ID del médico
+        centro_id: ID del centro médico
+        fecha_inicio: Primera fecha del rango
+        fecha_fin: Última fecha del rango (inclusive)
+        
+    Returns:
+        dict: fecha -> lista de tuplas (inicio, fin) bloqueadas, o None si el
+            día completo está bloqueado
+    """
+    excepciones = ExcepcionHorario.query.filter(
+        ExcepcionHorario.fecha >= fecha_inicio,
+        ExcepcionHorario.fecha <= fecha_fin,
+        db.or_(ExcepcionHorario.medico_id == medico_id, ExcepcionHorario.medico_id == None),
+        db.or_(ExcepcionHorario.centro_medico_id == centro_id, ExcepcionHorario.centro_medico_id == None)
+    ).all()
+    
+    return _agrupar_excepciones(excepciones)
+
+
+def _agrupar_excepciones(excepciones):
+    """Agrupa por fecha los bloqueos de una lista de excepciones (None = día completo)."""
+    bloqueos = {}
+    for excepcion in excepciones:
+        if excepcion.dia_completo:
+            bloqueos[excepcion.fecha] = None
+        elif bloqueos.get(excepcion.fecha, []) is not None:
+            bloqueos.setdefault(excepcion.fecha, []).append((
+                datetime.combine(excepcion.fecha, excepcion.hora_inicio),
+                datetime.combine(excepcion.fecha, excepcion.hora_fin)
+            ))
+    
+    return bloqueos
+
+
+def expandir_horarios(reglas, fecha_inicio, fecha_fin, bloqueos=None):
+    """
+    Expande de forma perezosa los horarios semanales en ventanas de atención por día.
+    
+    Args:
+        reglas: Lista de objetos HorarioMedico
+        fecha_inicio: Primera fecha del rango
+        fecha_fin: Última fecha del rango (inclusive)
+        bloqueos: Diccionario de excepciones devuelto por obtener_excepciones
+        
+    Yields:
+        tuple: (fecha, inicio, fin, intervalo, bloqueos_del_dia) por cada ventana,
+            en orden cronológico
+    """
+    bloqueos = bloqueos or {}
+    por_dia = {}
+    for regla in sorted(reglas, key=lambda r: r.hora_inicio):
+        por_dia.setdefault(regla.dia_semana, []).append(regla)
+    
+    fecha = fecha_inicio
+    while fecha <= fecha_fin:
+        reglas_dia = por_dia.get(fecha.weekday())
+        
+        # Los feriados y bloqueos de día completo anulan las reglas del día
+        if reglas_dia and not (fecha in bloqueos and bloqueos[fecha] is None):
+            for regla in reglas_dia:
+                yield (
+                    fecha,
+                    datetime.combine(fecha, regla.hora_inicio),
+                    datetime.combine(fecha, regla.hora_fin),
+                    regla.intervalo_citas or 30,
+                    bloqueos.get(fecha) or []
+                )
+        
+        fecha += timedelta(days=1)
+
+
+def horarios_ocupados(medico_id, desde, hasta):
+    """
+    Obtiene los horarios ocupados por citas activas de un médico (en cualquier centro).
+    
+    Args:
+        medico_id: ID del médico
+        desde: Fecha y hora inicial (inclusive)
+        hasta: Fecha y hora final (exclusive)
+        
+    Returns:
+        set: Fechas y horas de las citas activas del médico en el rango
+    """
+    return {
+        fila.fecha_hora for fila in db.session.query(Cita.fecha_hora).filter(
+            Cita.medico_id == medico_id,
+            Cita.fecha_hora >= desde,
+            Cita.fecha_hora < hasta,
+            Cita.estado.in_(ESTADOS_ACTIVOS)
+        ).all()
+    }
+
+
+def generar_turnos(reglas, desde, hasta, bloqueos, ocupados):
+    """
+    Genera los turnos libres de un rango a partir de datos ya cargados.
+    
+    Args:
+        reglas: Lista de objetos HorarioMedico del médico
+        desde: Fecha y hora inicial (inclusive)
+        hasta: Fecha y hora final (exclusive)
+        bloqueos: Diccionario de excepciones devuelto por obtener_excepciones
+        ocupados: Conjunto de horarios ocupados por citas activas
+        
+    Yields:
+        datetime: Fecha y hora de cada turno libre, en orden cronológico
+    """
+    fecha_inicio = desde.date()
+    fecha_fin = (hasta - timedelta(microseconds=1)).date()
+    
+    fecha_actual = None
+    turnos_dia = set()
+    
+    for fecha, inicio, fin, intervalo, bloqueos_dia in expandir_horarios(reglas, fecha_inicio, fecha_fin, bloqueos):
+        # Emitir los turnos del día anterior ya ordenados y sin duplicados
+        if fecha != fecha_actual:
+            yield from sorted(turnos_dia)
+            turnos_dia = set()
+            fecha_actual = fecha
+        
+        turno = inicio
+        while turno < fin:
+            fin_turno = turno + timedelta(minutes=intervalo)
+            
+            if desde <= turno < hasta and turno not in ocupados and \
+                    not any(b_inicio < fin_turno and turno < b_fin for b_inicio, b_fin in bloqueos_dia):
+                turnos_dia.add(turno)
+            
+            turno = fin_turno
+    
+    yield from sorted(turnos_dia)
+
+
+def turnos_recurrentes(medico_id, centro_id, desde, hasta):
+    """
+    Genera los turnos libres de un médico a partir de sus horarios semanales.
+    
+    Los turnos no se guardan en la base de datos: se calculan al vuelo para el
+    rango pedido, descontando las excepciones y las citas activas del médico.
+    Las excepciones y las citas se consultan por bloques de DIAS_POR_BLOQUE
+    días a medida que se recorre el generador, de modo que quien solo toma
+    los primeros turnos no carga el rango completo.
+    
+    Args:
+        medico_id: ID del médico
+        centro_id: ID del centro médico
+        desde: Fecha y hora inicial (inclusive)
+        hasta: Fecha y hora final (exclusive)
+        
+    Yields:
+        datetime: Fecha y hora de cada turno libre, en orden cronológico
+    """
+    reglas = HorarioMedico.query.filter_by(
+        medico_id=medico_id,
+        centro_medico_id=centro_id,
+        activo=True
+    ).all()
+    
+    if not reglas:
+        return
+    
+    inicio = desde
+    while inicio < hasta:
+        # Los bloques terminan a medianoche para no partir los turnos de un día
+        fin = min(inicio_del_dia(inicio.date() + timedelta(days=DIAS_POR_BLOQUE)), hasta)
+        bloqueos = obtener_excepciones(medico_id, centro_id, inicio.date(),
+                                       (fin - timedelta(microseconds=1)).date())
+        
+        yield from generar_turnos(reglas, inicio, fin, bloqueos, horarios_ocupados(medico_id, inicio, fin))
+        inicio = fin
+
+
+def turnos_recurrentes_medicos(medico_ids, centro_id, desde, hasta):
+    """
+    Calcula los turnos libres de varios médicos en un centro para todo un rango.
+    
+    Equivale a llamar a turnos_recurrentes por cada médico, pero las reglas,
+    las excepciones y las citas de todos ellos se cargan con una consulta
+    cada una. Pensado para resúmenes acotados, como el calendario de un mes.
+    
+    Args:
+        medico_ids: Lista de IDs de médicos
+        centro_id: ID del centro médico
+        desde: Fecha y hora inicial (inclusive)
+        hasta: Fecha y hora final (exclusive)
+        
+    Returns:
+        dict: medico_id -> lista de turnos libres en orden cronológico (solo
+            los médicos con horarios semanales activos en el centro)
+    """
+    reglas = {}
+    for regla in HorarioMedico.query.filter(
+        HorarioMedico.medico_id.in_(medico_ids),
+        HorarioMedico.centro_medico_id == centro_id,
+        HorarioMedico.activo == True
+    ).all():
+        reglas.setdefault(regla.medico_id, []).append(regla)
+    
+    if not reglas or desde >= hasta:
+        return {}
+    
+    excepciones = ExcepcionHorario.query.filter(
+        ExcepcionHorario.fecha >= desde.date(),
+        ExcepcionHorario.fecha <= (hasta - timedelta(microseconds=1)).date(),
+        db.or_(ExcepcionHorario.medico_id.in_(list(reglas)), ExcepcionHorario.medico_id == None),
+        db.or_(ExcepcionHorario.centro_medico_id == centro_id, ExcepcionHorario.centro_medico_id == None)
+    ).all()
+    
+    ocupados = {}
+    for medico_id, fecha_hora in db.session.query(Cita.medico_id, Cita.fecha_hora).filter(
+        Cita.medico_id.in_(list(reglas)),
+        Cita.fecha_hora >= desde,
+        Cita.fecha_hora < hasta,
+        Cita.estado.in_(ESTADOS_ACTIVOS)
+    ).all():
+        ocupados.setdefault(medico_id, set()).add(fecha_hora)
+    
+    return {
+        medico_id: list(generar_turnos(
+            reglas_medico, desde, hasta,
+            _agrupar_excepciones([e for e in excepciones if e.medico_id in (None, medico_id)]),
+            ocupados.get(medico_id, set())
+        ))
+        for medico_id, reglas_medico in reglas.items()
+    }
@@ -0,0 +1,114 @@
+from flask import current_app
+from sqlalchemy.orm import joinedload, make_transient_to_detached
+from sqlalchemy.orm.attributes import set_committed_value
+
+from app.extensions import db
+from app.models.usuario import Usuario
+from app.models.tipos_usuario import Paciente, Medico, AdministradorCentro, AdministradorSistema
+from app.utils.cache_identidad import cache_identidad
+
+# Perfiles de cada tipo de usuario que se cargan junto con él
+PERFILES = {
+    'paciente': Paciente,
+    'medico': Medico,
+    'admin_centro': AdministradorCentro,
+    'admin_sistema': AdministradorSistema,
+}
+
+
+# Columnas del usuario que no se copian a la caché (se cargan de forma diferida si se usan)
+COLUMNAS_EXCLUIDAS = {'password_hash'}
+
+
+def _columnas(objeto, excluir=()):
+    """Valores de las columnas de un objeto del ORM."""
+    return {
+        atributo.key: getattr(objeto, atributo.key)
+        for atributo in db.inspect(objeto).mapper.column_attrs if atributo.key not in excluir
+    }
+
+
+def _consultar_usuario(usuario_id):
+    """Carga el usuario, sus roles y sus perfiles en una sola consulta."""
+    return Usuario.query.options(
+        joinedload(Usuario.roles),
+        *[joinedload(getattr(Usuario, nombre)) for nombre in PERFILES]
+    ).filter(Usuario.id == usuario_id).first()
+
+
+def _instantanea(usuario):
+    """
+    Copia los datos de un usuario cargado en estructuras simples.
+    
+    La caché guarda esta copia y no la instancia, que pertenece a la sesión
+    de la solicitud que la cargó. El hash de la contraseña no se copia.
+    """
+    return {
+        'usuario': _columnas(usuario, excluir=COLUMNAS_EXCLUIDAS),
+        'roles': usuario.roles_resueltos,
+        'perfiles': {
+            nombre: _columnas(perfil) if perfil is not None else None
+            for nombre, perfil in ((nombre, getattr(usuario, nombre)) for nombre in PERFILES)
+        }
+    }
+
+
+def _restaurar(instantanea):
+    """
+    Reconstruye el usuario de una instantánea en la sesión actual sin consultar la base de datos.
+    
+    Las instancias se marcan como ya persistidas y se incorporan a la sesión
+    con merge(load=False); los atributos que no forman parte de la instantánea
+    se cargan de forma diferida si se usan.
+    """
+    usuario = Usuario(**instantanea['usuario'])
+    make_transient_to_detached(usuario)
+    
+    for nombre, modelo in PERFILES.items():
+        datos = instantanea['perfiles'][nombre]
+        perfil = None
+        if datos is not None:
+            perfil = modelo(**datos)
+            make_transient_to_detached(perfil)
+            set_committed_value(perfil, 'usuario', usuario)
+        set_committed_value(usuario, nombre, perfil)
+    
+    usuario = db.session.merge(usuario, load=False)
+    usuario.__dict__['_roles_resueltos'] = instantanea['roles']
+    return usuario
+
+
+def cargar_usuario(usuario_id):
+    """
+    Carga el usuario autenticado con sus roles y su perfil.
+    
+    El usuario, sus roles y sus perfiles (paciente, médico o administrador)
+    se obtienen en una sola consulta. Si IDENTITY_CACHE_SECONDS es mayor a
+    cero, una copia se guarda en la caché de identidades del proceso y las
+    solicitudes siguientes del mismo usuario no consultan la base de datos.
+    La entrada se invalida al confirmarse cambios en el usuario o en sus
+    perfiles, incluidos sus roles y su estado activo (ver cache_identidad);
+    entre procesos distintos la vigencia queda acotada por el TTL.
+    
+    Args:
+        usuario_id: Identificador del usuario
+    
+    Returns:
+        Usuario: Usuario cargado, o None si no existe
+    """
+    ttl = current_app.config.get('IDENTITY_CACHE_SECONDS', 0)
+    if not ttl:
+        return _consultar_usuario(usuario_id)
+    
+    cargado = {}
+    
+    def calcular():
+        usuario = cargado['usuario'] = _consultar_usuario(usuario_id)
+        return _instantanea(usuario) if usuario is not None else None
+    
+    instantanea = cache_identidad.obtener(usuario_id, calcular)
+    
+    # Si esta solicitud hizo la consulta, la instancia ya está en la sesión
+    if 'usuario' in cargado:
+        return cargado['usuario']
+    return _restaurar(instantanea) if instantanea is not None else None
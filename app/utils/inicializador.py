@@ -1,5 +1,12 @@
+from flask import current_app
+from sqlalchemy.exc import IntegrityError, OperationalError, ProgrammingError
+
 from app.extensions import db
-from app.models.usuario import Rol, Usuario
+from app.models.usuario import Rol, Usuario, BITS_ROLES, usuarios_roles
+from app.models.cita import Cita
+from app.models.estadistica import EstadisticaDiaria, EstadisticaUsuariosDiaria, recalcular_estadisticas
+from app.models.busqueda import IndiceBusqueda, reconstruir_indice
+from app.utils.busqueda import reiniciar_deteccion_fts
 from app.models.tipos_usuario import AdministradorSistema, Especialidad
 import datetime
 
@@ -14,6 +21,10 @@ def crear_datos_iniciales():
     
     # Confirmar cambios
     db.session.commit()
+    
+    # Resúmenes e índice de búsqueda de una base existente que aún no los tiene
+    completar_estadisticas()
+    completar_indice_busqueda()
 
 
 def crear_roles():
@@ -35,6 +46,166 @@ def crear_roles():
     db.session.commit()
 
 
+def completar_estadisticas():
+    """
+    Calcula los resúmenes diarios de estadísticas si están vacíos y hay datos de origen.
+    
+    En una base creada antes de los resúmenes el panel de estadísticas
+    mostraría ceros hasta ejecutar `flask recalcular-estadisticas`; una vez
+    poblados, los resúmenes se mantienen de forma incremental.
+    
+    Returns:
+        bool: True si se calcularon los resúmenes
+    """
+    sin_citas = db.session.query(EstadisticaDiaria.fecha).first() is None and \
+        db.session.query(Cita.id).first() is not None
+    sin_usuarios = db.session.query(EstadisticaUsuariosDiaria.fecha).first() is None and \
+        db.session.query(Usuario.id).filter(Usuario.fecha_registro != None).first() is not None
+    if not sin_citas and not sin_usuarios:
+        return False
+    
+    try:
+        recalcular_estadisticas()
+        db.session.commit()
+    except Exception as e:
+        # Otro proceso pudo calcularlos al mismo tiempo; el comando permite reintentarlo
+        db.session.rollback()
+        current_app.logger.warning(f'No se pudieron calcular los resúmenes de estadísticas: {e}')
+        return False
+    return True
+
+
+def completar_indice_busqueda():
+    """
+    Reconstruye el índice de búsqueda si le faltan usuarios.
+    
+    En una base creada antes del índice la búsqueda no devolvería resultados
+    hasta ejecutar `flask reconstruir-busqueda`; una vez poblado, el índice
+    se mantiene en la misma transacción que los usuarios.
+    
+    Returns:
+        bool: True si se reconstruyó el índice
+    """
+    indexados = db.session.query(db.func.count(IndiceBusqueda.usuario_id)).scalar()
+    if indexados >= db.session.query(db.func.count(Usuario.id)).scalar():
+        return False
+    
+    try:
+        reconstruir_indice()
+        db.session.commit()
+        reiniciar_deteccion_fts(db.engine)
+    except Exception as e:
+        db.session.rollback()
+        current_app.logger.warning(f'No se pudo reconstruir el índice de búsqueda: {e}')
+        return False
+    return True
+
+
+def agregar_columnas_faltantes():
+    """
+    Agrega a las tablas existentes las columnas de COLUMNAS_AGREGADAS que aún no tienen.
+    
+    db.create_all() solo crea las tablas nuevas; las columnas que se agregan a
+    un modelo existente se crean aquí con ALTER TABLE (siempre admiten NULL) y
+    luego se ejecuta, una única vez, la función que completa sus valores.
+    
+    Returns:
+        list: Nombres "tabla.columna" de las columnas agregadas
+    """
+    agregadas = []
+    
+    for (nombre_tabla, nombre_columna), completar in COLUMNAS_AGREGADAS.items():
+        inspector = db.inspect(db.engine)
+        if not inspector.has_table(nombre_tabla) or \
+                nombre_columna in {c['name'] for c in inspector.get_columns(nombre_tabla)}:
+            continue
+        
+        columna = db.metadata.tables[nombre_tabla].c[nombre_columna]
+        tipo = columna.type.compile(dialect=db.engine.dialect)
+        try:
+            with db.engine.begin() as conexion:
+                conexion.exec_driver_sql(f'ALTER TABLE {nombre_tabla} ADD COLUMN {nombre_columna} {tipo}')
+        except (OperationalError, ProgrammingError):
+            # Otro proceso que inició al mismo tiempo pudo haberla agregado
+            if nombre_columna in {c['name'] for c in db.inspect(db.engine).get_columns(nombre_tabla)}:
+                continue
+            raise
+        
+        if completar is not None:
+            completar()
+            db.session.commit()
+        agregadas.append(f'{nombre_tabla}.{nombre_columna}')
+    
+    return agregadas
+
+
+def crear_indices_faltantes():
+    """
+    Crea los índices declarados en los modelos que aún no existen en la base de datos.
+    
+    db.create_all() crea los índices solo junto con las tablas nuevas; los que
+    se declaran en un modelo existente (por ejemplo, el índice único parcial
+    que impide dos citas activas del mismo médico en el mismo horario) se
+    crean aquí. Si un índice no puede crearse (por ejemplo, porque los datos
+    existentes violan la unicidad) se registra una advertencia y se continúa.
+    
+    Returns:
+        list: Nombres de los índices creados
+    """
+    creados = []
+    inspector = db.inspect(db.engine)
+    
+    for tabla in db.metadata.sorted_tables:
+        if not inspector.has_table(tabla.name):
+            continue
+        
+        existentes = {i['name'] for i in inspector.get_indexes(tabla.name)}
+        for indice in tabla.indexes:
+            if indice.name in existentes:
+                continue
+            try:
+                indice.create(db.engine)
+            except (IntegrityError, OperationalError, ProgrammingError) as e:
+                # Otro proceso pudo haberlo creado, o los datos impiden crearlo
+                if indice.name not in {i['name'] for i in db.inspect(db.engine).get_indexes(tabla.name)}:
+                    current_app.logger.warning(f'No se pudo crear el índice {indice.name}: {e}')
+                continue
+            creados.append(indice.name)
+    
+    return creados
+
+
+def completar_mascaras_roles():
+    """
+    Calcula la máscara de roles de los usuarios que aún no la tienen.
+    
+    Cada rol aparece una sola vez por usuario, por lo que la suma de sus bits
+    equivale a combinarlos. Solo se actualizan las filas con máscara NULL.
+    
+    Returns:
+        int: Cantidad de usuarios actualizados
+    """
+    bits = db.case(BITS_ROLES, value=Rol.nombre, else_=0)
+    suma = db.select(db.func.coalesce(db.func.sum(bits), 0))\
+             .select_from(usuarios_roles.join(Rol, Rol.id == usuarios_roles.c.rol_id))\
+             .where(usuarios_roles.c.usuario_id == Usuario.id)\
+             .scalar_subquery()
+    
+    return db.session.execute(
+        db.update(Usuario).where(Usuario.roles_mascara == None).values(roles_mascara=suma)
+        .execution_options(synchronize_session=False)
+    ).rowcount
+
+
+# Columnas agregadas a tablas existentes -> función que completa sus valores (o None)
+COLUMNAS_AGREGADAS = {
+    ('usuarios', 'roles_mascara'): completar_mascaras_roles,
+    ('citas', 'recordatorio_reclamado_en'): None,
+    ('citas', 'recordatorio_reclamado_por'): None,
+    ('horarios_medicos', 'intervalo_citas'): None,  # NULL se interpreta como 30 minutos
+}
+
+
 def crear_especialidades():
     """Crea las especialidades médicas básicas si no existen."""
     especialidades = [
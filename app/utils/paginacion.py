@@ -0,0 +1,153 @@
+from datetime import date, datetime
+
+from flask import current_app
+from itsdangerous import BadSignature, URLSafeSerializer
+
+from app.extensions import db
+
+
+def _serializador():
+    """Serializador firmado de los cursores de paginación."""
+    return URLSafeSerializer(current_app.config['SECRET_KEY'], salt='paginacion-keyset')
+
+
+def _codificar_valor(valor):
+    """Convierte un valor de columna a un tipo serializable en JSON."""
+    if isinstance(valor, datetime):
+        return {'dt': valor.isoformat()}
+    if isinstance(valor, date):
+        return {'d': valor.isoformat()}
+    return valor
+
+
+def _decodificar_valor(valor):
+    """Recupera un valor de columna codificado con _codificar_valor."""
+    if isinstance(valor, dict):
+        if 'dt' in valor:
+            return datetime.fromisoformat(valor['dt'])
+        if 'd' in valor:
+            return date.fromisoformat(valor['d'])
+    return valor
+
+
+def _condicion_posterior(orden, valores):
+    """
+    Construye la condición de las filas posteriores a un cursor.
+    
+    Para un orden (c1, c2, ..., cn) la condición es
+    c1 > v1 OR (c1 = v1 AND c2 > v2) OR ... respetando el sentido de cada columna.
+    """
+    condiciones = []
+    for indice, (columna, descendente) in enumerate(orden):
+        iguales = [orden[i][0] == valores[i] for i in range(indice)]
+        siguiente = columna < valores[indice] if descendente else columna > valores[indice]
+        condiciones.append(db.and_(*iguales, siguiente))
+    return db.or_(*condiciones)
+
+
+class PaginaKeyset:
+    """
+    Página de resultados obtenida con paginación por clave (keyset).
+    
+    Atributos:
+        items: Objetos de la página
+        siguiente: Cursor de la página siguiente, o None si es la última
+        anterior: Cursor de la página anterior, o None si es la primera
+    """
+    
+    def __init__(self, items, siguiente, anterior):
+        self.items = items
+        self.siguiente = siguiente
+        self.anterior = anterior
+    
+    def __iter__(self):
+        return iter(self.items)
+    
+    def __len__(self):
+        return len(self.items)
+    
+    def como_json(self, serializar):
+        """
+        Obtiene la página en un formato apto para una respuesta JSON.
+        
+        Args:
+            serializar: Función que convierte cada objeto en un dict
+        
+        Returns:
+            dict: items, siguiente y anterior
+        """
+        return {
+            'items': [serializar(item) for item in self.items],
+            'siguiente': self.siguiente,
+            'anterior': self.anterior
+        }
+
+
+def paginar_keyset(query, orden, cursor=None, por_pagina=None):
+    """
+    Pagina una consulta buscando a partir de la última fila vista (seek).
+    
+    A diferencia de OFFSET, el costo de cada página no depende de su posición:
+    la base de datos busca directamente la primera fila posterior al cursor
+    usando el índice de las columnas de orden. La última columna del orden debe
+    ser única (normalmente la clave primaria) y ninguna puede ser nula.
+    
+    Los cursores son opacos y están firmados; uno inválido se ignora y se
+    devuelve la primera página.
+    
+    Uso:
+        pagina = paginar_keyset(Usuario.query, [(Usuario.apellido, False), (Usuario.id, False)],
+                                request.args.get('cursor'))
+    
+    Args:
+        query: Consulta del ORM (Model.query) sin ordenar ni limitar
+        orden: Lista de tuplas (columna, descendente)
+        cursor: Cursor recibido de una página anterior (opcional)
+        por_pagina: Cantidad de filas por página (por defecto LIST_PAGE_SIZE)
+    
+    Returns:
+        PaginaKeyset: Página de resultados
+    """
+    por_pagina = por_pagina or current_app.config.get('LIST_PAGE_SIZE', 50)
+    
+    valores, hacia_atras = None, False
+    if cursor:
+        try:
+            datos = _serializador().loads(cursor)
+            valores = [_decodificar_valor(valor) for valor in datos['v']]
+            hacia_atras = datos['a']
+            if len(valores) != len(orden):
+                raise ValueError
+        except (BadSignature, KeyError, TypeError, ValueError):
+            valores, hacia_atras = None, False
+    
+    # Hacia atrás se recorre el orden invertido y luego se da vuelta la página
+    orden_consulta = [(columna, descendente != hacia_atras) for columna, descendente in orden]
+    
+    consulta = query.add_columns(*[columna for columna, _ in orden])
+    if valores is not None:
+        consulta = consulta.filter(_condicion_posterior(orden_consulta, valores))
+    
+    filas = consulta.order_by(None).order_by(*[
+        columna.desc() if descendente else columna.asc() for columna, descendente in orden_consulta
+    ]).limit(por_pagina + 1).all()
+    
+    hay_mas = len(filas) > por_pagina
+    filas = filas[:por_pagina]
+    if hacia_atras:
+        filas.reverse()
+    
+    def token(fila, atras):
+        return _serializador().dumps({'v': [_codificar_valor(valor) for valor in fila[1:]], 'a': atras})
+    
+    # Hacia adelante siempre hay página anterior si se llegó con un cursor;
+    # hacia atrás siempre hay página siguiente
+    siguiente = anterior = None
+    if filas:
+        if hay_mas or hacia_atras:
+            siguiente = token(filas[-1], False)
+        if valores is not None and (hay_mas or not hacia_atras):
+            anterior = token(filas[0], True)
+    
+    return PaginaKeyset([fila[0] for fila in filas], siguiente, anterior)
+
@@ -0,0 +1,77 @@
+from sqlalchemy.orm import joinedload, selectinload
+
+from app.models.tipos_usuario import Medico, Paciente
+from app.models.cita import Cita
+from app.models.consulta import Consulta
+from app.models.documentos import RecetaMedica, OrdenLaboratorio
+
+
+def _relaciones_cita_lista():
+    """Relaciones de una cita que se muestran en los listados."""
+    return [
+        joinedload(Cita.paciente).joinedload(Paciente.usuario),
+        joinedload(Cita.medico).joinedload(Medico.usuario),
+        joinedload(Cita.especialidad),
+        joinedload(Cita.centro_medico),
+        selectinload(Cita.sala_virtual)
+    ]
+
+
+def _cita_detalle():
+    """Relaciones de los listados más la consulta y quien canceló la cita."""
+    return _relaciones_cita_lista() + [
+        selectinload(Cita.consulta),
+        joinedload(Cita.usuario_cancelador)
+    ]
+
+
+def _consulta_lista():
+    """La cita de cada consulta con las relaciones de los listados."""
+    return [joinedload(Consulta.cita).options(*_relaciones_cita_lista())]
+
+
+def _receta_lista():
+    """Paciente y médico de cada receta en los listados."""
+    return [
+        joinedload(RecetaMedica.paciente).joinedload(Paciente.usuario),
+        joinedload(RecetaMedica.medico).joinedload(Medico.usuario)
+    ]
+
+
+def _orden_lista():
+    """Paciente y médico de cada orden de laboratorio en los listados."""
+    return [
+        joinedload(OrdenLaboratorio.paciente).joinedload(Paciente.usuario),
+        joinedload(OrdenLaboratorio.medico).joinedload(Medico.usuario)
+    ]
+
+
+# Perfiles de carga disponibles
+PERFILES_CARGA = {
+    'cita_lista': _relaciones_cita_lista,
+    'cita_detalle': _cita_detalle,
+    'consulta_lista': _consulta_lista,
+    'receta_lista': _receta_lista,
+    'orden_lista': _orden_lista,
+}
+
+
+def perfil_carga(nombre):
+    """
+    Obtiene las opciones de carga de un perfil para aplicarlas a una consulta.
+    
+    Las relaciones muchos a uno se cargan con joinedload en la misma consulta y
+    las relaciones uno a uno o uno a muchos con selectinload en una consulta
+    adicional, de modo que la cantidad de consultas no depende de las filas.
+    
+    Uso:
+        Cita.query.options(*perfil_carga('cita_lista'))
+    
+    Args:
+        nombre: 'cita_lista', 'cita_detalle', 'consulta_lista', 'receta_lista'
+            u 'orden_lista'
+    
+    Returns:
+        list: Opciones de carga
+    """
+    return PERFILES_CARGA[nombre]()
@@ -0,0 +1,299 @@
+import threading
+import time
+import uuid
+from collections import deque
+from datetime import datetime, timedelta
+
+from flask import current_app
+from sqlalchemy import select, update
+from sqlalchemy.orm import joinedload
+
+from app.extensions import db, mail, socketio
+from app.models.cita import Cita
+from app.models.tipos_usuario import Paciente
+from app.utils.email import enviar_recordatorio_cita
+
+# Tipos de recordatorio: anticipación con que se envían y columna que los marca
+TIPOS_RECORDATORIO = {
+    '1h': (timedelta(hours=1), 'recordatorio_1h_enviado'),
+    '24h': (timedelta(hours=24), 'recordatorio_24h_enviado'),
+}
+
+# Solo se recuerdan citas que siguen vigentes
+ESTADOS_RECORDATORIO = ('pendiente', 'confirmada')
+
+
+class MetricasRecordatorios:
+    """
+    Métricas del envío de recordatorios en el proceso actual.
+    
+    Registra los envíos de los últimos 60 segundos para calcular el rendimiento
+    por minuto, y el retraso entre el momento en que correspondía enviar cada
+    recordatorio y su envío efectivo.
+    """
+    
+    def __init__(self):
+        self._envios = deque()  # (instante, cantidad) de los últimos 60 segundos
+        self._lock = threading.Lock()
+        self.enviados = 0
+        self.fallidos = 0
+        self.lotes = 0
+        self.ultimo_retraso = 0.0
+        self.maximo_retraso = 0.0
+        self.ultima_ejecucion = None
+    
+    def registrar_lote(self, enviados, fallidos, retrasos):
+        """
+        Registra el resultado de un lote de envíos.
+        
+        Args:
+            enviados: Cantidad de recordatorios enviados
+            fallidos: Cantidad de recordatorios que fallaron
+            retrasos: Lista de retrasos en segundos de los recordatorios enviados
+        """
+        ahora = time.monotonic()
+        with self._lock:
+            self.lotes += 1
+            self.enviados += enviados
+            self.fallidos += fallidos
+            self.ultima_ejecucion = datetime.now()
+            if enviados:
+                self._envios.append((ahora, enviados))
+            if retrasos:
+                self.ultimo_retraso = max(retrasos)
+                self.maximo_retraso = max(self.maximo_retraso, self.ultimo_retraso)
+    
+    def por_minuto(self):
+        """Cantidad de recordatorios enviados en los últimos 60 segundos."""
+        limite = time.monotonic() - 60
+        with self._lock:
+            while self._envios and self._envios[0][0] < limite:
+                self._envios.popleft()
+            return sum(cantidad for _, cantidad in self._envios)
+    
+    def resumen(self):
+        """
+        Obtiene las métricas actuales.
+        
+        Returns:
+            dict: Totales, rendimiento por minuto y retrasos en segundos
+        """
+        por_minuto = self.por_minuto()
+        with self._lock:
+            return {
+                'enviados': self.enviados,
+                'fallidos': self.fallidos,
+                'lotes': self.lotes,
+                'enviados_por_minuto': por_minuto,
+                'ultimo_retraso_segundos': round(self.ultimo_retraso, 1),
+                'maximo_retraso_segundos': round(self.maximo_retraso, 1),
+                'ultima_ejecucion': self.ultima_ejecucion.isoformat() if self.ultima_ejecucion else None
+            }
+
+
+# Instancia compartida por el proceso
+metricas_recordatorios = MetricasRecordatorios()
+
+
+def _filtros_pendientes(tipo, ahora):
+    """
+    Construye los filtros de las citas con un recordatorio pendiente de enviar.
+    
+    Args:
+        tipo: Tipo de recordatorio ('24h' o '1h')
+        ahora: Fecha y hora de referencia
+    
+    Returns:
+        list: Condiciones para la consulta
+    """
+    anticipacion, columna = TIPOS_RECORDATORIO[tipo]
+    
+    # Las citas que ya están dentro de la hora previa solo reciben el recordatorio de 1h
+    desde = ahora + TIPOS_RECORDATORIO['1h'][0] if tipo == '24h' else ahora
+    plazo_reclamo = timedelta(seconds=current_app.config.get('REMINDER_CLAIM_SECONDS', 600))
+    
+    return [
+        Cita.fecha_hora > desde,
+        Cita.fecha_hora <= ahora + anticipacion,
+        getattr(Cita, columna) == False,
+        Cita.estado.in_(ESTADOS_RECORDATORIO),
+        db.or_(Cita.recordatorio_reclamado_en == None,
+               Cita.recordatorio_reclamado_en < ahora - plazo_reclamo)
+    ]
+
+
+def reclamar_recordatorios(tipo, trabajador, ahora=None, tamano=None):
+    """
+    Reclama un lote de citas con recordatorio pendiente para este proceso.
+    
+    En PostgreSQL las filas se seleccionan con FOR UPDATE SKIP LOCKED, de modo
+    que varios procesos pueden reclamar lotes distintos en paralelo sin
+    bloquearse. En SQLite, donde las escrituras se serializan, el reclamo se
+    hace con un único UPDATE condicional sobre la columna de reclamo.
+    
+    Args:
+        tipo: Tipo de recordatorio ('24h' o '1h')
+        trabajador: Identificador del proceso que reclama
+        ahora: Fecha y hora de referencia (por defecto, la actual)
+        tamano: Cantidad máxima de citas a reclamar
+    
+    Returns:
+        list: IDs de las citas reclamadas
+    """
+    ahora = ahora or datetime.now()
+    tamano = tamano or current_app.config.get('REMINDER_BATCH_SIZE', 100)
+    
+    consulta = select(Cita.id).where(*_filtros_pendientes(tipo, ahora))\
+                              .order_by(Cita.fecha_hora).limit(tamano)
+    marca = {'recordatorio_reclamado_en': ahora, 'recordatorio_reclamado_por': trabajador}
+    
+    if db.session.get_bind().dialect.name == 'postgresql':
+        ids = db.session.scalars(consulta.with_for_update(skip_locked=True)).all()
+        if ids:
+            db.session.execute(update(Cita).where(Cita.id.in_(ids)).values(**marca))
+    else:
+        db.session.execute(update(Cita).where(Cita.id.in_(consulta.scalar_subquery())).values(**marca))
+        ids = db.session.scalars(select(Cita.id).where(
+            Cita.recordatorio_reclamado_por == trabajador,
+            Cita.recordatorio_reclamado_en == ahora
+        )).all()
+    
+    db.session.commit()
+    return list(ids)
+
+
+def enviar_lote_recordatorios(tipo, ids, ahora=None):
+    """
+    Envía los recordatorios de un lote reclamado y actualiza las marcas en bloque.
+    
+    Todos los correos del lote se envían por una misma conexión SMTP. Las citas
+    cuyo envío falla se liberan para reintentarlas en la próxima pasada.
+    
+    Args:
+        tipo: Tipo de recordatorio ('24h' o '1h')
+        ids: IDs de las citas reclamadas
+        ahora: Fecha y hora de referencia (por defecto, la actual)
+    
+    Returns:
+        tuple: (enviados, fallidos)
+    """
+    anticipacion, columna = TIPOS_RECORDATORIO[tipo]
+    
+    citas = Cita.query.options(
+        joinedload(Cita.paciente).joinedload(Paciente.usuario),
+        joinedload(Cita.especialidad)
+    ).filter(Cita.id.in_(ids)).all()
+    
+    enviados, fallidos, retrasos = [], [], []
+    
+    # Las fechas de creación se guardan en UTC y las de las citas en hora local
+    desfase = datetime.now() - datetime.utcnow()
+    
+    with mail.connect() as conexion:
+        for cita in citas:
+            try:
+                enviar_recordatorio_cita(cita, tipo=tipo, conexion=conexion)
+            except Exception as e:
+                current_app.logger.warning(f'No se pudo enviar el recordatorio {tipo} de la cita {cita.id}: {e}')
+                fallidos.append(cita.id)
+                continue
+            
+            enviados.append(cita.id)
+            
+            # Retraso respecto del momento en que el recordatorio pasó a estar pendiente
+            pendiente_desde = cita.fecha_hora - anticipacion
+            if cita.fecha_creacion:
+                pendiente_desde = max(pendiente_desde, cita.fecha_creacion + desfase)
+            retrasos.append(max((datetime.now() - pendiente_desde).total_seconds(), 0))
+    
+    liberar = {'recordatorio_reclamado_en': None, 'recordatorio_reclamado_por': None}
+    
+    if enviados:
+        valores = dict(liberar, **{columna: True})
+        if tipo == '1h':
+            # El recordatorio de 24h ya no tiene sentido una vez enviado el de 1h
+            valores['recordatorio_24h_enviado'] = True
+        db.session.execute(update(Cita).where(Cita.id.in_(enviados)).values(**valores))
+    
+    if fallidos:
+        db.session.execute(update(Cita).where(Cita.id.in_(fallidos)).values(**liberar))
+    
+    db.session.commit()
+    
+    metricas_recordatorios.registrar_lote(len(enviados), len(fallidos), retrasos)
+    return len(enviados), len(fallidos)
+
+
+def procesar_recordatorios(trabajador=None, tamano=None):
+    """
+    Realiza una pasada completa: reclama y envía lotes hasta agotar los pendientes.
+    
+    Args:
+        trabajador: Identificador del proceso (por defecto, uno aleatorio)
+        tamano: Cantidad de citas por lote
+    
+    Returns:
+        dict: Cantidad de recordatorios enviados y fallidos por tipo
+    """
+    trabajador = trabajador or uuid.uuid4().hex
+    resultado = {}
+    
+    for tipo in TIPOS_RECORDATORIO:
+        enviados = fallidos = 0
+        reintentados = set()
+        
+        while True:
+            ids = reclamar_recordatorios(tipo, trabajador, tamano=tamano)
+            
+            # Los fallidos se liberan y pueden volver a reclamarse; se reintentan en la próxima pasada
+            ids = [i for i in ids if i not in reintentados]
+            if not ids:
+                break
+            
+            lote_enviados, lote_fallidos = enviar_lote_recordatorios(tipo, ids)
+            enviados += lote_enviados
+            fallidos += lote_fallidos
+            
+            if lote_fallidos:
+                reintentados.update(ids)
+        
+        resultado[tipo] = {'enviados': enviados, 'fallidos': fallidos}
+    
+    return resultado
+
+
+def ejecutar_programador(app, intervalo=None, una_vez=False):
+    """
+    Ejecuta el programador de recordatorios en un bucle.
+    
+    Args:
+        app: Aplicación Flask
+        intervalo: Segundos entre pasadas (por defecto REMINDER_INTERVAL_SECONDS)
+        una_vez: Si es True realiza una sola pasada
+    """
+    intervalo = intervalo or app.config.get('REMINDER_INTERVAL_SECONDS', 60)
+    trabajador = uuid.uuid4().hex
+    
+    while True:
+        with app.app_context():
+            try:
+                procesar_recordatorios(trabajador)
+            except Exception as e:
+                db.session.rollback()
+                app.logger.error(f'Error al procesar recordatorios: {e}')
+        
+        if una_vez:
+            return
+        
+        # Cede el control al resto de hilos verdes mientras espera
+        socketio.sleep(intervalo)
+
+
+def iniciar_programador(app):
+    """
+    Inicia el programador de recordatorios como hilo verde dentro del proceso.
+    
+    Args:
+        app: Aplicación Flask
+    """
+    return socketio.start_background_task(ejecutar_programador, app)
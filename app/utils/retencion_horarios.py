@@ -0,0 +1,121 @@
+from datetime import datetime, timedelta
+
+from flask import current_app
+from sqlalchemy.exc import IntegrityError
+
+from app.extensions import db
+from app.models.cita import RetencionHorario
+
+
+class RetencionHorarios:
+    """
+    Gestiona retenciones temporales de horarios durante el flujo de agendamiento.
+    
+    Cuando un paciente selecciona un horario se le reserva por unos minutos para
+    que otro paciente no lo tome mientras completa el formulario. Las retenciones
+    se guardan en la tabla retenciones_horarios, de modo que son las mismas para
+    todos los procesos y trabajadores de la aplicación, y vencen de forma
+    perezosa: las lecturas ignoran las vencidas y cada nueva retención elimina
+    las que ya vencieron, sin necesidad de un hilo que revise periódicamente.
+    La unicidad por horario y por usuario la garantiza la base de datos.
+    """
+    
+    @staticmethod
+    def _vigentes():
+        """Consulta de las retenciones que aún no vencieron."""
+        return RetencionHorario.query.filter(RetencionHorario.vence > datetime.utcnow())
+    
+    def retener(self, medico_id, fecha_hora, usuario_id, segundos=None):
+        """
+        Retiene un horario para un usuario. Cada usuario retiene como máximo un
+        horario: una nueva retención libera la anterior.
+        
+        Args:
+            medico_id: ID del médico
+            fecha_hora: Fecha y hora del horario
+            usuario_id: ID del usuario que retiene el horario
+            segundos: Duración de la retención (por defecto SLOT_HOLD_SECONDS)
+        
+        Returns:
+            bool: True si se retuvo, False si otro usuario lo tiene retenido
+        """
+        if segundos is None:
+            segundos = current_app.config.get('SLOT_HOLD_SECONDS', 300)
+        
+        ahora = datetime.utcnow()
+        
+        # Descartar las retenciones vencidas
+        RetencionHorario.query.filter(RetencionHorario.vence <= ahora).delete(synchronize_session=False)
+        
+        retencion = RetencionHorario.query.filter_by(medico_id=medico_id, fecha_hora=fecha_hora).first()
+        if retencion and retencion.usuario_id != usuario_id:
+            db.session.commit()
+            return False
+        
+        # Liberar la retención anterior del usuario
+        RetencionHorario.query.filter(
+            RetencionHorario.usuario_id == usuario_id,
+            (RetencionHorario.medico_id != medico_id) | (RetencionHorario.fecha_hora != fecha_hora)
+        ).delete(synchronize_session=False)
+        
+        if retencion is None:
+            retencion = RetencionHorario(medico_id=medico_id, fecha_hora=fecha_hora, usuario_id=usuario_id)
+            db.session.add(retencion)
+        retencion.vence = ahora + timedelta(seconds=segundos)
+        
+        try:
+            db.session.commit()
+        except IntegrityError:
+            # Otro usuario retuvo el horario al mismo tiempo
+            db.session.rollback()
+            return False
+        
+        return True
+    
+    def liberar(self, medico_id, fecha_hora, usuario_id=None, confirmar=True):
+        """
+        Libera la retención de un horario.
+        
+        Args:
+            medico_id: ID del médico
+            fecha_hora: Fecha y hora del horario
+            usuario_id: Si se indica, solo se libera si la retención es de este usuario
+            confirmar: Si es False, la eliminación queda en la transacción en
+                curso (por ejemplo, para confirmarla junto con la cita)
+        """
+        consulta = RetencionHorario.query.filter_by(medico_id=medico_id, fecha_hora=fecha_hora)
+        if usuario_id is not None:
+            consulta = consulta.filter_by(usuario_id=usuario_id)
+        
+        consulta.delete(synchronize_session=False)
+        if confirmar:
+            db.session.commit()
+    
+    def retenido_por_otro(self, medico_id, fecha_hora, usuario_id):
+        """Determina si el horario está retenido por un usuario distinto al indicado."""
+        return self._vigentes().filter(
+            RetencionHorario.medico_id == medico_id,
+            RetencionHorario.fecha_hora == fecha_hora,
+            RetencionHorario.usuario_id != usuario_id
+        ).count() > 0
+    
+    def horarios_retenidos(self, medico_id, excepto_usuario_id=None):
+        """
+        Obtiene los horarios retenidos de un médico.
+        
+        Args:
+            medico_id: ID del médico
+            excepto_usuario_id: Excluir las retenciones de este usuario
+        
+        Returns:
+            set: Conjunto de objetos datetime retenidos
+        """
+        consulta = self._vigentes().filter(RetencionHorario.medico_id == medico_id)
+        if excepto_usuario_id is not None:
+            consulta = consulta.filter(RetencionHorario.usuario_id != excepto_usuario_id)
+        
+        return {fecha_hora for fecha_hora, in consulta.with_entities(RetencionHorario.fecha_hora)}
+
+
+# Instancia compartida; el estado está en la base de datos
+retencion_horarios = RetencionHorarios()
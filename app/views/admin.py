@@ -1,13 +1,25 @@
-from flask import Blueprint, render_template, redirect, url_for, flash, request, current_app
+from flask import Blueprint, render_template, redirect, url_for, flash, request, current_app, jsonify, abort
 from flask_login import login_required, current_user
 from datetime import datetime, date, timedelta
 
 from app.models.usuario import Usuario, Rol
-from app.models.tipos_usuario import Medico, Paciente, AdministradorCentro, AdministradorSistema, Especialidad
+from app.models.tipos_usuario import (Medico, Paciente, AdministradorCentro, AdministradorSistema, Especialidad,
+                                     medicos_centros)
 from app.models.centro_medico import CentroMedico
 from app.models.cita import Cita
+from app.models.estadistica import EstadisticaDiaria, EstadisticaUsuariosDiaria
 from app.extensions import db
 from app.utils.decorators import admin_required
+from app.utils.fechas import rango_dias
+from app.utils.recordatorios import metricas_recordatorios
+from app.utils.contrasenas import metricas_contrasenas
+from app.utils.consultas import limite_consultas
+from app.utils.cache_paneles import cache_paneles
+from app.utils.analitica import cancelaciones_del_dia, leer_rango
+from app.utils.paginacion import paginar_keyset
+from app.utils.busqueda import subconsulta_busqueda
+from app.utils.exportacion import (TIPOS_EXPORTACION, FORMATOS_EXPORTACION, leer_filtros,
+                                   respuesta_exportacion)
 
 # Crear el blueprint de administrador del sistema
 admin_bp = Blueprint('admin', __name__)
@@ -17,37 +29,49 @@ admin_bp = Blueprint('admin', __name__)
 @admin_required
 def inicio():
     """Vista principal del panel de administrador del sistema."""
-    # Estadísticas generales
-    total_usuarios = Usuario.query.count()
-    total_medicos = Medico.query.count()
-    total_pacientes = Paciente.query.count()
-    total_centros = CentroMedico.query.count()
+    # Estadísticas generales (en caché hasta que cambien los datos o venza el TTL)
+    hoy = date.today()
+    indicadores = cache_paneles.obtener(('admin', hoy), lambda: _indicadores_inicio(hoy))
     
     # Registros recientes
     usuarios_recientes = Usuario.query.order_by(Usuario.fecha_registro.desc()).limit(5).all()
     
-    # Citas hoy
-    citas_hoy = Cita.query.filter(
-        db.func.date(Cita.fecha_hora) == date.today()
-    ).count()
-    
-    # Médicos pendientes de validación
-    medicos_pendientes = Usuario.query.join(Usuario.roles).filter(
-        Rol.nombre == 'medico',
-        Usuario.activo == False
-    ).count()
-    
     return render_template(
         'admin/inicio.html',
-        total_usuarios=total_usuarios,
-        total_medicos=total_medicos,
-        total_pacientes=total_pacientes,
-        total_centros=total_centros,
         usuarios_recientes=usuarios_recientes,
-        citas_hoy=citas_hoy,
-        medicos_pendientes=medicos_pendientes
+        **indicadores
     )
 
+def _indicadores_inicio(hoy):
+    """
+    Calcula los indicadores del panel principal del administrador del sistema.
+    
+    Args:
+        hoy: Fecha del día actual
+    
+    Returns:
+        dict: Totales de usuarios, médicos, pacientes y centros, citas del día
+              y médicos pendientes de validación
+    """
+    # Citas hoy
+    inicio_hoy, inicio_manana = rango_dias(hoy)
+    
+    return {
+        'total_usuarios': Usuario.query.count(),
+        'total_medicos': Medico.query.count(),
+        'total_pacientes': Paciente.query.count(),
+        'total_centros': CentroMedico.query.count(),
+        'citas_hoy': Cita.query.filter(
+            Cita.fecha_hora >= inicio_hoy,
+            Cita.fecha_hora < inicio_manana
+        ).count(),
+        # Médicos pendientes de validación
+        'medicos_pendientes': Usuario.query.join(Usuario.roles).filter(
+            Rol.nombre == 'medico',
+            Usuario.activo == False
+        ).count()
+    }
+
 @admin_bp.route('/usuarios')
 @login_required
 @admin_required
@@ -69,24 +93,22 @@ def usuarios():
         activo = estado == 'activos'
         query = query.filter(Usuario.activo == activo)
     
-    if busqueda:
-        query = query.filter(
-            db.or_(
-                Usuario.nombre.like(f'%{busqueda}%'),
-                Usuario.apellido.like(f'%{busqueda}%'),
-                Usuario.numero_documento.like(f'%{busqueda}%'),
-                Usuario.email.like(f'%{busqueda}%')
-            )
-        )
+    # Con búsqueda se ordena por relevancia; sin ella, alfabéticamente
+    orden = [(Usuario.apellido, False), (Usuario.nombre, False), (Usuario.id, False)]
+    resultados = subconsulta_busqueda(busqueda)
+    if resultados is not None:
+        query = query.join(resultados, resultados.c.usuario_id == Usuario.id)
+        orden = [(resultados.c.rango, False), (Usuario.id, False)]
     
-    # Ordenar
-    usuarios = query.order_by(Usuario.apellido, Usuario.nombre).all()
+    # Ordenar y paginar
+    pagina = paginar_keyset(query, orden, request.args.get('cursor'))
     
     # Obtener roles para el filtro
     roles = Rol.query.all()
     
     return render_template('admin/usuarios.html', 
-                         usuarios=usuarios, 
+                         usuarios=pagina.items, 
+                         pagina=pagina,
                          roles=roles,
                          rol_actual=rol,
                          estado_actual=estado,
@@ -117,25 +139,22 @@ def medicos():
         elif estado == 'pendientes':
             query = query.filter(Medico.usuario.has(activo=False))
     
-    if busqueda:
-        query = query.filter(
-            db.or_(
-                Medico.usuario.has(nombre=busqueda),
-                Medico.usuario.has(apellido=busqueda),
-                Medico.usuario.has(numero_documento=busqueda),
-                Medico.usuario.has(email=busqueda),
-                Medico.numero_licencia.like(f'%{busqueda}%')
-            )
-        )
+    # Con búsqueda se ordena por relevancia; sin ella, alfabéticamente
+    orden = [(Usuario.apellido, False), (Usuario.nombre, False), (Medico.usuario_id, False)]
+    resultados = subconsulta_busqueda(busqueda)
+    if resultados is not None:
+        query = query.join(resultados, resultados.c.usuario_id == Medico.usuario_id)
+        orden = [(resultados.c.rango, False), (Medico.usuario_id, False)]
     
-    # Ordenar
-    medicos = query.order_by(Medico.usuario.has(apellido=db.asc()), Medico.usuario.has(nombre=db.asc())).all()
+    # Ordenar y paginar
+    pagina = paginar_keyset(query, orden, request.args.get('cursor'))
     
     # Obtener especialidades para el filtro
     especialidades = Especialidad.query.order_by(Especialidad.nombre).all()
     
     return render_template('admin/medicos.html', 
-                         medicos=medicos, 
+                         medicos=pagina.items, 
+                         pagina=pagina,
                          especialidades=especialidades,
                          especialidad_actual=especialidad_id,
                          estado_actual=estado,
@@ -167,11 +186,13 @@ def centros():
             )
         )
     
-    # Ordenar
-    centros = query.order_by(CentroMedico.nombre).all()
+    # Ordenar y paginar
+    pagina = paginar_keyset(query, [(CentroMedico.nombre, False), (CentroMedico.id, False)],
+                            request.args.get('cursor'))
     
     return render_template('admin/centros.html', 
-                         centros=centros,
+                         centros=pagina.items,
+                         pagina=pagina,
                          estado_actual=estado,
                          busqueda=busqueda)
 
@@ -337,86 +358,100 @@ def editar_especialidad(especialidad_id):
 @admin_bp.route('/estadisticas')
 @login_required
 @admin_required
+@limite_consultas(6)
 def estadisticas():
     """Vista para ver estadísticas del sistema."""
-    # Estadísticas generales
-    total_usuarios = Usuario.query.count()
-    total_medicos = Medico.query.count()
-    total_pacientes = Paciente.query.count()
-    total_centros = CentroMedico.query.count()
-    total_citas = Cita.query.count()
-    
-    # Citas por estado
-    citas_pendientes = Cita.query.filter_by(estado='pendiente').count()
-    citas_confirmadas = Cita.query.filter_by(estado='confirmada').count()
-    citas_completadas = Cita.query.filter_by(estado='completada').count()
-    citas_canceladas = Cita.query.filter_by(estado='cancelada').count()
-    
-    # Estadísticas por especialidad
-    especialidades = Especialidad.query.all()
-    estadisticas_especialidad = []
-    
-    for esp in especialidades:
-        medicos_esp = Medico.query.filter_by(especialidad_id=esp.id).count()
-        citas_esp = Cita.query.join(Cita.medico).filter(Medico.especialidad_id == esp.id).count()
-        
-        estadisticas_especialidad.append({
-            'especialidad': esp,
-            'medicos': medicos_esp,
-            'citas': citas_esp
-        })
+    # Totales generales y citas por estado (desde el resumen diario) en una sola consulta
+    totales = db.session.query(
+        db.select(db.func.count(Usuario.id)).scalar_subquery().label('usuarios'),
+        db.select(db.func.count(Medico.usuario_id)).scalar_subquery().label('medicos'),
+        db.select(db.func.count(Paciente.usuario_id)).scalar_subquery().label('pacientes'),
+        db.select(db.func.count(CentroMedico.id)).scalar_subquery().label('centros'),
+        db.func.coalesce(EstadisticaDiaria.total_citas_expr(), 0).label('citas'),
+        db.func.coalesce(db.func.sum(EstadisticaDiaria.citas_pendientes), 0).label('pendientes'),
+        db.func.coalesce(db.func.sum(EstadisticaDiaria.citas_confirmadas), 0).label('confirmadas'),
+        db.func.coalesce(db.func.sum(EstadisticaDiaria.citas_completadas), 0).label('completadas'),
+        db.func.coalesce(db.func.sum(EstadisticaDiaria.citas_canceladas), 0).label('canceladas')
+    ).select_from(EstadisticaDiaria).one()
+    
+    # Estadísticas por especialidad: médicos y citas agrupados en subconsultas
+    medicos_por_especialidad = db.session.query(
+        Medico.especialidad_id.label('especialidad_id'),
+        db.func.count(Medico.usuario_id).label('cantidad')
+    ).group_by(Medico.especialidad_id).subquery()
+    
+    citas_por_especialidad = db.session.query(
+        EstadisticaDiaria.especialidad_id.label('especialidad_id'),
+        EstadisticaDiaria.total_citas_expr().label('cantidad')
+    ).group_by(EstadisticaDiaria.especialidad_id).subquery()
+    
+    estadisticas_especialidad = [
+        {'especialidad': esp, 'medicos': medicos, 'citas': citas}
+        for esp, medicos, citas in db.session.query(
+            Especialidad,
+            db.func.coalesce(medicos_por_especialidad.c.cantidad, 0),
+            db.func.coalesce(citas_por_especialidad.c.cantidad, 0)
+        ).outerjoin(
+            medicos_por_especialidad, medicos_por_especialidad.c.especialidad_id == Especialidad.id
+        ).outerjoin(
+            citas_por_especialidad, citas_por_especialidad.c.especialidad_id == Especialidad.id
+        ).order_by(Especialidad.id).all()
+    ]
     
     # Estadísticas por centro médico
-    centros = CentroMedico.query.all()
-    estadisticas_centro = []
-    
-    for centro in centros:
-        medicos_centro = db.session.query(Medico).join(
-            Medico.centros_medicos
-        ).filter_by(id=centro.id).count()
-        
-        citas_centro = Cita.query.filter_by(centro_medico_id=centro.id).count()
-        
-        estadisticas_centro.append({
-            'centro': centro,
-            'medicos': medicos_centro,
-            'citas': citas_centro
-        })
+    medicos_por_centro = db.session.query(
+        medicos_centros.c.centro_medico_id.label('centro_medico_id'),
+        db.func.count(medicos_centros.c.medico_id).label('cantidad')
+    ).group_by(medicos_centros.c.centro_medico_id).subquery()
+    
+    citas_por_centro = db.session.query(
+        EstadisticaDiaria.centro_medico_id.label('centro_medico_id'),
+        EstadisticaDiaria.total_citas_expr().label('cantidad')
+    ).group_by(EstadisticaDiaria.centro_medico_id).subquery()
+    
+    estadisticas_centro = [
+        {'centro': centro, 'medicos': medicos, 'citas': citas}
+        for centro, medicos, citas in db.session.query(
+            CentroMedico,
+            db.func.coalesce(medicos_por_centro.c.cantidad, 0),
+            db.func.coalesce(citas_por_centro.c.cantidad, 0)
+        ).outerjoin(
+            medicos_por_centro, medicos_por_centro.c.centro_medico_id == CentroMedico.id
+        ).outerjoin(
+            citas_por_centro, citas_por_centro.c.centro_medico_id == CentroMedico.id
+        ).order_by(CentroMedico.id).all()
+    ]
     
     # Estadísticas temporales (últimos 30 días)
     fecha_inicio = date.today() - timedelta(days=30)
     
     # Nuevos usuarios por día
     nuevos_usuarios = db.session.query(
-        db.func.date(Usuario.fecha_registro).label('fecha'),
-        db.func.count(Usuario.id).label('cantidad')
+        EstadisticaUsuariosDiaria.fecha.label('fecha'),
+        EstadisticaUsuariosDiaria.nuevos_usuarios.label('cantidad')
     ).filter(
-        Usuario.fecha_registro >= fecha_inicio
-    ).group_by(
-        db.func.date(Usuario.fecha_registro)
-    ).all()
+        EstadisticaUsuariosDiaria.fecha >= fecha_inicio
+    ).order_by(EstadisticaUsuariosDiaria.fecha).all()
     
     # Citas por día
     citas_por_dia = db.session.query(
-        db.func.date(Cita.fecha_hora).label('fecha'),
-        db.func.count(Cita.id).label('cantidad')
+        EstadisticaDiaria.fecha.label('fecha'),
+        EstadisticaDiaria.total_citas_expr().label('cantidad')
     ).filter(
-        Cita.fecha_hora >= fecha_inicio
-    ).group_by(
-        db.func.date(Cita.fecha_hora)
-    ).all()
+        EstadisticaDiaria.fecha >= fecha_inicio
+    ).group_by(EstadisticaDiaria.fecha).order_by(EstadisticaDiaria.fecha).all()
     
     return render_template(
         'admin/estadisticas.html',
-        total_usuarios=total_usuarios,
-        total_medicos=total_medicos,
-        total_pacientes=total_pacientes,
-        total_centros=total_centros,
-        total_citas=total_citas,
-        citas_pendientes=citas_pendientes,
-        citas_confirmadas=citas_confirmadas,
-        citas_completadas=citas_completadas,
-        citas_canceladas=citas_canceladas,
+        total_usuarios=totales.usuarios,
+        total_medicos=totales.medicos,
+        total_pacientes=totales.pacientes,
+        total_centros=totales.centros,
+        total_citas=totales.citas,
+        citas_pendientes=totales.pendientes,
+        citas_confirmadas=totales.confirmadas,
+        citas_completadas=totales.completadas,
+        citas_canceladas=totales.canceladas,
         estadisticas_especialidad=estadisticas_especialidad,
         estadisticas_centro=estadisticas_centro,
         nuevos_usuarios=nuevos_usuarios,
@@ -429,4 +464,54 @@ def estadisticas():
 @admin_required
 def configuracion():
     """Vista para la configuración del sistema."""
-    return render_template('admin/configuracion.html')
\ No newline at end of file
+    return render_template('admin/configuracion.html')
+
+
+@admin_bp.route('/metricas-recordatorios')
+@login_required
+@admin_required
+def metricas_recordatorios_json():
+    """Devuelve las métricas del programador de recordatorios de este proceso."""
+    return jsonify(metricas_recordatorios.resumen())
+
+
+@admin_bp.route('/metricas-contrasenas')
+@login_required
+@admin_required
+def metricas_contrasenas_json():
+    """Devuelve las métricas del cálculo de hashes de contraseña de este proceso."""
+    return jsonify(metricas_contrasenas.resumen())
+
+
+@admin_bp.route('/estadisticas/cancelaciones')
+@login_required
+@admin_required
+def estadisticas_cancelaciones():
+    """Devuelve las tasas de cancelación e inasistencia de todos los centros."""
+    centro_id = request.args.get('centro_id', type=int)
+    fecha_desde, fecha_hasta = leer_rango(request.args)
+    
+    return jsonify({
+        'fecha_inicio': fecha_desde.isoformat(),
+        'fecha_fin': fecha_hasta.isoformat(),
+        **cancelaciones_del_dia(centro_id, fecha_desde, fecha_hasta)
+    })
+
+
+@admin_bp.route('/exportar/<tipo>')
+@login_required
+@admin_required
+def exportar(tipo):
+    """Exporta citas o consultas de todos los centros en CSV o NDJSON."""
+    formato = request.args.get('formato', 'csv')
+    if tipo not in TIPOS_EXPORTACION or formato not in FORMATOS_EXPORTACION:
+        abort(404)
+    
+    try:
+        filtros = leer_filtros(request.args)
+    except ValueError:
+        abort(400)
+    
+    centro_id = request.args.get('centro_id', type=int)
+    
+    return respuesta_exportacion(tipo, formato, centro_id=centro_id, **filtros)
@@ -1,12 +1,22 @@
-from flask import Blueprint, render_template, redirect, url_for, flash, request, current_app
+from flask import Blueprint, render_template, redirect, url_for, flash, request, current_app, abort, jsonify
 from flask_login import login_required, current_user
 from datetime import datetime, date, timedelta
+from sqlalchemy.orm import contains_eager
 
-from app.models.tipos_usuario import Medico, Especialidad
+from app.models.tipos_usuario import Medico, Especialidad, medicos_centros
 from app.models.centro_medico import CentroMedico, EspecialidadCentro
 from app.models.cita import Cita
+from app.models.estadistica import EstadisticaDiaria
 from app.extensions import db
 from app.utils.decorators import admin_centro_required
+from app.utils.fechas import rango_dias, inicio_del_dia
+from app.utils.cache_paneles import cache_paneles
+from app.utils.consultas import limite_consultas
+from app.utils.perfiles_carga import perfil_carga
+from app.utils.paginacion import paginar_keyset
+from app.utils.analitica import analizar_duraciones, cancelaciones_del_dia, leer_rango
+from app.utils.exportacion import (TIPOS_EXPORTACION, FORMATOS_EXPORTACION, leer_filtros,
+                                   respuesta_exportacion)
 
 # Crear el blueprint de administrador de centro
 admin_centro_bp = Blueprint('admin_centro', __name__)
@@ -19,36 +29,50 @@ def inicio():
     # Obtener el centro médico administrado
     centro = current_user.admin_centro.centro_medico
     
-    # Estadísticas del centro
-    total_medicos = db.session.query(Medico).join(
-        Medico.centros_medicos).filter_by(id=centro.id).count()
-    
-    total_especialidades = EspecialidadCentro.query.filter_by(
-        centro_medico_id=centro.id, disponible=True).count()
+    # Estadísticas del centro (en caché hasta que cambien los datos o venza el TTL)
+    hoy = date.today()
+    indicadores = cache_paneles.obtener(('centro', centro.id, hoy),
+                                        lambda: _indicadores_inicio(centro.id, hoy))
     
     # Citas de hoy
+    inicio_hoy, inicio_manana = rango_dias(hoy)
     citas_hoy = Cita.query.filter_by(centro_medico_id=centro.id).filter(
-        db.func.date(Cita.fecha_hora) == date.today()).all()
-    
-    # Citas pendientes
-    citas_pendientes = Cita.query.filter_by(
-        centro_medico_id=centro.id, estado='pendiente').count()
-    
-    # Citas de los últimos 30 días
-    fecha_inicio = date.today() - timedelta(days=30)
-    citas_mes = Cita.query.filter_by(centro_medico_id=centro.id).filter(
-        db.func.date(Cita.fecha_hora) >= fecha_inicio).count()
+        Cita.fecha_hora >= inicio_hoy,
+        Cita.fecha_hora < inicio_manana).all()
     
     return render_template(
         'admin_centro/inicio.html',
         centro=centro,
-        total_medicos=total_medicos,
-        total_especialidades=total_especialidades,
         citas_hoy=citas_hoy,
-        citas_pendientes=citas_pendientes,
-        citas_mes=citas_mes
+        **indicadores
     )
 
+def _indicadores_inicio(centro_id, hoy):
+    """
+    Calcula los indicadores del panel principal de un centro médico.
+    
+    Args:
+        centro_id: ID del centro médico
+        hoy: Fecha del día actual
+    
+    Returns:
+        dict: Totales de médicos y especialidades, citas pendientes y citas
+              de los últimos 30 días
+    """
+    # Citas de los últimos 30 días
+    fecha_inicio = hoy - timedelta(days=30)
+    
+    return {
+        'total_medicos': db.session.query(Medico).join(
+            Medico.centros_medicos).filter_by(id=centro_id).count(),
+        'total_especialidades': EspecialidadCentro.query.filter_by(
+            centro_medico_id=centro_id, disponible=True).count(),
+        'citas_pendientes': Cita.query.filter_by(
+            centro_medico_id=centro_id, estado='pendiente').count(),
+        'citas_mes': Cita.query.filter_by(centro_medico_id=centro_id).filter(
+            Cita.fecha_hora >= inicio_del_dia(fecha_inicio)).count()
+    }
+
 @admin_centro_bp.route('/medicos')
 @login_required
 @admin_centro_required
@@ -128,6 +152,7 @@ def especialidades():
 @admin_centro_bp.route('/citas')
 @login_required
 @admin_centro_required
+@limite_consultas(4)
 def citas():
     """Vista para gestionar las citas del centro."""
     # Obtener el centro médico administrado
@@ -154,15 +179,16 @@ def citas():
         fecha_fin = date.today() + timedelta(days=30)
     
     # Consulta base
-    query = Cita.query.filter_by(centro_medico_id=centro.id)
+    query = Cita.query.options(*perfil_carga('cita_lista')).filter_by(centro_medico_id=centro.id)
     
     # Aplicar filtros
     if estado != 'todas':
         query = query.filter_by(estado=estado)
     
+    desde, hasta = rango_dias(fecha_inicio, fecha_fin)
     query = query.filter(
-        db.func.date(Cita.fecha_hora) >= fecha_inicio,
-        db.func.date(Cita.fecha_hora) <= fecha_fin
+        Cita.fecha_hora >= desde,
+        Cita.fecha_hora < hasta
     )
     
     # Ordenar
@@ -192,73 +218,124 @@ def estadisticas():
     total_especialidades = EspecialidadCentro.query.filter_by(
         centro_medico_id=centro.id, disponible=True).count()
     
-    total_citas = Cita.query.filter_by(centro_medico_id=centro.id).count()
-    
-    # Citas por estado
-    citas_pendientes = Cita.query.filter_by(centro_medico_id=centro.id, estado='pendiente').count()
-    citas_confirmadas = Cita.query.filter_by(centro_medico_id=centro.id, estado='confirmada').count()
-    citas_completadas = Cita.query.filter_by(centro_medico_id=centro.id, estado='completada').count()
-    citas_canceladas = Cita.query.filter_by(centro_medico_id=centro.id, estado='cancelada').count()
-    
-    # Estadísticas por especialidad
-    especialidades_centro = EspecialidadCentro.query.filter_by(centro_medico_id=centro.id).all()
-    estadisticas_especialidad = []
-    
-    for esp_centro in especialidades_centro:
-        medicos_esp = db.session.query(Medico).filter_by(
-            especialidad_id=esp_centro.especialidad_id
-        ).join(Medico.centros_medicos).filter_by(id=centro.id).count()
-        
-        citas_esp = Cita.query.filter_by(
-            centro_medico_id=centro.id,
-            especialidad_id=esp_centro.especialidad_id
-        ).count()
-        
-        estadisticas_especialidad.append({
-            'especialidad': esp_centro.especialidad,
-            'medicos': medicos_esp,
-            'citas': citas_esp
-        })
+    # Citas por estado, desde el resumen diario
+    totales = db.session.query(
+        db.func.coalesce(EstadisticaDiaria.total_citas_expr(), 0).label('citas'),
+        db.func.coalesce(db.func.sum(EstadisticaDiaria.citas_pendientes), 0).label('pendientes'),
+        db.func.coalesce(db.func.sum(EstadisticaDiaria.citas_confirmadas), 0).label('confirmadas'),
+        db.func.coalesce(db.func.sum(EstadisticaDiaria.citas_completadas), 0).label('completadas'),
+        db.func.coalesce(db.func.sum(EstadisticaDiaria.citas_canceladas), 0).label('canceladas')
+    ).filter(EstadisticaDiaria.centro_medico_id == centro.id).one()
+    
+    # Estadísticas por especialidad: médicos del centro y citas agrupados en subconsultas
+    medicos_por_especialidad = db.session.query(
+        Medico.especialidad_id.label('especialidad_id'),
+        db.func.count(Medico.usuario_id).label('cantidad')
+    ).join(medicos_centros, medicos_centros.c.medico_id == Medico.usuario_id).filter(
+        medicos_centros.c.centro_medico_id == centro.id
+    ).group_by(Medico.especialidad_id).subquery()
+    
+    citas_por_especialidad = db.session.query(
+        EstadisticaDiaria.especialidad_id.label('especialidad_id'),
+        EstadisticaDiaria.total_citas_expr().label('cantidad')
+    ).filter(
+        EstadisticaDiaria.centro_medico_id == centro.id
+    ).group_by(EstadisticaDiaria.especialidad_id).subquery()
+    
+    estadisticas_especialidad = [
+        {'especialidad': especialidad, 'medicos': medicos, 'citas': citas}
+        for especialidad, medicos, citas in db.session.query(
+            Especialidad,
+            db.func.coalesce(medicos_por_especialidad.c.cantidad, 0),
+            db.func.coalesce(citas_por_especialidad.c.cantidad, 0)
+        ).join(
+            EspecialidadCentro, EspecialidadCentro.especialidad_id == Especialidad.id
+        ).outerjoin(
+            medicos_por_especialidad, medicos_por_especialidad.c.especialidad_id == Especialidad.id
+        ).outerjoin(
+            citas_por_especialidad, citas_por_especialidad.c.especialidad_id == Especialidad.id
+        ).filter(
+            EspecialidadCentro.centro_medico_id == centro.id
+        ).order_by(EspecialidadCentro.id).all()
+    ]
     
     # Estadísticas temporales (últimos 30 días)
     fecha_inicio = date.today() - timedelta(days=30)
     
     # Citas por día
     citas_por_dia = db.session.query(
-        db.func.date(Cita.fecha_hora).label('fecha'),
-        db.func.count(Cita.id).label('cantidad')
+        EstadisticaDiaria.fecha.label('fecha'),
+        EstadisticaDiaria.total_citas_expr().label('cantidad')
     ).filter(
-        Cita.centro_medico_id == centro.id,
-        Cita.fecha_hora >= fecha_inicio
-    ).group_by(
-        db.func.date(Cita.fecha_hora)
-    ).all()
+        EstadisticaDiaria.centro_medico_id == centro.id,
+        EstadisticaDiaria.fecha >= fecha_inicio
+    ).group_by(EstadisticaDiaria.fecha).order_by(EstadisticaDiaria.fecha).all()
     
     # Médicos más solicitados
+    total_por_medico = EstadisticaDiaria.total_citas_expr()
     medicos_top = db.session.query(
         Medico,
-        db.func.count(Cita.id).label('total_citas')
-    ).join(Cita).filter(
-        Cita.centro_medico_id == centro.id
+        total_por_medico.label('total_citas')
+    ).join(EstadisticaDiaria, EstadisticaDiaria.medico_id == Medico.usuario_id).filter(
+        EstadisticaDiaria.centro_medico_id == centro.id
     ).group_by(Medico).order_by(
-        db.func.count(Cita.id).desc()
+        total_por_medico.desc()
     ).limit(5).all()
     
+    # Duración de las consultas frente a la duración reservada
+    fecha_desde, fecha_hasta = leer_rango(request.args)
+    duraciones = analizar_duraciones(centro.id, fecha_desde, fecha_hasta)
+    
+    # Cancelaciones e inasistencias (se recalculan una vez por día)
+    cancelaciones = cancelaciones_del_dia(centro.id, fecha_desde, fecha_hasta)
+    
     return render_template(
         'admin_centro/estadisticas.html',
         centro=centro,
         total_medicos=total_medicos,
         total_especialidades=total_especialidades,
-        total_citas=total_citas,
-        citas_pendientes=citas_pendientes,
-        citas_confirmadas=citas_confirmadas,
-        citas_completadas=citas_completadas,
-        citas_canceladas=citas_canceladas,
+        total_citas=totales.citas,
+        citas_pendientes=totales.pendientes,
+        citas_confirmadas=totales.confirmadas,
+        citas_completadas=totales.completadas,
+        citas_canceladas=totales.canceladas,
         estadisticas_especialidad=estadisticas_especialidad,
         citas_por_dia=citas_por_dia,
-        medicos_top=medicos_top
+        medicos_top=medicos_top,
+        duraciones=duraciones,
+        cancelaciones=cancelaciones,
+        fecha_desde=fecha_desde,
+        fecha_hasta=fecha_hasta
     )
 
+@admin_centro_bp.route('/estadisticas/duraciones')
+@login_required
+@admin_centro_required
+def estadisticas_duraciones():
+    """Devuelve la distribución de duración de las consultas del centro."""
+    centro = current_user.admin_centro.centro_medico
+    fecha_desde, fecha_hasta = leer_rango(request.args)
+    
+    return jsonify({
+        'fecha_inicio': fecha_desde.isoformat(),
+        'fecha_fin': fecha_hasta.isoformat(),
+        **analizar_duraciones(centro.id, fecha_desde, fecha_hasta)
+    })
+
+@admin_centro_bp.route('/estadisticas/cancelaciones')
+@login_required
+@admin_centro_required
+def estadisticas_cancelaciones():
+    """Devuelve las tasas de cancelación e inasistencia de las citas del centro."""
+    centro = current_user.admin_centro.centro_medico
+    fecha_desde, fecha_hasta = leer_rango(request.args)
+    
+    return jsonify({
+        'fecha_inicio': fecha_desde.isoformat(),
+        'fecha_fin': fecha_hasta.isoformat(),
+        **cancelaciones_del_dia(centro.id, fecha_desde, fecha_hasta)
+    })
+
 @admin_centro_bp.route('/configuracion')
 @login_required
 @admin_centro_required
@@ -368,15 +445,36 @@ def pacientes():
     centro = current_user.admin_centro.centro_medico
     
     # Obtener pacientes únicos que han tenido citas en el centro
+    from app.models.usuario import Usuario
     from app.models.tipos_usuario import Paciente
     
     pacientes_ids = db.session.query(Cita.paciente_id).filter_by(
         centro_medico_id=centro.id
-    ).distinct().all()
+    ).distinct()
+    
+    # Obtener información de los pacientes, paginada por apellido y nombre
+    query = Paciente.query.join(Paciente.usuario).options(contains_eager(Paciente.usuario)).filter(
+        Paciente.usuario_id.in_(pacientes_ids))
+    pagina = paginar_keyset(query, [(Usuario.apellido, False), (Usuario.nombre, False), (Usuario.id, False)],
+                            request.args.get('cursor'))
+    
+    return render_template('admin_centro/pacientes.html', centro=centro, pacientes=pagina.items, pagina=pagina)
+
+@admin_centro_bp.route('/exportar/<tipo>')
+@login_required
+@admin_centro_required
+def exportar(tipo):
+    """Exporta citas o consultas del centro en CSV o NDJSON."""
+    formato = request.args.get('formato', 'csv')
+    if tipo not in TIPOS_EXPORTACION or formato not in FORMATOS_EXPORTACION:
+        abort(404)
     
-    pacientes_ids = [p[0] for p in pacientes_ids]
+    try:
+        filtros = leer_filtros(request.args)
+    except ValueError:
+        abort(400)
     
-    # Obtener información de los pacientes
-    pacientes = Paciente.query.filter(Paciente.usuario_id.in_(pacientes_ids)).all()
+    # Obtener el centro médico administrado
+    centro = current_user.admin_centro.centro_medico
     
-    return render_template('admin_centro/pacientes.html', centro=centro, pacientes=pacientes)
\ No newline at end of file
+    return respuesta_exportacion(tipo, formato, centro_id=centro.id, **filtros)
@@ -4,7 +4,7 @@ from werkzeug.security import generate_password_hash
 import uuid
 from datetime import datetime, timedelta
 
-from app.models.usuario import Usuario, Rol, HistorialAcceso
+from app.models.usuario import Usuario, Rol
 from app.models.tipos_usuario import Paciente, Medico, AdministradorCentro, AdministradorSistema
 from app.forms.auth import (LoginForm, RegistroPacienteForm, RegistroMedicoForm, 
                            RegistroAdminCentroForm, CambioPasswordForm, 
@@ -13,6 +13,7 @@ from app.forms.auth import (LoginForm, RegistroPacienteForm, RegistroMedicoForm,
 from app.extensions import db
 from app.utils.email import enviar_email
 from app.utils.security import generar_token, verificar_token
+from app.utils.contrasenas import ServicioContrasenasSaturado
 from app.utils.decorators import admin_required, admin_centro_required, sin_autenticar
 
 # Crear el blueprint de autenticación
@@ -29,7 +30,14 @@ def login():
         # Buscar al usuario por número de documento
         usuario = Usuario.query.filter_by(numero_documento=form.numero_documento.data).first()
         
-        if usuario and usuario.verificar_password(form.password.data):
+        # Con demasiados inicios de sesión simultáneos se pide reintentar en lugar de encolar
+        try:
+            password_correcta = usuario is not None and usuario.verificar_password(form.password.data)
+        except ServicioContrasenasSaturado as e:
+            flash(e.description, 'warning')
+            return render_template('auth/login.html', form=form), 503
+        
+        if password_correcta:
             # Verificar si el usuario está activo
             if not usuario.activo:
                 flash('Su cuenta está desactivada. Por favor contacte al administrador.', 'danger')
@@ -38,15 +46,8 @@ def login():
             # Crear sesión
             login_user(usuario, remember=form.recordar.data)
             
-            # Registrar el acceso
-            usuario.registrar_acceso()
-            
-            # Guardar información de acceso
-            acceso = HistorialAcceso(usuario_id=usuario.id)
-            acceso.direccion_ip = request.remote_addr
-            acceso.user_agent = request.user_agent.string
-            
-            db.session.add(acceso)
+            # Registrar el acceso (una sola vez, con IP y navegador)
+            usuario.registrar_acceso(request.remote_addr, request.user_agent.string)
             db.session.commit()
             
             # Redireccionar a la página solicitada o a la página de inicio
@@ -4,15 +4,23 @@ from flask_login import login_required, current_user
 from datetime import datetime, date, timedelta
 import uuid
 
-from app.models.cita import Cita, Disponibilidad, SalaVirtual
+from app.models.cita import Cita, Disponibilidad, SalaVirtual, FranjaHoraria, CupoAgotadoError
 from app.models.consulta import Consulta
-from app.models.tipos_usuario import Medico, Especialidad, CentroMedico
+from app.models.usuario import Usuario
+from app.models.tipos_usuario import Medico, Especialidad, HorarioMedico
+from app.models.centro_medico import CentroMedico
 from app.forms.cita import (AgendarCitaForm, BuscarHorariosForm, RegistrarDisponibilidadForm,
                          CancelarCitaForm, ReprogramarCitaForm)
 from app.extensions import db
 from app.utils.decorators import paciente_required, medico_required, validar_propiedad_cita
+from app.utils.agenda import (guardar_reserva, registrar_disponibilidades, obtener_horarios_disponibles,
+                              horario_disponible, proximos_horarios_disponibles, resumen_horarios_libres,
+                              dias_sin_cupo)
+from app.utils.retencion_horarios import retencion_horarios
+from app.utils.horarios_recurrentes import turnos_recurrentes
 from app.utils.email import enviar_notificacion_cita, enviar_notificacion_cancelacion
 from app.utils.security import generar_token
+from app.utils.perfiles_carga import perfil_carga
 
 # Crear el blueprint de citas
 cita_bp = Blueprint('cita', __name__)
@@ -69,7 +77,8 @@ def agendar():
                         try:
                             form.fecha.data = datetime.strptime(fecha, '%Y-%m-%d').date()
                             # Cargar horarios disponibles
-                            horarios = obtener_horarios_disponibles(medico_id, centro_id, form.fecha.data)
+                            horarios = obtener_horarios_disponibles(medico_id, centro_id, form.fecha.data,
+                                                                   usuario_id=current_user.id)
                             if horarios:
                                 form.horario.choices = [(h.strftime('%H:%M'), h.strftime('%H:%M')) for h in horarios]
                             else:
@@ -86,14 +95,10 @@ def agendar():
             '%Y-%m-%d %H:%M'
         )
         
-        # Verificar si ya existe una cita para este médico y horario
-        cita_existente = Cita.query.filter_by(
-            medico_id=form.medico_id.data,
-            fecha_hora=fecha_hora,
-            estado=['pendiente', 'confirmada', 'en_curso']
-        ).first()
-        
-        if cita_existente:
+        # Verificar que el horario sea uno de los ofrecidos por el médico en el centro
+        # y que no esté ocupado ni retenido por otro paciente
+        if not horario_disponible(form.medico_id.data, form.centro_medico_id.data, fecha_hora,
+                                  usuario_id=current_user.id):
             flash('Este horario ya no está disponible. Por favor seleccione otro.', 'danger')
             return redirect(url_for('cita.agendar'))
         
@@ -117,10 +122,22 @@ def agendar():
             cita=cita
         )
         
-        # Guardar en la base de datos
-        db.session.add(cita)
-        db.session.add(sala)
-        db.session.commit()
+        # La retención se elimina en la misma transacción que crea la cita
+        retencion_horarios.liberar(form.medico_id.data, fecha_hora, current_user.id, confirmar=False)
+        
+        # Guardar en la base de datos; la unicidad del horario la garantiza el índice
+        # y el cupo diario del médico lo controla el contador de capacidad
+        try:
+            reservada = guardar_reserva(cita, sala)
+        except CupoAgotadoError:
+            retencion_horarios.liberar(form.medico_id.data, fecha_hora, current_user.id)
+            flash('El médico ya no tiene cupo disponible para esta fecha. Por favor seleccione otra.', 'danger')
+            return redirect(url_for('cita.agendar'))
+        
+        if not reservada:
+            retencion_horarios.liberar(form.medico_id.data, fecha_hora, current_user.id)
+            flash('Este horario ya no está disponible. Por favor seleccione otro.', 'danger')
+            return redirect(url_for('cita.agendar'))
         
         # Enviar notificaciones
         enviar_notificacion_cita(cita)
@@ -148,7 +165,7 @@ def horarios_disponibles():
         return jsonify({'error': 'Formato de fecha inválido'}), 400
     
     # Obtener horarios disponibles
-    horarios = obtener_horarios_disponibles(medico_id, centro_id, fecha)
+    horarios = obtener_horarios_disponibles(medico_id, centro_id, fecha, usuario_id=current_user.id)
     
     # Formatear horarios para JSON
     horarios_json = [h.strftime('%H:%M') for h in horarios]
@@ -156,6 +173,110 @@ def horarios_disponibles():
     return jsonify({'horarios': horarios_json})
 
 
+@cita_bp.route('/retener-horario', methods=['POST'])
+@login_required
+@paciente_required
+def retener_horario():
+    """Vista AJAX para retener temporalmente el horario seleccionado mientras se agenda."""
+    medico_id = request.form.get('medico_id', type=int)
+    centro_id = request.form.get('centro_id', type=int)
+    fecha_str = request.form.get('fecha')
+    horario_str = request.form.get('horario')
+    
+    if not medico_id or not centro_id or not fecha_str or not horario_str:
+        return jsonify({'error': 'Parámetros incompletos'}), 400
+    
+    try:
+        fecha_hora = datetime.strptime(f"{fecha_str} {horario_str}", '%Y-%m-%d %H:%M')
+    except ValueError:
+        return jsonify({'error': 'Formato de fecha u hora inválido'}), 400
+    
+    # Verificar que el horario siga libre
+    horarios = obtener_horarios_disponibles(medico_id, centro_id, fecha_hora.date(),
+                                            usuario_id=current_user.id)
+    
+    if fecha_hora not in horarios or \
+            not retencion_horarios.retener(medico_id, fecha_hora, current_user.id):
+        return jsonify({'error': 'Este horario ya no está disponible'}), 409
+    
+    return jsonify({
+        'retenido': True,
+        'expira_en': current_app.config.get('SLOT_HOLD_SECONDS', 300)
+    })
+
+
+@cita_bp.route('/calendario-horarios', methods=['GET'])
+@login_required
+def calendario_horarios():
+    """
+    Vista AJAX para obtener en una sola llamada los horarios libres por día de
+    uno o varios médicos en un rango de fechas (por ejemplo, un mes completo).
+    """
+    medico_ids = request.args.getlist('medico_id', type=int)
+    centro_id = request.args.get('centro_id', type=int)
+    fecha_inicio_str = request.args.get('fecha_inicio')
+    fecha_fin_str = request.args.get('fecha_fin')
+    detalle = request.args.get('detalle', 0, type=int) == 1
+    
+    if not medico_ids or not centro_id or not fecha_inicio_str or not fecha_fin_str:
+        return jsonify({'error': 'Parámetros incompletos'}), 400
+    
+    try:
+        fecha_inicio = datetime.strptime(fecha_inicio_str, '%Y-%m-%d').date()
+        fecha_fin = datetime.strptime(fecha_fin_str, '%Y-%m-%d').date()
+    except ValueError:
+        return jsonify({'error': 'Formato de fecha inválido'}), 400
+    
+    if fecha_fin < fecha_inicio or (fecha_fin - fecha_inicio).days > 92:
+        return jsonify({'error': 'El rango de fechas no puede ser mayor a 92 días'}), 400
+    
+    if len(medico_ids) > 20:
+        return jsonify({'error': 'Demasiados médicos en la consulta'}), 400
+    
+    resumen = resumen_horarios_libres(medico_ids, centro_id, fecha_inicio, fecha_fin,
+                                      usuario_id=current_user.id, detalle=detalle)
+    
+    # Formato compacto: {medico_id: {fecha: cantidad | [horas]}}
+    medicos_json = {
+        str(medico_id): {
+            fecha.strftime('%Y-%m-%d'): [h.strftime('%H:%M') for h in valor] if detalle else valor
+            for fecha, valor in dias.items()
+        }
+        for medico_id, dias in resumen.items()
+    }
+    
+    return jsonify({'medicos': medicos_json})
+
+
+@cita_bp.route('/proximos-horarios', methods=['GET'])
+@login_required
+def proximos_horarios():
+    """Vista AJAX para obtener los primeros horarios libres de una especialidad."""
+    especialidad_id = request.args.get('especialidad_id', type=int)
+    centro_id = request.args.get('centro_id', type=int)
+    limite = min(request.args.get('limite', 10, type=int), 50)
+    
+    if not especialidad_id:
+        return jsonify({'error': 'Parámetros incompletos'}), 400
+    
+    horarios = proximos_horarios_disponibles(especialidad_id, centro_id, limite=limite,
+                                             usuario_id=current_user.id)
+    
+    horarios_json = [
+        {
+            'fecha': h['fecha_hora'].strftime('%Y-%m-%d'),
+            'hora': h['fecha_hora'].strftime('%H:%M'),
+            'medico_id': h['medico_id'],
+            'medico_nombre': h['medico_nombre'],
+            'centro_id': h['centro_id'],
+            'centro_nombre': h['centro_nombre']
+        }
+        for h in horarios
+    ]
+    
+    return jsonify({'horarios': horarios_json})
+
+
 @cita_bp.route('/centros-por-especialidad/<int:especialidad_id>', methods=['GET'])
 @login_required
 def centros_por_especialidad(especialidad_id):
@@ -223,46 +344,31 @@ def registrar_disponibilidad():
         # Obtener máximo de citas (si se especificó)
         citas_maximas = int(form.citas_maximas.data) if form.citas_maximas.data else 0
         
-        # Iterar por cada día en el rango de fechas
-        fecha_actual = fecha_inicio
-        dias_creados = 0
-        
-        while fecha_actual <= fecha_fin:
-            # Verificar si este día de la semana está seleccionado
-            if fecha_actual.weekday() in dias_semana:
-                # Verificar si ya existe disponibilidad para este día
-                disponibilidad_existente = Disponibilidad.query.filter_by(
-                    medico_id=current_user.medico.usuario_id,
-                    centro_medico_id=form.centro_medico_id.data,
-                    fecha=fecha_actual,
-                    hora_inicio=form.hora_inicio.data,
-                    hora_fin=form.hora_fin.data
-                ).first()
-                
-                if not disponibilidad_existente:
-                    # Crear nueva disponibilidad
-                    disponibilidad = Disponibilidad(
-                        medico_id=current_user.medico.usuario_id,
-                        centro_medico_id=form.centro_medico_id.data,
-                        fecha=fecha_actual,
-                        hora_inicio=form.hora_inicio.data,
-                        hora_fin=form.hora_fin.data,
-                        intervalo_citas=intervalo_citas,
-                        citas_maximas=citas_maximas
-                    )
-                    
-                    db.session.add(disponibilidad)
-                    dias_creados += 1
-            
-            # Avanzar al siguiente día
-            fecha_actual += timedelta(days=1)
+        # Registrar todos los días en bloque
+        resultado = registrar_disponibilidades(
+            medico_id=current_user.medico.usuario_id,
+            centro_medico_id=form.centro_medico_id.data,
+            fecha_inicio=fecha_inicio,
+            fecha_fin=fecha_fin,
+            dias_semana=dias_semana,
+            hora_inicio=form.hora_inicio.data,
+            hora_fin=form.hora_fin.data,
+            intervalo_citas=intervalo_citas,
+            citas_maximas=citas_maximas
+        )
         
         db.session.commit()
         
-        flash(f'Disponibilidad registrada exitosamente para {dias_creados} días.', 'success')
+        flash(f'Disponibilidad registrada exitosamente para {resultado["creados"]} días '
+              f'({resultado["omitidos"]} ya existentes, '
+              f'{resultado["conflictos"]} en conflicto con otros horarios).',
+              'warning' if resultado['conflictos'] else 'success')
         return redirect(url_for('medico.horarios'))
     
-    return render_template('cita/registrar_disponibilidad.html', form=form)
+    # El formulario se muestra en el panel de horarios del médico
+    if request.method == 'POST':
+        flash('Por favor revise los datos de la disponibilidad.', 'danger')
+    return redirect(url_for('medico.horarios'))
 
 
 @cita_bp.route('/buscar-horarios', methods=['GET', 'POST'])
@@ -287,45 +393,97 @@ def buscar_horarios():
     resultados = []
     
     if form.validate_on_submit():
-        # Buscar disponibilidad según los criterios
-        query = Disponibilidad.query.filter(
-            Disponibilidad.fecha >= form.fecha_inicio.data,
-            Disponibilidad.fecha <= form.fecha_fin.data
+        desde = max(datetime.combine(form.fecha_inicio.data, datetime.min.time()), datetime.now())
+        hasta = datetime.combine(form.fecha_fin.data + timedelta(days=1), datetime.min.time())
+        
+        # Buscar franjas libres en el índice de horarios con una sola consulta
+        query = db.session.query(
+            FranjaHoraria.fecha,
+            FranjaHoraria.fecha_hora,
+            FranjaHoraria.medico_id,
+            FranjaHoraria.centro_medico_id,
+            Usuario.nombre,
+            Usuario.apellido,
+            Especialidad.nombre.label('especialidad'),
+            CentroMedico.nombre.label('centro_nombre')
+        ).join(Medico, Medico.usuario_id == FranjaHoraria.medico_id)\
+         .join(Usuario, Usuario.id == Medico.usuario_id)\
+         .join(Especialidad, Especialidad.id == Medico.especialidad_id)\
+         .join(CentroMedico, CentroMedico.id == FranjaHoraria.centro_medico_id)\
+         .filter(
+            FranjaHoraria.cita_id == None,
+            FranjaHoraria.fecha_hora >= desde,
+            FranjaHoraria.fecha_hora < hasta
         )
         
         # Filtrar por médico si se especificó
         if form.medico_id.data:
-            query = query.filter_by(medico_id=form.medico_id.data)
+            query = query.filter(FranjaHoraria.medico_id == form.medico_id.data)
         else:
             # Si no se especificó médico, filtrar por especialidad
-            query = query.join(Disponibilidad.medico).filter_by(especialidad_id=form.especialidad_id.data)
+            query = query.filter(Medico.especialidad_id == form.especialidad_id.data)
         
         # Filtrar por centro médico si se especificó
         if form.centro_medico_id.data:
-            query = query.filter_by(centro_medico_id=form.centro_medico_id.data)
-        
-        # Ejecutar la consulta
-        disponibilidades = query.order_by(Disponibilidad.fecha, Disponibilidad.hora_inicio).all()
+            query = query.filter(FranjaHoraria.centro_medico_id == form.centro_medico_id.data)
         
         # Procesar resultados
-        for disp in disponibilidades:
-            # Obtener horarios disponibles para esta disponibilidad
-            horarios = disp.generar_horarios_disponibles()
-            
-            if horarios:
-                medico = disp.medico
-                centro = disp.centro_medico
+        for franja in query.order_by(FranjaHoraria.fecha_hora, FranjaHoraria.medico_id).all():
+            resultados.append({
+                'fecha': franja.fecha,
+                'hora': franja.fecha_hora.time(),
+                'medico_id': franja.medico_id,
+                'medico_nombre': f"{franja.nombre} {franja.apellido}",
+                'especialidad': franja.especialidad,
+                'centro_id': franja.centro_medico_id,
+                'centro_nombre': franja.centro_nombre
+            })
+        
+        # Agregar los turnos calculados a partir de los horarios semanales
+        query = db.session.query(
+            HorarioMedico.medico_id,
+            HorarioMedico.centro_medico_id,
+            Usuario.nombre,
+            Usuario.apellido,
+            Especialidad.nombre.label('especialidad'),
+            CentroMedico.nombre.label('centro_nombre')
+        ).join(Medico, Medico.usuario_id == HorarioMedico.medico_id)\
+         .join(Usuario, Usuario.id == Medico.usuario_id)\
+         .join(Especialidad, Especialidad.id == Medico.especialidad_id)\
+         .join(CentroMedico, CentroMedico.id == HorarioMedico.centro_medico_id)\
+         .filter(HorarioMedico.activo == True)
+        
+        if form.medico_id.data:
+            query = query.filter(HorarioMedico.medico_id == form.medico_id.data)
+        else:
+            query = query.filter(Medico.especialidad_id == form.especialidad_id.data)
+        
+        if form.centro_medico_id.data:
+            query = query.filter(HorarioMedico.centro_medico_id == form.centro_medico_id.data)
+        
+        encontrados = {(r['medico_id'], r['centro_id'], r['fecha'], r['hora']) for r in resultados}
+        
+        for fila in query.distinct().all():
+            for turno in turnos_recurrentes(fila.medico_id, fila.centro_medico_id, desde, hasta):
+                if (fila.medico_id, fila.centro_medico_id, turno.date(), turno.time()) in encontrados:
+                    continue
                 
-                for horario in horarios:
-                    resultados.append({
-                        'fecha': disp.fecha,
-                        'hora': horario.time(),
-                        'medico_id': medico.usuario_id,
-                        'medico_nombre': medico.usuario.nombre_completo,
-                        'especialidad': medico.especialidad.nombre,
-                        'centro_id': centro.id,
-                        'centro_nombre': centro.nombre
-                    })
+                resultados.append({
+                    'fecha': turno.date(),
+                    'hora': turno.time(),
+                    'medico_id': fila.medico_id,
+                    'medico_nombre': f"{fila.nombre} {fila.apellido}",
+                    'especialidad': fila.especialidad,
+                    'centro_id': fila.centro_medico_id,
+                    'centro_nombre': fila.centro_nombre
+                })
+        
+        # Descartar los días en que el médico ya no tiene cupo
+        sin_cupo = dias_sin_cupo(list({r['medico_id'] for r in resultados}),
+                                 form.fecha_inicio.data, form.fecha_fin.data)
+        resultados = [r for r in resultados if r['fecha'] not in sin_cupo[r['medico_id']]]
+        
+        resultados.sort(key=lambda r: (r['fecha'], r['hora'], r['medico_id']))
     
     return render_template('cita/buscar_horarios.html', form=form, resultados=resultados)
 
@@ -335,7 +493,7 @@ def buscar_horarios():
 @validar_propiedad_cita
 def detalle(cita_id):
     """Vista para ver los detalles de una cita."""
-    cita = Cita.query.get_or_404(cita_id)
+    cita = Cita.query.options(*perfil_carga('cita_detalle')).filter_by(id=cita_id).first_or_404()
     return render_template('cita/detalle.html', cita=cita)
 
 
@@ -403,17 +561,9 @@ def reprogramar(cita_id):
             '%Y-%m-%d %H:%M'
         )
         
-        # Verificar si ya existe una cita para este médico y horario
-        cita_existente = Cita.query.filter(
-            Cita.medico_id == cita.medico_id,
-            Cita.fecha_hora == fecha_hora,
-            Cita.estado.in_(['pendiente', 'confirmada', 'en_curso']),
-            Cita.id != cita.id  # Excluir la cita actual
-        ).first()
-        
-        if cita_existente:
+        if not horario_disponible(cita.medico_id, cita.centro_medico_id, fecha_hora, usuario_id=current_user.id):
             flash('Este horario ya no está disponible. Por favor seleccione otro.', 'danger')
-            return redirect(url_for('cita.reprogramar', cita_id=cita.id))
+            return redirect(url_for('cita.reprogramar', cita_id=cita_id))
         
         # Registrar motivo de reprogramación
         notas_anteriores = cita.notas or ""
@@ -421,7 +571,15 @@ def reprogramar(cita_id):
         
         # Reprogramar la cita
         if cita.reprogramar(fecha_hora):
-            db.session.commit()
+            try:
+                reservada = guardar_reserva(cita)
+            except CupoAgotadoError:
+                flash('El médico ya no tiene cupo disponible para esta fecha. Por favor seleccione otra.', 'danger')
+                return redirect(url_for('cita.reprogramar', cita_id=cita_id))
+            
+            if not reservada:
+                flash('Este horario ya no está disponible. Por favor seleccione otro.', 'danger')
+                return redirect(url_for('cita.reprogramar', cita_id=cita_id))
             
             # Enviar notificaciones
             # Aquí debería enviarse una notificación de reprogramación
@@ -502,36 +660,3 @@ def iniciar_sala(cita_id):
     else:
         return redirect(url_for('sala.paciente', token=cita.sala_virtual.token_paciente))
 
-
-def obtener_horarios_disponibles(medico_id, centro_id, fecha):
-    """
-    Función auxiliar para obtener los horarios disponibles de un médico en una fecha específica.
-    
-    Args:
-        medico_id: ID del médico
-        centro_id: ID del centro médico
-        fecha: Fecha para la que se buscan horarios
-        
-    Returns:
-        list: Lista de objetos datetime con los horarios disponibles
-    """
-    # Buscar disponibilidades del médico para esta fecha y centro
-    disponibilidades = Disponibilidad.query.filter_by(
-        medico_id=medico_id,
-        centro_medico_id=centro_id,
-        fecha=fecha
-    ).all()
-    
-    # Si no hay disponibilidades, retornar lista vacía
-    if not disponibilidades:
-        return []
-    
-    # Obtener todos los horarios disponibles de todas las disponibilidades
-    todos_horarios = []
-    for disponibilidad in disponibilidades:
-        todos_horarios.extend(disponibilidad.generar_horarios_disponibles())
-    
-    # Ordenar horarios
-    todos_horarios.sort()
-    
-    return todos_horarios
\ No newline at end of file
@@ -4,8 +4,10 @@ from flask_login import login_required, current_user
 import os
 
 from app.models.documentos import RecetaMedica, OrdenLaboratorio
+from app.extensions import db
 from app.utils.pdf_generator import generar_pdf_receta, generar_pdf_orden
-from app.utils.decorators import login_required
+from app.utils.paginacion import paginar_keyset
+from app.utils.perfiles_carga import perfil_carga
 
 # Crear el blueprint de documentos
 documento_bp = Blueprint('documento', __name__)
@@ -16,22 +18,25 @@ def recetas():
     """Vista para listar las recetas médicas del usuario."""
     # Si es paciente, mostrar sus recetas
     if current_user.es_paciente:
-        recetas = RecetaMedica.query.filter_by(paciente_id=current_user.paciente.usuario_id)\
-                            .order_by(RecetaMedica.fecha_emision.desc()).all()
+        query = RecetaMedica.query.filter_by(paciente_id=current_user.paciente.usuario_id)
         
     # Si es médico, mostrar las recetas que ha emitido
     elif current_user.es_medico:
-        recetas = RecetaMedica.query.filter_by(medico_id=current_user.medico.usuario_id)\
-                            .order_by(RecetaMedica.fecha_emision.desc()).all()
+        query = RecetaMedica.query.filter_by(medico_id=current_user.medico.usuario_id)
     
     # Si es administrador, mostrar todas las recetas
     elif current_user.es_admin_sistema or current_user.es_admin_centro:
-        recetas = RecetaMedica.query.order_by(RecetaMedica.fecha_emision.desc()).all()
+        query = RecetaMedica.query
     
     else:
-        recetas = []
+        query = RecetaMedica.query.filter(db.false())
     
-    return render_template('documento/recetas.html', recetas=recetas)
+    # Ordenar y paginar
+    pagina = paginar_keyset(query.options(*perfil_carga('receta_lista')),
+                            [(RecetaMedica.fecha_emision, True), (RecetaMedica.id, True)],
+                            request.args.get('cursor'))
+    
+    return render_template('documento/recetas.html', recetas=pagina.items, pagina=pagina)
 
 @documento_bp.route('/ordenes')
 @login_required
@@ -39,22 +44,25 @@ def ordenes():
     """Vista para listar las órdenes de laboratorio del usuario."""
     # Si es paciente, mostrar sus órdenes
     if current_user.es_paciente:
-        ordenes = OrdenLaboratorio.query.filter_by(paciente_id=current_user.paciente.usuario_id)\
-                              .order_by(OrdenLaboratorio.fecha_emision.desc()).all()
+        query = OrdenLaboratorio.query.filter_by(paciente_id=current_user.paciente.usuario_id)
         
     # Si es médico, mostrar las órdenes que ha emitido
     elif current_user.es_medico:
-        ordenes = OrdenLaboratorio.query.filter_by(medico_id=current_user.medico.usuario_id)\
-                              .order_by(OrdenLaboratorio.fecha_emision.desc()).all()
+        query = OrdenLaboratorio.query.filter_by(medico_id=current_user.medico.usuario_id)
     
     # Si es administrador, mostrar todas las órdenes
     elif current_user.es_admin_sistema or current_user.es_admin_centro:
-        ordenes = OrdenLaboratorio.query.order_by(OrdenLaboratorio.fecha_emision.desc()).all()
+        query = OrdenLaboratorio.query
     
     else:
-        ordenes = []
+        query = OrdenLaboratorio.query.filter(db.false())
+    
+    # Ordenar y paginar
+    pagina = paginar_keyset(query.options(*perfil_carga('orden_lista')),
+                            [(OrdenLaboratorio.fecha_emision, True), (OrdenLaboratorio.id, True)],
+                            request.args.get('cursor'))
     
-    return render_template('documento/ordenes.html', ordenes=ordenes)
+    return render_template('documento/ordenes.html', ordenes=pagina.items, pagina=pagina)
 
 @documento_bp.route('/receta/<int:receta_id>')
 @login_required
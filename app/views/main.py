@@ -2,6 +2,9 @@ from flask import Blueprint, render_template, redirect, url_for, request, curren
 from flask_login import current_user
 from app.models.tipos_usuario import Especialidad, Medico
 from app.models.centro_medico import CentroMedico
+from app.models.usuario import Usuario
+from app.utils.busqueda import subconsulta_busqueda
+from app.utils.paginacion import paginar_keyset
 
 # Crear blueprint principal
 main_bp = Blueprint('main', __name__)
@@ -118,6 +121,7 @@ def medicos():
     # Filtros
     especialidad_id = request.args.get('especialidad', type=int)
     centro_id = request.args.get('centro', type=int)
+    busqueda = request.args.get('busqueda', '')
     
     # Consulta base
     query = Medico.query.filter_by(disponible=True)\
@@ -132,15 +136,24 @@ def medicos():
         query = query.join(Medico.centros_medicos)\
                      .filter_by(id=centro_id)
     
-    # Obtener médicos
-    medicos = query.all()
+    # Con búsqueda se ordena por relevancia; sin ella, alfabéticamente
+    orden = [(Usuario.apellido, False), (Usuario.nombre, False), (Medico.usuario_id, False)]
+    resultados = subconsulta_busqueda(busqueda)
+    if resultados is not None:
+        query = query.join(resultados, resultados.c.usuario_id == Medico.usuario_id)
+        orden = [(resultados.c.rango, False), (Medico.usuario_id, False)]
+    
+    # Obtener médicos, paginados
+    pagina = paginar_keyset(query, orden, request.args.get('cursor'))
     
     # Obtener especialidades y centros para los filtros
     especialidades = Especialidad.query.order_by(Especialidad.nombre).all()
     centros = CentroMedico.query.filter_by(activo=True).order_by(CentroMedico.nombre).all()
     
     return render_template('main/medicos.html', 
-                         medicos=medicos,
+                         medicos=pagina.items,
+                         pagina=pagina,
+                         busqueda=busqueda,
                          especialidades=especialidades,
                          centros=centros,
                          especialidad_seleccionada=especialidad_id,
@@ -1,15 +1,22 @@
 from flask import Blueprint, render_template, redirect, url_for, flash, request, current_app
 from flask_login import login_required, current_user
 from datetime import datetime, date, timedelta
+from sqlalchemy.orm import joinedload, selectinload
 
-from app.models.tipos_usuario import Medico, Paciente, Especialidad, CentroMedico
+from app.models.tipos_usuario import Medico, Paciente, Especialidad, HorarioMedico, ExcepcionHorario
+from app.models.centro_medico import CentroMedico
 from app.models.cita import Cita, Disponibilidad
 from app.models.consulta import Consulta
 from app.models.documentos import RecetaMedica, OrdenLaboratorio
-from app.forms.cita import RegistrarDisponibilidadForm, CancelarCitaForm
+from app.forms.cita import (RegistrarDisponibilidadForm, CancelarCitaForm, HorarioSemanalForm,
+                            ExcepcionHorarioForm)
 from app.forms.consulta import IniciarConsultaForm, RegistrarConsultaForm
 from app.extensions import db
 from app.utils.decorators import medico_required
+from app.utils.fechas import rango_dias
+from app.utils.consultas import limite_consultas
+from app.utils.perfiles_carga import perfil_carga
+from app.utils.paginacion import paginar_keyset
 
 # Crear el blueprint de médico
 medico_bp = Blueprint('medico', __name__)
@@ -17,28 +24,30 @@ medico_bp = Blueprint('medico', __name__)
 @medico_bp.route('/')
 @login_required
 @medico_required
+@limite_consultas(10)
 def inicio():
     """Vista principal del panel de médico."""
-    today = date.today()
+    inicio_hoy, inicio_manana = rango_dias(date.today())
     
     # Obtener citas de hoy
-    citas_hoy = Cita.query.filter_by(
+    citas_hoy = Cita.query.options(*perfil_carga('cita_lista')).filter_by(
         medico_id=current_user.medico.usuario_id
     ).filter(
-        db.func.date(Cita.fecha_hora) == today,
+        Cita.fecha_hora >= inicio_hoy,
+        Cita.fecha_hora < inicio_manana,
         Cita.estado.in_(['pendiente', 'confirmada', 'en_curso'])
     ).order_by(Cita.fecha_hora).all()
     
     # Obtener próximas citas (no de hoy)
-    citas_proximas = Cita.query.filter_by(
+    citas_proximas = Cita.query.options(*perfil_carga('cita_lista')).filter_by(
         medico_id=current_user.medico.usuario_id
     ).filter(
-        db.func.date(Cita.fecha_hora) > today,
+        Cita.fecha_hora >= inicio_manana,
         Cita.estado.in_(['pendiente', 'confirmada'])
     ).order_by(Cita.fecha_hora).limit(5).all()
     
     # Obtener consultas pendientes de completar
-    consultas_pendientes = Consulta.query.join(Consulta.cita).filter(
+    consultas_pendientes = Consulta.query.options(*perfil_carga('consulta_lista')).join(Consulta.cita).filter(
         Cita.medico_id == current_user.medico.usuario_id,
         Consulta.fecha_inicio != None,
         Consulta.fecha_fin == None
@@ -77,6 +86,7 @@ def inicio():
 @medico_bp.route('/citas')
 @login_required
 @medico_required
+@limite_consultas(3)
 def citas():
     """Vista para listar todas las citas del médico."""
     # Obtener parámetros de filtro
@@ -100,15 +110,17 @@ def citas():
         fecha_fin = date.today() + timedelta(days=30)
     
     # Consulta base
-    query = Cita.query.filter_by(medico_id=current_user.medico.usuario_id)
+    query = Cita.query.options(*perfil_carga('cita_lista')).filter_by(
+        medico_id=current_user.medico.usuario_id)
     
     # Aplicar filtros
     if estado != 'todas':
         query = query.filter_by(estado=estado)
     
+    desde, hasta = rango_dias(fecha_inicio, fecha_fin)
     query = query.filter(
-        db.func.date(Cita.fecha_hora) >= fecha_inicio,
-        db.func.date(Cita.fecha_hora) <= fecha_fin
+        Cita.fecha_hora >= desde,
+        Cita.fecha_hora < hasta
     )
     
     # Ordenar
@@ -154,6 +166,8 @@ def horarios():
     ).filter(
         Disponibilidad.fecha >= fecha_inicio,
         Disponibilidad.fecha <= fecha_fin
+    ).options(
+        joinedload(Disponibilidad.centro_medico)
     ).order_by(Disponibilidad.fecha, Disponibilidad.hora_inicio).all()
     
     # Obtener formulario para nueva disponibilidad
@@ -167,48 +181,199 @@ def horarios():
     
     form.centro_medico_id.choices = [(c.id, c.nombre) for c in centros]
     
+    # Horarios semanales recurrentes y excepciones del período
+    horarios_semanales = HorarioMedico.query.filter_by(
+        medico_id=current_user.medico.usuario_id,
+        activo=True
+    ).options(
+        joinedload(HorarioMedico.centro_medico)
+    ).order_by(HorarioMedico.dia_semana, HorarioMedico.hora_inicio).all()
+    
+    excepciones = ExcepcionHorario.query.filter(
+        db.or_(ExcepcionHorario.medico_id == current_user.medico.usuario_id,
+               ExcepcionHorario.medico_id == None),
+        ExcepcionHorario.fecha >= fecha_inicio,
+        ExcepcionHorario.fecha <= fecha_fin
+    ).options(
+        joinedload(ExcepcionHorario.centro_medico)
+    ).order_by(ExcepcionHorario.fecha, ExcepcionHorario.hora_inicio).all()
+    
+    form_semanal = HorarioSemanalForm()
+    form_semanal.centro_medico_id.choices = form.centro_medico_id.choices
+    
+    form_excepcion = ExcepcionHorarioForm()
+    form_excepcion.centro_medico_id.choices = [(0, 'Todos los centros')] + form.centro_medico_id.choices
+    
     return render_template('medico/horarios.html', 
                          disponibilidades=disponibilidades,
+                         horarios_semanales=horarios_semanales,
+                         excepciones=excepciones,
                          form=form,
+                         form_semanal=form_semanal,
+                         form_excepcion=form_excepcion,
                          fecha_inicio=fecha_inicio,
                          fecha_fin=fecha_fin)
 
-@medico_bp.route('/pacientes')
+def _centros_del_medico():
+    """Obtiene las opciones de centros médicos activos donde trabaja el médico actual."""
+    centros = CentroMedico.query.join(CentroMedico.medicos)\
+                        .filter_by(usuario_id=current_user.medico.usuario_id)\
+                        .filter(CentroMedico.activo==True)\
+                        .order_by(CentroMedico.nombre).all()
+    
+    return [(c.id, c.nombre) for c in centros]
+
+@medico_bp.route('/horario-semanal', methods=['POST'])
 @login_required
 @medico_required
-def pacientes():
-    """Vista para listar los pacientes atendidos por el médico."""
-    # Obtener pacientes únicos atendidos
-    pacientes_ids = db.session.query(Cita.paciente_id).filter_by(
-        medico_id=current_user.medico.usuario_id,
-        estado='completada'
-    ).distinct().all()
+def registrar_horario_semanal():
+    """Vista para registrar un horario semanal recurrente."""
+    form = HorarioSemanalForm()
+    form.centro_medico_id.choices = _centros_del_medico()
     
-    pacientes_ids = [p[0] for p in pacientes_ids]
+    if not form.validate_on_submit():
+        flash('Por favor revise los datos del horario semanal.', 'danger')
+        return redirect(url_for('medico.horarios'))
     
-    # Obtener información de los pacientes
-    pacientes = Paciente.query.filter(Paciente.usuario_id.in_(pacientes_ids)).all()
+    medico_id = current_user.medico.usuario_id
     
-    # Para cada paciente, obtener la última consulta
-    pacientes_data = []
-    for paciente in pacientes:
-        ultima_cita = Cita.query.filter_by(
-            medico_id=current_user.medico.usuario_id,
-            paciente_id=paciente.usuario_id,
-            estado='completada'
-        ).order_by(Cita.fecha_hora.desc()).first()
-        
-        ultima_consulta = None
-        if ultima_cita:
-            ultima_consulta = Consulta.query.filter_by(cita_id=ultima_cita.id).first()
+    # Horarios activos del médico en los días seleccionados, para detectar solapamientos
+    dias = [int(d) for d in form.dias_semana.data]
+    existentes = HorarioMedico.query.filter(
+        HorarioMedico.medico_id == medico_id,
+        HorarioMedico.activo == True,
+        HorarioMedico.dia_semana.in_(dias)
+    ).all()
+    
+    creados = 0
+    conflictos = 0
+    for dia in dias:
+        if any(h.dia_semana == dia and h.hora_inicio < form.hora_fin.data and form.hora_inicio.data < h.hora_fin
+               for h in existentes):
+            conflictos += 1
+            continue
         
-        pacientes_data.append({
-            'paciente': paciente,
-            'ultima_cita': ultima_cita,
-            'ultima_consulta': ultima_consulta
-        })
+        db.session.add(HorarioMedico(
+            medico_id=medico_id,
+            centro_medico_id=form.centro_medico_id.data,
+            dia_semana=dia,
+            hora_inicio=form.hora_inicio.data,
+            hora_fin=form.hora_fin.data,
+            intervalo_citas=int(form.intervalo_citas.data)
+        ))
+        creados += 1
+    
+    db.session.commit()
     
-    return render_template('medico/pacientes.html', pacientes_data=pacientes_data)
+    if creados:
+        flash(f'Horario semanal registrado para {creados} día(s).', 'success')
+    if conflictos:
+        flash(f'{conflictos} día(s) omitidos por solaparse con otro horario semanal.', 'warning')
+    
+    return redirect(url_for('medico.horarios'))
+
+@medico_bp.route('/eliminar-horario-semanal/<int:horario_id>', methods=['POST'])
+@login_required
+@medico_required
+def eliminar_horario_semanal(horario_id):
+    """Vista para desactivar un horario semanal recurrente."""
+    horario = HorarioMedico.query.get_or_404(horario_id)
+    
+    if horario.medico_id != current_user.medico.usuario_id:
+        flash('No tiene permiso para eliminar este horario.', 'danger')
+        return redirect(url_for('medico.horarios'))
+    
+    # Las citas ya agendadas se conservan; solo dejan de ofrecerse nuevos turnos
+    horario.activo = False
+    db.session.commit()
+    
+    flash('Horario semanal eliminado exitosamente.', 'success')
+    return redirect(url_for('medico.horarios'))
+
+@medico_bp.route('/excepcion-horario', methods=['POST'])
+@login_required
+@medico_required
+def registrar_excepcion():
+    """Vista para bloquear un día o un rango de horas en la agenda del médico."""
+    form = ExcepcionHorarioForm()
+    form.centro_medico_id.choices = [(0, 'Todos los centros')] + _centros_del_medico()
+    
+    if not form.validate_on_submit():
+        flash('Por favor revise los datos del bloqueo.', 'danger')
+        return redirect(url_for('medico.horarios'))
+    
+    excepcion = ExcepcionHorario(
+        medico_id=current_user.medico.usuario_id,
+        centro_medico_id=form.centro_medico_id.data or None,
+        fecha=form.fecha.data,
+        hora_inicio=form.hora_inicio.data,
+        hora_fin=form.hora_fin.data,
+        tipo='bloqueo',
+        motivo=form.motivo.data
+    )
+    
+    db.session.add(excepcion)
+    db.session.commit()
+    
+    flash('Bloqueo registrado exitosamente. Las citas ya agendadas en ese horario se conservan.', 'success')
+    return redirect(url_for('medico.horarios'))
+
+@medico_bp.route('/eliminar-excepcion/<int:excepcion_id>', methods=['POST'])
+@login_required
+@medico_required
+def eliminar_excepcion(excepcion_id):
+    """Vista para eliminar un bloqueo de la agenda del médico."""
+    excepcion = ExcepcionHorario.query.get_or_404(excepcion_id)
+    
+    # Los feriados generales (sin médico) solo los administra el administrador
+    if excepcion.medico_id != current_user.medico.usuario_id:
+        flash('No tiene permiso para eliminar este bloqueo.', 'danger')
+        return redirect(url_for('medico.horarios'))
+    
+    db.session.delete(excepcion)
+    db.session.commit()
+    
+    flash('Bloqueo eliminado exitosamente.', 'success')
+    return redirect(url_for('medico.horarios'))
+
+@medico_bp.route('/pacientes')
+@login_required
+@medico_required
+def pacientes():
+    """Vista para listar los pacientes atendidos por el médico."""
+    # Numerar las citas completadas de cada paciente desde la más reciente
+    citas_numeradas = db.session.query(
+        Cita.id.label('cita_id'),
+        db.func.row_number().over(
+            partition_by=Cita.paciente_id,
+            order_by=(Cita.fecha_hora.desc(), Cita.id.desc())
+        ).label('orden')
+    ).filter(
+        Cita.medico_id == current_user.medico.usuario_id,
+        Cita.estado == 'completada'
+    ).subquery()
+    
+    # Última cita de cada paciente con el paciente y su consulta; hay una fila
+    # por paciente, por lo que (fecha de la cita, paciente) identifica la fila
+    # y la página se busca por clave en lugar de saltar filas con OFFSET
+    query = Cita.query.join(
+        citas_numeradas, citas_numeradas.c.cita_id == Cita.id
+    ).filter(
+        citas_numeradas.c.orden == 1
+    ).options(
+        joinedload(Cita.paciente).joinedload(Paciente.usuario),
+        selectinload(Cita.consulta)
+    )
+    pagina = paginar_keyset(query, [(Cita.fecha_hora, True), (Cita.paciente_id, True)],
+                            request.args.get('cursor'),
+                            por_pagina=current_app.config.get('PATIENTS_PER_PAGE', 50))
+    
+    pacientes_data = [
+        {'paciente': cita.paciente, 'ultima_cita': cita, 'ultima_consulta': cita.consulta}
+        for cita in pagina
+    ]
+    
+    return render_template('medico/pacientes.html', pacientes_data=pacientes_data, pagina=pagina)
 
 @medico_bp.route('/paciente/<int:paciente_id>')
 @login_required
@@ -216,10 +381,11 @@ def pacientes():
 def ver_paciente(paciente_id):
     """Vista para ver la información de un paciente."""
     # Obtener el paciente
-    paciente = Paciente.query.get_or_404(paciente_id)
+    paciente = Paciente.query.options(joinedload(Paciente.usuario)).filter_by(
+        usuario_id=paciente_id).first_or_404()
     
     # Verificar que el médico ha atendido a este paciente
-    ha_atendido = Cita.query.filter_by(
+    ha_atendido = Cita.query.with_entities(Cita.id).filter_by(
         medico_id=current_user.medico.usuario_id,
         paciente_id=paciente.usuario_id,
         estado='completada'
@@ -229,37 +395,56 @@ def ver_paciente(paciente_id):
         flash('No tiene permiso para ver la información de este paciente.', 'danger')
         return redirect(url_for('medico.pacientes'))
     
-    # Obtener historial de citas
-    citas = Cita.query.filter_by(
-        medico_id=current_user.medico.usuario_id,
-        paciente_id=paciente.usuario_id
-    ).order_by(Cita.fecha_hora.desc()).all()
-    
-    # Obtener consultas
-    consultas = []
-    for cita in citas:
-        consulta = Consulta.query.filter_by(cita_id=cita.id).first()
-        if consulta:
-            consultas.append(consulta)
-    
-    # Obtener recetas emitidas
-    recetas = RecetaMedica.query.filter_by(
-        medico_id=current_user.medico.usuario_id,
-        paciente_id=paciente.usuario_id
-    ).order_by(RecetaMedica.fecha_emision.desc()).all()
+    # Cantidad máxima de filas por sección
+    limite = current_app.config.get('PATIENT_HISTORY_LIMIT', 50)
     
-    # Obtener órdenes emitidas
-    ordenes = OrdenLaboratorio.query.filter_by(
-        medico_id=current_user.medico.usuario_id,
-        paciente_id=paciente.usuario_id
-    ).order_by(OrdenLaboratorio.fecha_emision.desc()).all()
+    # Obtener historial de citas (las más recientes), paginado y con sus consultas
+    citas = db.paginate(
+        db.select(Cita).options(joinedload(Cita.centro_medico), selectinload(Cita.consulta)).filter_by(
+            medico_id=current_user.medico.usuario_id,
+            paciente_id=paciente.usuario_id
+        ).order_by(Cita.fecha_hora.desc(), Cita.id.desc()),
+        page=request.args.get('pagina_citas', 1, type=int),
+        per_page=limite,
+        max_per_page=limite,
+        error_out=False
+    )
+    
+    consultas = [cita.consulta for cita in citas.items if cita.consulta]
     
-    return render_template('medico/ver_paciente.html',
+    # Obtener recetas emitidas, paginadas y con sus medicamentos
+    recetas = db.paginate(
+        db.select(RecetaMedica).options(selectinload(RecetaMedica.medicamentos)).filter_by(
+            medico_id=current_user.medico.usuario_id,
+            paciente_id=paciente.usuario_id
+        ).order_by(RecetaMedica.fecha_emision.desc()),
+        page=request.args.get('pagina_recetas', 1, type=int),
+        per_page=limite,
+        max_per_page=limite,
+        error_out=False
+    )
+    
+    # Obtener órdenes emitidas, paginadas y con sus exámenes
+    ordenes = db.paginate(
+        db.select(OrdenLaboratorio).options(selectinload(OrdenLaboratorio.examenes)).filter_by(
+            medico_id=current_user.medico.usuario_id,
+            paciente_id=paciente.usuario_id
+        ).order_by(OrdenLaboratorio.fecha_emision.desc()),
+        page=request.args.get('pagina_ordenes', 1, type=int),
+        per_page=limite,
+        max_per_page=limite,
+        error_out=False
+    )
+    
+    return render_template('medico/historial_paciente.html',
                          paciente=paciente,
-                         citas=citas,
+                         citas=citas.items,
+                         paginacion_citas=citas,
                          consultas=consultas,
-                         recetas=recetas,
-                         ordenes=ordenes)
+                         recetas=recetas.items,
+                         ordenes=ordenes.items,
+                         paginacion_recetas=recetas,
+                         paginacion_ordenes=ordenes)
 
 @medico_bp.route('/eliminar-disponibilidad/<int:disponibilidad_id>', methods=['POST'])
 @login_required
@@ -306,13 +491,14 @@ def eliminar_disponibilidad(disponibilidad_id):
 @medico_bp.route('/consultas')
 @login_required
 @medico_required
+@limite_consultas(3)
 def consultas():
     """Vista para listar las consultas realizadas por el médico."""
     # Obtener parámetros de filtro
     estado = request.args.get('estado', 'todas')
     
     # Consulta base
-    query = Consulta.query.join(Consulta.cita).filter(
+    query = Consulta.query.options(*perfil_carga('consulta_lista')).join(Consulta.cita).filter(
         Cita.medico_id == current_user.medico.usuario_id
     )
     
@@ -327,11 +513,13 @@ def consultas():
         # Consultas finalizadas
         query = query.filter(Consulta.fecha_fin != None)
     
-    # Ordenar
-    consultas = query.order_by(Consulta.fecha_inicio.desc()).all()
+    # Ordenar por la fecha de la cita (no nula e indexada) y paginar
+    pagina = paginar_keyset(query, [(Cita.fecha_hora, True), (Consulta.id, True)],
+                            request.args.get('cursor'))
     
     return render_template('medico/consultas.html', 
-                         consultas=consultas, 
+                         consultas=pagina.items, 
+                         pagina=pagina,
                          estado_actual=estado)
 
 @medico_bp.route('/iniciar-consulta/<int:cita_id>', methods=['GET', 'POST'])
@@ -347,19 +535,25 @@ def iniciar_consulta(cita_id):
 @medico_required
 def recetas():
     """Vista para listar las recetas emitidas por el médico."""
-    # Obtener todas las recetas emitidas por el médico
-    recetas = RecetaMedica.query.filter_by(medico_id=current_user.medico.usuario_id)\
-                        .order_by(RecetaMedica.fecha_emision.desc()).all()
-    
-    return render_template('medico/recetas.html', recetas=recetas)
+    # Obtener las recetas emitidas por el médico, paginadas
+    query = RecetaMedica.query.options(*perfil_carga('receta_lista')).filter_by(
+        medico_id=current_user.medico.usuario_id)
+    pagina = paginar_keyset(query,
+                            [(RecetaMedica.fecha_emision, True), (RecetaMedica.id, True)],
+                            request.args.get('cursor'))
+    
+    return render_template('medico/recetas.html', recetas=pagina.items, pagina=pagina)
 
 @medico_bp.route('/ordenes')
 @login_required
 @medico_required
 def ordenes():
     """Vista para listar las órdenes de laboratorio emitidas por el médico."""
-    # Obtener todas las órdenes emitidas por el médico
-    ordenes = OrdenLaboratorio.query.filter_by(medico_id=current_user.medico.usuario_id)\
-                              .order_by(OrdenLaboratorio.fecha_emision.desc()).all()
-    
-    return render_template('medico/ordenes.html', ordenes=ordenes)
\ No newline at end of file
+    # Obtener las órdenes emitidas por el médico, paginadas
+    query = OrdenLaboratorio.query.options(*perfil_carga('orden_lista')).filter_by(
+        medico_id=current_user.medico.usuario_id)
+    pagina = paginar_keyset(query,
+                            [(OrdenLaboratorio.fecha_emision, True), (OrdenLaboratorio.id, True)],
+                            request.args.get('cursor'))
+    
+    return render_template('medico/ordenes.html', ordenes=pagina.items, pagina=pagina)
\ No newline at end of file
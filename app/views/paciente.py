@@ -2,12 +2,16 @@ from flask import Blueprint, render_template, redirect, url_for, flash, request,
 from flask_login import login_required, current_user
 from datetime import datetime, date, timedelta
 
-from app.models.tipos_usuario import Paciente, Medico, Especialidad, CentroMedico
+from app.models.tipos_usuario import Paciente, Medico, Especialidad
+from app.models.centro_medico import CentroMedico
 from app.models.cita import Cita
 from app.models.documentos import RecetaMedica, OrdenLaboratorio
 from app.forms.cita import AgendarCitaForm, BuscarHorariosForm, CancelarCitaForm, ReprogramarCitaForm
 from app.extensions import db
 from app.utils.decorators import paciente_required
+from app.utils.consultas import limite_consultas
+from app.utils.perfiles_carga import perfil_carga
+from app.utils.paginacion import paginar_keyset
 
 # Crear el blueprint de paciente
 paciente_bp = Blueprint('paciente', __name__)
@@ -54,13 +58,15 @@ def inicio():
 @paciente_bp.route('/citas')
 @login_required
 @paciente_required
+@limite_consultas(3)
 def citas():
     """Vista para listar todas las citas del paciente."""
     # Obtener parámetros de filtro
     estado = request.args.get('estado', 'todas')
     
     # Consulta base
-    query = Cita.query.filter_by(paciente_id=current_user.paciente.usuario_id)
+    query = Cita.query.options(*perfil_carga('cita_lista')).filter_by(
+        paciente_id=current_user.paciente.usuario_id)
     
     # Aplicar filtros
     if estado == 'proximas':
@@ -137,22 +143,28 @@ def historial():
 @paciente_required
 def recetas():
     """Vista para listar las recetas del paciente."""
-    # Obtener todas las recetas del paciente
-    recetas = RecetaMedica.query.filter_by(paciente_id=current_user.paciente.usuario_id)\
-                        .order_by(RecetaMedica.fecha_emision.desc()).all()
-    
-    return render_template('paciente/recetas.html', recetas=recetas)
+    # Obtener las recetas del paciente, paginadas
+    query = RecetaMedica.query.options(*perfil_carga('receta_lista')).filter_by(
+        paciente_id=current_user.paciente.usuario_id)
+    pagina = paginar_keyset(query,
+                            [(RecetaMedica.fecha_emision, True), (RecetaMedica.id, True)],
+                            request.args.get('cursor'))
+    
+    return render_template('paciente/recetas.html', recetas=pagina.items, pagina=pagina)
 
 @paciente_bp.route('/ordenes')
 @login_required
 @paciente_required
 def ordenes():
     """Vista para listar las órdenes de laboratorio del paciente."""
-    # Obtener todas las órdenes del paciente
-    ordenes = OrdenLaboratorio.query.filter_by(paciente_id=current_user.paciente.usuario_id)\
-                              .order_by(OrdenLaboratorio.fecha_emision.desc()).all()
-    
-    return render_template('paciente/ordenes.html', ordenes=ordenes)
+    # Obtener las órdenes del paciente, paginadas
+    query = OrdenLaboratorio.query.options(*perfil_carga('orden_lista')).filter_by(
+        paciente_id=current_user.paciente.usuario_id)
+    pagina = paginar_keyset(query,
+                            [(OrdenLaboratorio.fecha_emision, True), (OrdenLaboratorio.id, True)],
+                            request.args.get('cursor'))
+    
+    return render_template('paciente/ordenes.html', ordenes=pagina.items, pagina=pagina)
 
 @paciente_bp.route('/perfil-medico/<int:medico_id>')
 @login_required
@@ -0,0 +1,132 @@
+import os
+from datetime import date, datetime, timedelta
+
+import pytest
+
+# Base de datos en memoria (debe definirse antes de importar la configuración)
+os.environ.setdefault('TEST_DATABASE_URL', 'sqlite://')
+
+from app import create_app
+from app.extensions import db, login_manager
+from app.models.usuario import Usuario, Rol
+from app.models.tipos_usuario import (Medico, Paciente, AdministradorCentro, AdministradorSistema,
+                                      Especialidad, medicos_centros)
+from app.models.centro_medico import CentroMedico
+from app.models.cita import Cita
+from app.models.consulta import Consulta
+from app.utils.cache_identidad import cache_identidad
+from app.utils.cache_paneles import cache_paneles
+
+
+@pytest.fixture
+def app():
+    """Aplicación de pruebas con la base de datos creada y un contexto activo."""
+    app = create_app('testing')
+    # Sin cachés entre pruebas (los identificadores se repiten en cada base nueva)
+    # y sin cupo diario, para crear muchas citas del mismo día
+    app.config.update(IDENTITY_CACHE_SECONDS=0, DASHBOARD_CACHE_SECONDS=0,
+                      MAX_APPOINTMENTS_PER_DOCTOR_DAY=None)
+    
+    with app.app_context():
+        yield app
+        db.session.remove()
+        db.drop_all()
+    
+    cache_paneles.invalidar()
+    cache_identidad.invalidar()
+
+
+@pytest.fixture
+def client(app):
+    """Cliente de pruebas de la aplicación."""
+    return app.test_client()
+
+
+def crear_usuario(documento, rol):
+    """Crea un usuario con un rol (la contraseña no se usa en las pruebas)."""
+    # Sin autoflush: los usuarios creados antes todavía no están en la sesión
+    with db.session.no_autoflush:
+        rol = Rol.query.filter_by(nombre=rol).one()
+    usuario = Usuario(
+        numero_documento=documento,
+        tipo_documento='CC',
+        nombre=f'Nombre {documento}',
+        apellido='Apellido',
+        fecha_nacimiento=date(1985, 1, 1),
+        genero='otro',
+        email=f'{documento}@ejemplo.com',
+        password_hash='sin-uso'
+    )
+    usuario.roles.append(rol)
+    return usuario
+
+
+@pytest.fixture
+def datos(app):
+    """Identificadores del centro, el médico, el paciente y los administradores para las vistas."""
+    especialidad = Especialidad.query.first()
+    centro = CentroMedico(nombre='Centro de pruebas', tipo='Clínica', direccion='Calle 1',
+                          ciudad='Ciudad', departamento='Departamento', telefono='5550000')
+    db.session.add(centro)
+    db.session.flush()
+    
+    medico = Medico(usuario=crear_usuario('medico', 'medico'), numero_licencia='LIC-1',
+                    especialidad_id=especialidad.id, titulo_profesional='Médico')
+    paciente = Paciente(usuario=crear_usuario('paciente', 'paciente'))
+    admin_centro = AdministradorCentro(usuario=crear_usuario('admin-centro', 'administrador_centro'),
+                                       centro_medico_id=centro.id)
+    db.session.add_all([medico, paciente, admin_centro])
+    db.session.flush()
+    
+    db.session.execute(medicos_centros.insert().values(
+        medico_id=medico.usuario_id, centro_medico_id=centro.id, fecha_inicio=date.today()))
+    db.session.commit()
+    
+    # Solo identificadores: las pruebas vacían la sesión antes de medir
+    return {
+        'especialidad': especialidad.id,
+        'centro': centro.id,
+        'medico': medico.usuario_id,
+        'paciente': paciente.usuario_id,
+        'admin_centro': admin_centro.usuario_id,
+        'admin': AdministradorSistema.query.first().usuario_id,
+    }
+
+
+def crear_citas(datos, cantidad, desde=0, con_consulta=True):
+    """
+    Crea citas del día, cada 3 minutos desde las 8:00, entre el médico y el paciente de prueba.
+    
+    Args:
+        datos: Diccionario de la fixture datos
+        cantidad: Cantidad de citas
+        desde: Posición de la primera cita (para agregar citas a las ya creadas)
+        con_consulta: Si es True cada cita tiene su consulta
+    """
+    inicio = datetime.combine(date.today(), datetime.min.time()) + timedelta(hours=8)
+    citas = [
+        Cita(paciente_id=datos['paciente'], medico_id=datos['medico'],
+             centro_medico_id=datos['centro'], especialidad_id=datos['especialidad'],
+             fecha_hora=inicio + timedelta(minutes=3 * i), tipo='presencial', estado='pendiente',
+             motivo=f'Motivo {i}')
+        for i in range(desde, desde + cantidad)
+    ]
+    db.session.add_all(citas)
+    db.session.flush()
+    
+    if con_consulta:
+        db.session.add_all([Consulta(cita_id=cita.id, fecha_inicio=cita.fecha_hora,
+                                     motivo_consulta=cita.motivo) for cita in citas])
+    db.session.commit()
+
+
+def iniciar_sesion(client, usuario_id):
+    """Autentica al usuario en el cliente de pruebas sin pasar por el formulario."""
+    # Identificador de la sesión exigido por session_protection = 'strong'
+    with client.application.test_request_context(environ_base=client.environ_base):
+        identificador = login_manager._session_identifier_generator()
+    
+    with client.session_transaction() as sesion:
+        sesion['_user_id'] = str(usuario_id)
+        sesion['_fresh'] = True
+        sesion['_id'] = identificador
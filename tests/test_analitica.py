@@ -0,0 +1,80 @@
+from datetime import date, timedelta
+
+import pytest
+
+from app.extensions import db
+from app.models.cita import Cita
+from app.models.consulta import Consulta
+from app.utils.analitica import DIAS_SEMANA, analizar_cancelaciones, analizar_duraciones
+
+from conftest import crear_citas, iniciar_sesion
+
+
+@pytest.fixture
+def consultas_finalizadas(app, datos):
+    """Diez consultas finalizadas de 10 a 100 minutos sobre citas de 30 minutos."""
+    crear_citas(datos, 10)
+    for indice, consulta in enumerate(Consulta.query.order_by(Consulta.id)):
+        consulta.fecha_fin = consulta.fecha_inicio
+        consulta.duracion_minutos = 10 * (indice + 1)
+    db.session.commit()
+
+
+def test_percentiles_de_duracion_calculados_en_la_base(datos, consultas_finalizadas):
+    resultado = analizar_duraciones(datos['centro'], date.today(), date.today())
+    
+    esperado = {'consultas': 10, 'media': 55.0, 'p50': 55.0, 'p90': 91.0, 'p99': 99.1,
+                'duracion_reservada_media': 30.0, 'tasa_exceso': 0.7}
+    assert resultado['general'] == esperado
+    assert resultado['por_medico'] == [
+        {'medico_id': datos['medico'], 'medico': 'Nombre medico Apellido', **esperado}]
+    assert [grupo['especialidad_id'] for grupo in resultado['por_especialidad']] == [datos['especialidad']]
+
+
+def test_sin_consultas_finalizadas(datos):
+    crear_citas(datos, 2)
+    
+    assert analizar_duraciones(datos['centro']) == {'general': None, 'por_medico': [], 'por_especialidad': []}
+
+
+def test_pagina_de_estadisticas_muestra_las_duraciones(client, datos, consultas_finalizadas):
+    iniciar_sesion(client, datos['admin_centro'])
+    
+    html = client.get('/admin-centro/estadisticas').get_data(as_text=True)
+    
+    assert 'Duración de las Consultas' in html
+    assert 'Nombre medico Apellido' in html
+    assert '99.1 min' in html and '70.0%' in html
+
+
+def test_cancelaciones_agrupadas_en_la_base(datos):
+    crear_citas(datos, 4, con_consulta=False)
+    citas = Cita.query.order_by(Cita.id).all()
+    citas[0].estado, citas[0].cancelado_por = 'cancelada', datos['paciente']
+    citas[1].estado = 'confirmada'
+    db.session.commit()
+    
+    # Dos horas después de la última cita: las tres no canceladas ya vencieron
+    ahora = citas[-1].fecha_hora + timedelta(hours=2)
+    resultado = analizar_cancelaciones(datos['centro'], ahora=ahora)
+    
+    general = {'citas': 4, 'canceladas': 1, 'tasa_cancelacion': 0.25,
+               'citas_vencidas': 3, 'no_asistidas': 1, 'tasa_inasistencia': 0.333}
+    assert resultado['general'] == general
+    assert resultado['por_medico'] == [{'id': datos['medico'], 'nombre': 'Nombre medico Apellido', **general}]
+    dia = date.today().weekday()
+    assert [(grupo['id'], grupo['nombre']) for grupo in resultado['por_dia_semana']] == [(dia, DIAS_SEMANA[dia])]
+    assert [(grupo['id'], grupo['canceladas']) for grupo in resultado['por_cancelado_por']] == [('paciente', 1)]
+
+
+def test_pagina_de_estadisticas_muestra_las_cancelaciones(client, datos):
+    crear_citas(datos, 4, con_consulta=False)
+    Cita.query.first().estado = 'cancelada'
+    db.session.commit()
+    iniciar_sesion(client, datos['admin_centro'])
+    
+    html = client.get('/admin-centro/estadisticas').get_data(as_text=True)
+    
+    texto = ' '.join(html.split())
+    assert 'Cancelaciones e Inasistencias' in texto
+    assert '4 citas en el período: 1 canceladas (25.0%)' in texto
@@ -0,0 +1,21 @@
+import click
+import pytest
+
+from app import sirve_solicitudes
+
+
+@pytest.mark.parametrize('comando, esperado', [('run', True), ('enviar-recordatorios', False), (None, False)])
+def test_bajo_la_linea_de_comandos_solo_flask_run_sirve_solicitudes(monkeypatch, comando, esperado):
+    monkeypatch.setenv('FLASK_RUN_FROM_CLI', 'true')
+    
+    if comando is None:
+        assert sirve_solicitudes() is esperado
+    else:
+        with click.Context(click.Command(comando), info_name=comando):
+            assert sirve_solicitudes() is esperado
+
+
+def test_fuera_de_la_linea_de_comandos_sirve_solicitudes(monkeypatch):
+    monkeypatch.delenv('FLASK_RUN_FROM_CLI', raising=False)
+    
+    assert sirve_solicitudes()
@@ -0,0 +1,16 @@
+from app.extensions import db
+from app.models.busqueda import IndiceBusqueda
+from app.utils import busqueda
+from app.utils.inicializador import completar_indice_busqueda
+
+
+def test_reconstruir_el_indice_repite_la_deteccion_de_fts(app, datos):
+    # Un proceso que verificó antes de que existiera la tabla FTS5
+    busqueda._fts_disponible[str(db.engine.url)] = False
+    IndiceBusqueda.query.delete()
+    db.session.commit()
+    
+    assert completar_indice_busqueda()
+    
+    assert str(db.engine.url) not in busqueda._fts_disponible
+    assert busqueda._usa_fts(db.session)
@@ -0,0 +1,85 @@
+import logging
+
+import pytest
+from flask import g
+
+from app.extensions import db
+from app.models.usuario import Usuario
+from app.utils.consultas import contar_consultas, limite_consultas
+
+from conftest import crear_citas, iniciar_sesion
+
+# Vistas con límite de consultas: (usuario que la visita, URL)
+VISTAS_LIMITADAS = [
+    ('admin', '/admin/estadisticas'),
+    ('medico', '/medico/'),
+    ('medico', '/medico/citas'),
+    ('paciente', '/paciente/citas'),
+    ('admin_centro', '/admin-centro/citas'),
+]
+
+
+def consultas_de_solicitud(client, url):
+    """
+    Cuenta las consultas SQL de una solicitud, incluida la carga del usuario.
+    
+    La solicitud comparte el contexto de la aplicación con la prueba; antes
+    se vacían la sesión y el usuario autenticado de g para que no reutilice
+    objetos cargados por la preparación o por una solicitud anterior.
+    """
+    db.session.expunge_all()
+    g.pop('_login_user', None)
+    with contar_consultas() as contador:
+        respuesta = client.get(url)
+    assert respuesta.status_code == 200, url
+    return contador.cantidad
+
+
+def test_contar_consultas_anidado(app):
+    with contar_consultas() as externo:
+        db.session.query(Usuario).count()
+        with contar_consultas() as interno:
+            db.session.query(Usuario).first()
+    
+    assert interno.cantidad == 1
+    assert externo.cantidad == 2
+
+
+def test_limite_consultas_solo_registra_advertencia(app, caplog):
+    @limite_consultas(1)
+    def vista():
+        db.session.query(Usuario).count()
+        db.session.query(Usuario).first()
+        return 'ok'
+    
+    with caplog.at_level(logging.WARNING):
+        assert vista() == 'ok'
+    
+    assert 'vista ejecutó 2 consultas SQL (máximo 1)' in caplog.text
+
+
+@pytest.mark.parametrize('rol, url', VISTAS_LIMITADAS)
+def test_vistas_dentro_del_limite(client, datos, caplog, rol, url):
+    crear_citas(datos, 5)
+    iniciar_sesion(client, datos[rol])
+    
+    with caplog.at_level(logging.WARNING):
+        consultas_de_solicitud(client, url)
+    
+    assert 'consultas SQL' not in caplog.text
+
+
+@pytest.mark.parametrize('rol, url', VISTAS_LIMITADAS)
+def test_consultas_no_dependen_de_las_filas(client, datos, caplog, rol, url):
+    """Con 200 citas (y sus consultas) la vista ejecuta las mismas consultas que con una."""
+    iniciar_sesion(client, datos[rol])
+    
+    crear_citas(datos, 1)
+    con_una = consultas_de_solicitud(client, url)
+    
+    crear_citas(datos, 199, desde=1)
+    with caplog.at_level(logging.WARNING):
+        con_doscientas = consultas_de_solicitud(client, url)
+    
+    assert con_doscientas == con_una
+    assert 'consultas SQL' not in caplog.text
@@ -0,0 +1,77 @@
+from datetime import date, time, timedelta
+
+from app.extensions import db
+from app.models.cita import Disponibilidad
+from app.models.tipos_usuario import HorarioMedico, ExcepcionHorario
+from app.utils.agenda import registrar_disponibilidades
+
+from conftest import iniciar_sesion
+
+
+def test_panel_muestra_formularios_de_horario_semanal_y_bloqueos(client, datos):
+    iniciar_sesion(client, datos['medico'])
+    
+    html = client.get('/medico/horarios').get_data(as_text=True)
+    
+    assert 'action="/medico/horario-semanal"' in html
+    assert 'action="/medico/excepcion-horario"' in html
+    assert 'action="/cita/disponibilidad"' in html
+
+
+def test_registrar_y_eliminar_horario_semanal(client, datos):
+    iniciar_sesion(client, datos['medico'])
+    
+    respuesta = client.post('/medico/horario-semanal', data={
+        'centro_medico_id': datos['centro'],
+        'dias_semana': ['0', '2'],
+        'hora_inicio': '08:00',
+        'hora_fin': '12:00',
+        'intervalo_citas': '30',
+    })
+    assert respuesta.status_code == 302
+    
+    horarios = HorarioMedico.query.filter_by(medico_id=datos['medico'], activo=True).all()
+    assert sorted(h.dia_semana for h in horarios) == [0, 2]
+    
+    html = client.get('/medico/horarios').get_data(as_text=True)
+    assert 'Lunes' in html and '08:00 - 12:00' in html
+    
+    client.post(f'/medico/eliminar-horario-semanal/{horarios[0].id}')
+    assert HorarioMedico.query.filter_by(medico_id=datos['medico'], activo=True).count() == 1
+
+
+def test_registrar_y_eliminar_bloqueo(client, datos):
+    iniciar_sesion(client, datos['medico'])
+    manana = date.today() + timedelta(days=1)
+    
+    client.post('/medico/excepcion-horario', data={
+        'centro_medico_id': 0,
+        'fecha': manana.isoformat(),
+        'hora_inicio': '09:00',
+        'hora_fin': '10:00',
+        'motivo': 'Congreso',
+    })
+    
+    excepcion = ExcepcionHorario.query.filter_by(medico_id=datos['medico']).one()
+    assert (excepcion.hora_inicio, excepcion.hora_fin, excepcion.centro_medico_id) == (time(9), time(10), None)
+    assert 'Congreso' in client.get('/medico/horarios').get_data(as_text=True)
+    
+    client.post(f'/medico/eliminar-excepcion/{excepcion.id}')
+    assert ExcepcionHorario.query.filter_by(medico_id=datos['medico']).count() == 0
+
+
+def test_disponibilidad_por_fecha_no_se_solapa_con_el_horario_semanal(app, datos):
+    lunes = date.today() + timedelta(days=7 - date.today().weekday())
+    db.session.add(HorarioMedico(medico_id=datos['medico'], centro_medico_id=datos['centro'],
+                                 dia_semana=0, hora_inicio=time(8), hora_fin=time(12), intervalo_citas=30))
+    db.session.commit()
+    
+    def registrar(hora_inicio, hora_fin):
+        return registrar_disponibilidades(datos['medico'], datos['centro'], lunes, lunes + timedelta(days=1),
+                                          [0, 1], time(hora_inicio), time(hora_fin), 30)
+    
+    # El martes no tiene horario semanal; el lunes se cruza con él o lo repite
+    # (el martes de la segunda vez se cruza con el registrado la primera)
+    assert registrar(10, 14) == {'creados': 1, 'omitidos': 0, 'conflictos': 1}
+    assert registrar(8, 12) == {'creados': 0, 'omitidos': 1, 'conflictos': 1}
+    assert Disponibilidad.query.filter_by(fecha=lunes).count() == 0
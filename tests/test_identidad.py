@@ -0,0 +1,44 @@
+from app.extensions import db
+from app.models.usuario import Usuario
+from app.utils.cache_identidad import cache_identidad
+from app.utils.cache_paneles import cache_paneles
+from app.utils.consultas import contar_consultas
+from app.utils.identidad import cargar_usuario
+
+
+def cargar_en_sesion_nueva(usuario_id):
+    """Carga el usuario como lo haría una solicitud nueva y cuenta sus consultas."""
+    db.session.expunge_all()
+    with contar_consultas() as contador:
+        usuario = cargar_usuario(usuario_id)
+    return usuario, contador.cantidad
+
+
+def test_identidad_en_su_propia_cache_sin_hash_de_contrasena(app, datos):
+    app.config['IDENTITY_CACHE_SECONDS'] = 30
+    
+    cargar_en_sesion_nueva(datos['medico'])
+    usuario, consultas = cargar_en_sesion_nueva(datos['medico'])
+    
+    assert consultas == 0
+    assert usuario.medico.numero_licencia == 'LIC-1'
+    assert 'password_hash' not in cache_identidad._entradas[datos['medico']][0]['usuario']
+    assert not [clave for clave in cache_paneles._entradas if clave[0] == 'identidad']
+    
+    # El hash se carga de forma diferida si se necesita
+    assert usuario.password_hash == 'sin-uso'
+
+
+def test_identidad_se_invalida_al_modificar_el_usuario_o_su_perfil(app, datos):
+    app.config['IDENTITY_CACHE_SECONDS'] = 30
+    cargar_en_sesion_nueva(datos['medico'])
+    
+    db.session.get(Usuario, datos['medico']).nombre = 'Cambiado'
+    db.session.commit()
+    usuario, consultas = cargar_en_sesion_nueva(datos['medico'])
+    assert consultas == 1 and usuario.nombre == 'Cambiado'
+    
+    usuario.medico.numero_licencia = 'LIC-2'
+    db.session.commit()
+    usuario, consultas = cargar_en_sesion_nueva(datos['medico'])
+    assert consultas == 1 and usuario.medico.numero_licencia == 'LIC-2'
@@ -0,0 +1,107 @@
+import html
+import re
+from datetime import datetime, timedelta
+
+import pytest
+
+from app.extensions import db
+from app.models.cita import Cita
+from app.models.consulta import Consulta
+from app.models.documentos import RecetaMedica, OrdenLaboratorio
+from app.models.tipos_usuario import Paciente
+
+from conftest import crear_citas, crear_usuario, iniciar_sesion
+
+# Listados paginados por clave: (usuario que lo visita, URL)
+LISTADOS_PAGINADOS = [
+    ('medico', '/medico/consultas'),
+    ('medico', '/medico/recetas'),
+    ('medico', '/medico/ordenes'),
+    ('paciente', '/paciente/recetas'),
+    ('paciente', '/paciente/ordenes'),
+    ('paciente', '/documento/recetas'),
+    ('medico', '/documento/ordenes'),
+    ('admin_centro', '/admin-centro/pacientes'),
+]
+
+
+@pytest.fixture
+def documentos(app, datos):
+    """Tres consultas del médico con una receta y una orden cada una, y tres pacientes del centro."""
+    app.config['LIST_PAGE_SIZE'] = 2
+    crear_citas(datos, 3)
+    
+    for i, consulta in enumerate(Consulta.query.all()):
+        comunes = dict(consulta_id=consulta.id, paciente_id=datos['paciente'], medico_id=datos['medico'],
+                       emitido_por=datos['medico'], codigo_validacion=f'COD{i:05d}',
+                       fecha_emision=datetime(2024, 1, 1) + timedelta(days=i))
+        db.session.add(RecetaMedica(diagnostico=f'Diagnóstico {i}', **comunes))
+        db.session.add(OrdenLaboratorio(diagnostico_presuntivo=f'Diagnóstico {i}', **comunes))
+    
+    # Dos pacientes más con citas en el centro
+    inicio = datetime.combine(datetime.today(), datetime.min.time()) + timedelta(days=1, hours=8)
+    for i in range(2):
+        paciente = Paciente(usuario=crear_usuario(f'paciente-{i}', 'paciente'))
+        db.session.add(paciente)
+        db.session.flush()
+        db.session.add(Cita(paciente_id=paciente.usuario_id, medico_id=datos['medico'],
+                            centro_medico_id=datos['centro'], especialidad_id=datos['especialidad'],
+                            fecha_hora=inicio + timedelta(hours=i), tipo='presencial', estado='pendiente'))
+    db.session.commit()
+    return datos
+
+
+def enlace_siguiente(contenido):
+    """Obtiene el enlace a la página siguiente de un listado, o None si no hay."""
+    enlaces = re.findall(r'href="([^"#]*cursor=[^"]*)"\s*>\s*Siguiente', contenido)
+    return html.unescape(enlaces[0]) if enlaces else None
+
+
+@pytest.mark.parametrize('rol, url', LISTADOS_PAGINADOS)
+def test_listado_llega_a_la_segunda_pagina(client, documentos, rol, url):
+    iniciar_sesion(client, documentos[rol])
+    
+    respuesta = client.get(url)
+    assert respuesta.status_code == 200
+    siguiente = enlace_siguiente(respuesta.get_data(as_text=True))
+    assert siguiente is not None
+    
+    respuesta = client.get(siguiente)
+    assert respuesta.status_code == 200
+    contenido = respuesta.get_data(as_text=True)
+    assert enlace_siguiente(contenido) is None
+    assert 'Anterior' in contenido
+
+
+def test_pacientes_del_medico_por_clave(app, client, documentos):
+    """Los tres pacientes con citas completadas se reparten en dos páginas, sin repetirse."""
+    app.config['PATIENTS_PER_PAGE'] = 2
+    Cita.query.update({'estado': 'completada'})
+    db.session.commit()
+    iniciar_sesion(client, documentos['medico'])
+    
+    primera = client.get('/medico/pacientes').get_data(as_text=True)
+    segunda = client.get(enlace_siguiente(primera)).get_data(as_text=True)
+    
+    assert enlace_siguiente(segunda) is None
+    documentos_vistos = re.findall(r'CC (paciente[-\d]*)', primera + segunda)
+    assert sorted(documentos_vistos) == ['paciente', 'paciente-0', 'paciente-1']
+
+
+def test_ficha_del_paciente_pagina_cada_seccion(app, client, documentos):
+    """Cada sección de la ficha tiene su propio paginador y conserva la página de las demás."""
+    app.config['PATIENT_HISTORY_LIMIT'] = 2
+    Cita.query.update({'estado': 'completada'})
+    db.session.commit()
+    iniciar_sesion(client, documentos['medico'])
+    url = f"/medico/paciente/{documentos['paciente']}"
+    
+    contenido = client.get(url).get_data(as_text=True)
+    for parametro in ('pagina_citas', 'pagina_recetas', 'pagina_ordenes'):
+        assert f'{parametro}=2' in contenido
+    
+    respuesta = client.get(url + '?pagina_citas=2&pagina_recetas=2')
+    assert respuesta.status_code == 200
+    contenido = html.unescape(respuesta.get_data(as_text=True))
+    assert 'Página 2 de 2' in contenido
+    assert 'pagina_citas=2&pagina_recetas=2&pagina_ordenes=2' in contenido
@@ -0,0 +1,124 @@
+from datetime import date, datetime, time, timedelta
+
+import pytest
+from flask import g
+
+from app.extensions import db
+from app.models.cita import Cita, RetencionHorario
+from app.models.tipos_usuario import HorarioMedico, Paciente
+from app.utils.inicializador import crear_indices_faltantes
+from app.utils.retencion_horarios import retencion_horarios
+
+from conftest import crear_usuario, iniciar_sesion
+
+MANANA = date.today() + timedelta(days=1)
+
+
+@pytest.fixture
+def horario(app, datos):
+    """Horario semanal del médico en el centro para mañana, de 8:00 a 10:00 cada 30 minutos."""
+    db.session.add(HorarioMedico(medico_id=datos['medico'], centro_medico_id=datos['centro'],
+                                 dia_semana=MANANA.weekday(), hora_inicio=time(8), hora_fin=time(10),
+                                 intervalo_citas=30))
+    db.session.commit()
+
+
+def agendar(client, datos, horario):
+    return client.post('/cita/agendar', data={
+        'especialidad_id': datos['especialidad'],
+        'centro_medico_id': datos['centro'],
+        'medico_id': datos['medico'],
+        'fecha': MANANA.isoformat(),
+        'horario': horario,
+        'tipo': 'primera_vez',
+        'motivo': 'Dolor de cabeza persistente',
+    })
+
+
+def test_agendar_un_horario_ofrecido(client, datos, horario):
+    iniciar_sesion(client, datos['paciente'])
+    
+    agendar(client, datos, '08:30')
+    
+    assert Cita.query.one().fecha_hora == datetime.combine(MANANA, time(8, 30))
+
+
+@pytest.mark.parametrize('hora', ['08:10', '11:00'])
+def test_agendar_rechaza_horarios_no_ofrecidos(client, datos, horario, hora):
+    iniciar_sesion(client, datos['paciente'])
+    
+    respuesta = agendar(client, datos, hora)
+    
+    assert respuesta.status_code == 302
+    assert Cita.query.count() == 0
+
+
+def test_retencion_propia_cuenta_como_libre_y_la_ajena_no(client, datos, horario):
+    otro = Paciente(usuario=crear_usuario('otro', 'paciente'))
+    db.session.add(otro)
+    db.session.commit()
+    retencion_horarios.retener(datos['medico'], datetime.combine(MANANA, time(9)), otro.usuario_id)
+    
+    iniciar_sesion(client, datos['paciente'])
+    agendar(client, datos, '09:00')
+    assert Cita.query.count() == 0
+    
+    # El usuario autenticado queda en g, compartido entre solicitudes en las pruebas
+    g.pop('_login_user', None)
+    iniciar_sesion(client, otro.usuario_id)
+    agendar(client, datos, '09:00')
+    assert Cita.query.one().paciente_id == otro.usuario_id
+
+
+def test_retenciones_en_la_base_de_datos(datos):
+    horario = datetime.combine(MANANA, time(9))
+    otro = Paciente(usuario=crear_usuario('otro', 'paciente'))
+    db.session.add(otro)
+    db.session.commit()
+    
+    assert retencion_horarios.retener(datos['medico'], horario, datos['paciente'])
+    assert not retencion_horarios.retener(datos['medico'], horario, otro.usuario_id)
+    assert retencion_horarios.horarios_retenidos(datos['medico'], excepto_usuario_id=otro.usuario_id) == {horario}
+    
+    # Una nueva retención del usuario reemplaza la anterior
+    assert retencion_horarios.retener(datos['medico'], horario + timedelta(minutes=30), datos['paciente'])
+    assert RetencionHorario.query.one().fecha_hora == horario + timedelta(minutes=30)
+    
+    # Las vencidas se ignoran y se reemplazan
+    assert retencion_horarios.retener(datos['medico'], horario, otro.usuario_id, segundos=-1)
+    assert retencion_horarios.horarios_retenidos(datos['medico']) == {horario + timedelta(minutes=30)}
+    assert retencion_horarios.retener(datos['medico'], horario, datos['paciente'])
+
+
+def test_la_retencion_se_elimina_al_agendar(client, datos, horario):
+    retencion_horarios.retener(datos['medico'], datetime.combine(MANANA, time(9)), datos['paciente'])
+    iniciar_sesion(client, datos['paciente'])
+    
+    agendar(client, datos, '09:00')
+    
+    assert Cita.query.count() == 1
+    assert RetencionHorario.query.count() == 0
+
+
+def test_reprogramar_rechaza_horarios_no_ofrecidos(client, datos, horario):
+    iniciar_sesion(client, datos['paciente'])
+    agendar(client, datos, '08:00')
+    cita_id = Cita.query.one().id
+    
+    datos_formulario = {'fecha': MANANA.isoformat(), 'motivo_reprogramacion': 'Cambio de planes laborales',
+                        'confirmar': 'y', 'cita_id': cita_id}
+    client.post(f'/cita/reprogramar/{cita_id}', data={**datos_formulario, 'horario': '08:45'})
+    assert db.session.get(Cita, cita_id).fecha_hora == datetime.combine(MANANA, time(8))
+    
+    client.post(f'/cita/reprogramar/{cita_id}', data={**datos_formulario, 'horario': '09:30'})
+    db.session.expire_all()
+    assert db.session.get(Cita, cita_id).fecha_hora == datetime.combine(MANANA, time(9, 30))
+
+
+def test_indice_unico_de_citas_activas_se_crea_al_iniciar(app):
+    db.session.execute(db.text('DROP INDEX uq_citas_medico_fecha_hora_activa'))
+    db.session.commit()
+    
+    assert crear_indices_faltantes() == ['uq_citas_medico_fecha_hora_activa']
+    assert 'uq_citas_medico_fecha_hora_activa' in {
+        indice['name'] for indice in db.inspect(db.engine).get_indexes('citas')}